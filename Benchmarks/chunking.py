@@ -0,0 +1,126 @@
+import os
+import json
+import time
+import argparse
+from typing import Any
+
+import numpy as np
+
+from Benchmarks.synthetic_corpus import SyntheticCorpus
+from Benchmarks.run_benchmarks import _environment
+from Services.summarizer import CHUNKERS, genreate_pdf_chunks, load_pdf
+from Utilities.tokenization import get_encoding
+
+# Speed of the single-pass token chunker against RecursiveCharacterTextSplitter, and how often the two
+# cut a page at the same place.
+#   python -m Benchmarks.chunking --pdf-directory Uploads
+# Without --pdf-directory the pages come from the synthetic corpus. Boundaries are the page offsets
+# where chunks end; agreement is the share of the splitter's boundaries the token chunker also cuts at
+# (recall), the share of its own boundaries the splitter shares (precision), and identical chunks.
+
+def _read_pages(args: argparse.Namespace) -> list[Any]:
+    if args.pdf_directory:
+        return load_pdf(args.pdf_directory)[:args.pages]
+
+    from langchain_core.documents import Document
+
+    corpus = SyntheticCorpus(args.pages * 4, seed=args.seed)
+    return [Document(page_content=text, metadata=metadata) for text, metadata in corpus.pages(args.pages)]
+
+def chunk_boundaries(page_text: str, chunk_texts: list[str]) -> list[tuple[int, int]]:
+    # Chunks come in page order and overlap, so each one is searched for after the start of the last
+    spans = []
+    cursor = 0
+    for chunk_text in chunk_texts:
+        start = page_text.find(chunk_text, cursor)
+        if start < 0:
+            continue
+        spans.append((start, start + len(chunk_text)))
+        cursor = start + 1
+    return spans
+
+def measure_chunker(chunker: str, pages: list[Any], args: argparse.Namespace) -> dict[str, Any]:
+
+    # One untimed page so loading the tokenizer and LangChain is not counted
+    genreate_pdf_chunks(pages[:1], model_name=args.model, chunk_size=args.chunk_size,
+                        chunk_size_overlap=args.chunk_overlap, chunker=chunker)
+
+    seconds = []
+    for _ in range(args.repeats):
+        start_time = time.perf_counter()
+        chunks = genreate_pdf_chunks(pages, model_name=args.model, chunk_size=args.chunk_size,
+                                     chunk_size_overlap=args.chunk_overlap, chunker=chunker)
+        seconds.append(time.perf_counter() - start_time)
+
+    encoding = get_encoding(args.model)
+    token_counts = np.asarray([len(encoding.encode(chunk["text"], disallowed_special=())) for chunk in chunks])
+    best = min(seconds)
+    return {"chunker": chunker, "pages": len(pages), "chunks": len(chunks), "best_seconds": best,
+            "median_seconds": float(np.median(seconds)), "pages_per_second": len(pages) / best if best > 0 else float(len(pages)),
+            "mean_tokens": float(token_counts.mean()) if len(chunks) else 0.0,
+            "max_tokens": int(token_counts.max()) if len(chunks) else 0,
+            "over_chunk_size": int((token_counts > args.chunk_size).sum())}
+
+def agreement(pages: list[Any], args: argparse.Namespace) -> dict[str, float]:
+
+    matched, token_total, recursive_total, identical = 0, 0, 0, 0
+    for page in pages:
+        spans = {}
+        for chunker in ("token", "recursive"):
+            chunks = genreate_pdf_chunks([page], model_name=args.model, chunk_size=args.chunk_size,
+                                         chunk_size_overlap=args.chunk_overlap, chunker=chunker)
+            spans[chunker] = chunk_boundaries(page.page_content, [chunk["text"] for chunk in chunks])
+
+        # The last chunk always ends with the page, so it is left out of the boundary counts
+        token_ends = {end for _, end in spans["token"][:-1]}
+        recursive_ends = {end for _, end in spans["recursive"][:-1]}
+        matched += sum(1 for end in recursive_ends
+                       if any(abs(end - token_end) <= args.tolerance for token_end in token_ends))
+        token_total += len(token_ends)
+        recursive_total += len(recursive_ends)
+        identical += len(set(spans["token"]) & set(spans["recursive"]))
+
+    return {"boundary_recall": matched / recursive_total if recursive_total else 1.0,
+            "boundary_precision": matched / token_total if token_total else 1.0,
+            "tolerance_chars": args.tolerance, "identical_chunks": identical,
+            "recursive_boundaries": recursive_total, "token_boundaries": token_total}
+
+def parse_arguments(argv: list[str] | None = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Token-offset chunker against RecursiveCharacterTextSplitter")
+    parser.add_argument("--pdf-directory", default=None, help="chunk the pages of these PDFs instead of synthetic pages")
+    parser.add_argument("--pages", type=int, default=500)
+    parser.add_argument("--model", default=os.getenv("Model", "gpt-5"), help="model whose tiktoken encoding counts the tokens")
+    parser.add_argument("--chunk-size", type=int, default=400)
+    parser.add_argument("--chunk-overlap", type=int, default=50)
+    parser.add_argument("--repeats", type=int, default=3)
+    parser.add_argument("--tolerance", type=int, default=0, help="characters two boundaries may differ by and still agree")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", default=None, help="JSON results file (default data/benchmarks/chunking_<time>.json)")
+    return parser.parse_args(argv)
+
+def main(argv: list[str] | None = None) -> dict[str, Any]:
+
+    args = parse_arguments(argv)
+    output = args.output or os.path.join("data", "benchmarks", f"chunking_{time.strftime('%Y%m%d_%H%M%S')}.json")
+    pages = _read_pages(args)
+
+    results = {chunker: measure_chunker(chunker, pages, args) for chunker in CHUNKERS}
+    report = {"environment": _environment(), "arguments": vars(args), "results": results,
+              "speedup": results["recursive"]["best_seconds"] / results["token"]["best_seconds"]
+                         if results["token"]["best_seconds"] > 0 else None,
+              "agreement": agreement(pages, args)}
+
+    os.makedirs(os.path.dirname(output) or ".", exist_ok=True)
+    with open(output, "w", encoding="utf-8") as output_file:
+        json.dump(report, output_file, indent=2)
+
+    for result in results.values():
+        print(f"{result['chunker']:>10}: {result['pages_per_second']:.0f} pages/s, {result['chunks']} chunks, "
+              f"tokens mean/max {result['mean_tokens']:.0f}/{result['max_tokens']}")
+    print(f"Speed-up {report['speedup']:.2f}x, boundary recall/precision {report['agreement']['boundary_recall']:.3f}/"
+          f"{report['agreement']['boundary_precision']:.3f}, {report['agreement']['identical_chunks']} identical chunks")
+    print(f"Results written to {output}")
+    return report
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,122 @@
+import os
+import json
+import time
+import argparse
+from typing import Any
+
+import numpy as np
+
+from Benchmarks.synthetic_corpus import SyntheticCorpus
+from Benchmarks.run_benchmarks import _environment, _latency_summary, _throughput
+from Services.EmbeddingManager import EMBEDDING_BACKENDS, EmbeddingManager
+
+# Drift and throughput of the optimized embedding backends against the float PyTorch model.
+#   python -m Benchmarks.embedding_backends --backends torch-int8,onnx,onnx-int8
+# Every backend encodes the same chunk texts (ingestion) and short queries one at a time (query path);
+# drift is the cosine between each vector and the float model's vector for the same text.
+
+def _read_texts(args: argparse.Namespace) -> tuple[list[str], list[str]]:
+    if args.texts_file:
+        with open(args.texts_file, "r", encoding="utf-8") as texts_file:
+            texts = [line.strip() for line in texts_file if line.strip()]
+        return texts[:args.texts], texts[:args.queries]
+    corpus = SyntheticCorpus(args.texts, seed=args.seed)
+    return [chunk["text"] for chunk in corpus.chunks(0, args.texts)], corpus.queries(args.queries)
+
+def _normalize(vectors: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    return vectors / np.where(norms > 0, norms, 1.0)
+
+def measure_backend(backend: str, texts: list[str], queries: list[str], args: argparse.Namespace) -> dict[str, Any]:
+
+    start_time = time.perf_counter()
+    embedding_manager = EmbeddingManager(model_name=args.model, backend=backend, num_threads=args.threads,
+                                         batch_size=args.batch_size, onnx_directory=args.onnx_directory)
+    load_seconds = time.perf_counter() - start_time
+
+    # One untimed batch so lazy initialisation is not counted as throughput
+    embedding_manager.generate_embeddings(texts[:args.batch_size])
+
+    start_time = time.perf_counter()
+    text_vectors = embedding_manager.generate_embeddings(texts)
+    ingest_seconds = time.perf_counter() - start_time
+
+    query_seconds = []
+    query_vectors = []
+    for query in queries:
+        start_time = time.perf_counter()
+        query_vectors.append(embedding_manager.generate_query_embedding(query))
+        query_seconds.append(time.perf_counter() - start_time)
+
+    return {"backend": backend, "load_seconds": load_seconds, "ingest": _throughput(len(texts), ingest_seconds),
+            "query": _latency_summary(query_seconds),
+            "text_vectors": np.asarray(text_vectors, dtype=np.float32), "query_vectors": np.vstack(query_vectors)}
+
+def drift(result: dict[str, Any], reference: dict[str, Any], k: int) -> dict[str, float]:
+
+    cosines = np.einsum("ij,ij->i", _normalize(result["text_vectors"]), _normalize(reference["text_vectors"]))
+
+    # What retrieval would notice: how many of the float model's top-k chunks each query still finds
+    def top_k(query_vectors: np.ndarray, text_vectors: np.ndarray) -> np.ndarray:
+        return np.argsort(-(_normalize(query_vectors) @ _normalize(text_vectors).T), axis=1)[:, :k]
+    overlap = [len(set(found) & set(expected)) / k for found, expected in
+               zip(top_k(result["query_vectors"], result["text_vectors"]),
+                   top_k(reference["query_vectors"], reference["text_vectors"]))]
+
+    return {"mean_cosine": float(cosines.mean()), "min_cosine": float(cosines.min()),
+            "p01_cosine": float(np.percentile(cosines, 1)), f"top{k}_overlap": float(np.mean(overlap))}
+
+def parse_arguments(argv: list[str] | None = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Embedding drift and throughput of the optimized backends against the float model")
+    parser.add_argument("--backends", default="torch-int8,onnx,onnx-int8", help=f"comma separated, of {', '.join(EMBEDDING_BACKENDS)}")
+    parser.add_argument("--model", default=os.getenv("TRANSFORMER_MODEL_NAME", "all-MiniLM-L6-v2"))
+    parser.add_argument("--texts", type=int, default=2000, help="chunk texts encoded in batches")
+    parser.add_argument("--queries", type=int, default=200, help="short texts encoded one at a time")
+    parser.add_argument("--texts-file", default=None, help="one text per line instead of the synthetic corpus")
+    parser.add_argument("--threads", type=int, default=int(os.getenv("EMBEDDING_THREADS", "0")))
+    parser.add_argument("--batch-size", type=int, default=int(os.getenv("EMBEDDING_BATCH_SIZE", "32")))
+    parser.add_argument("--onnx-directory", default=os.getenv("EMBEDDING_ONNX_DIR", "data/models/onnx"))
+    parser.add_argument("--k", type=int, default=10, help="k for the top-k overlap with the float model")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", default=None, help="JSON results file (default data/benchmarks/embedding_backends_<time>.json)")
+    return parser.parse_args(argv)
+
+def main(argv: list[str] | None = None) -> dict[str, Any]:
+
+    args = parse_arguments(argv)
+    output = args.output or os.path.join("data", "benchmarks", f"embedding_backends_{time.strftime('%Y%m%d_%H%M%S')}.json")
+    texts, queries = _read_texts(args)
+
+    reference = measure_backend("torch", texts, queries, args)
+    results = []
+    for backend in [value.strip() for value in args.backends.split(",") if value.strip() and value.strip() != "torch"]:
+        print(f"Measuring {backend}")
+        try:
+            result = measure_backend(backend, texts, queries, args)
+            result["drift"] = drift(result, reference, args.k)
+            result["ingest_speedup"] = result["ingest"]["rows_per_second"] / reference["ingest"]["rows_per_second"]
+            results.append(result)
+        except Exception as e:
+            results.append({"backend": backend, "error": f"{type(e).__name__}: {e}"})
+
+    strip_vectors = lambda result: {name: value for name, value in result.items() if not name.endswith("_vectors")}
+    report = {"environment": _environment(), "arguments": vars(args),
+              "reference": strip_vectors(reference), "results": [strip_vectors(result) for result in results]}
+
+    os.makedirs(os.path.dirname(output) or ".", exist_ok=True)
+    with open(output, "w", encoding="utf-8") as output_file:
+        json.dump(report, output_file, indent=2)
+
+    print(f"{'torch':>10}: {reference['ingest']['rows_per_second']:.0f} texts/s, query p50 {reference['query']['p50_ms']:.1f} ms")
+    for result in results:
+        if "error" in result:
+            print(f"{result['backend']:>10}: {result['error']}")
+            continue
+        print(f"{result['backend']:>10}: {result['ingest']['rows_per_second']:.0f} texts/s ({result['ingest_speedup']:.2f}x), "
+              f"query p50 {result['query']['p50_ms']:.1f} ms, cosine mean/min {result['drift']['mean_cosine']:.4f}/"
+              f"{result['drift']['min_cosine']:.4f}, top{args.k} overlap {result['drift'][f'top{args.k}_overlap']:.3f}")
+    print(f"Results written to {output}")
+    return report
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,404 @@
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import platform
+import subprocess
+import tempfile
+from typing import Any
+
+import numpy as np
+
+from Benchmarks.synthetic_corpus import HashEmbedder, SyntheticCorpus
+from Benchmarks.stub_llm_server import StubLLMServer
+
+# Offline benchmark of ingestion and the query path on synthetic chunk sets.
+#   python -m Benchmarks.run_benchmarks --scales 1000,10000,100000
+# Every scale runs in its own process (so peak RSS is per scale) against a throw-away
+# "benchmark-<scale>" namespace, with generation served by a local stub of the OpenAI API.
+# Results are written as one JSON document, see README "Benchmarks".
+
+def _latency_summary(seconds: list[float]) -> dict[str, float]:
+    if len(seconds) == 0:
+        return {"count": 0}
+    milliseconds = np.asarray(seconds, dtype=np.float64) * 1000.0
+    p50, p95, p99 = np.percentile(milliseconds, [50, 95, 99])
+    return {"count": len(seconds), "p50_ms": float(p50), "p95_ms": float(p95), "p99_ms": float(p99),
+            "mean_ms": float(milliseconds.mean()), "max_ms": float(milliseconds.max())}
+
+def _throughput(rows: int, seconds: float) -> dict[str, float]:
+    return {"rows": rows, "seconds": seconds, "rows_per_second": rows / seconds if seconds > 0 else float(rows)}
+
+def peak_rss_bytes() -> int:
+    try:
+        import resource
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # kilobytes on Linux, bytes on macOS
+        return int(peak if sys.platform == "darwin" else peak * 1024)
+    except ImportError:
+        import psutil
+        return int(psutil.Process().memory_info().peak_wset)
+
+def current_rss_bytes() -> int:
+    import psutil
+    return int(psutil.Process().memory_info().rss)
+
+class ExactSearch:
+
+    # Exhaustive squared-L2 top-k (Chroma's default distance) over every ingested batch, kept as a
+    # running merge so ground truth does not need the whole embedding matrix in memory.
+    def __init__(self, query_embeddings: np.ndarray, k: int) -> None:
+        self.queries = np.ascontiguousarray(query_embeddings, dtype=np.float32)
+        self.query_norms = np.einsum("ij,ij->i", self.queries, self.queries)
+        self.k = k
+        self.distances = np.empty((len(self.queries), 0), dtype=np.float32)
+        self.rows = np.empty((len(self.queries), 0), dtype=np.int64)
+
+    def add(self, first_row: int, embeddings: np.ndarray) -> None:
+        embeddings = np.asarray(embeddings, dtype=np.float32)
+        distances = (self.query_norms[:, None] + np.einsum("ij,ij->i", embeddings, embeddings)[None, :]
+                     - 2.0 * (self.queries @ embeddings.T))
+        rows = np.broadcast_to(np.arange(first_row, first_row + len(embeddings)), distances.shape)
+        distances = np.hstack([self.distances, distances])
+        rows = np.hstack([self.rows, rows])
+        if distances.shape[1] > self.k:
+            keep = np.argpartition(distances, self.k - 1, axis=1)[:, :self.k]
+            distances = np.take_along_axis(distances, keep, axis=1)
+            rows = np.take_along_axis(rows, keep, axis=1)
+        self.distances, self.rows = distances, rows
+
+    def top_rows(self, k: int) -> list[list[int]]:
+        order = np.argsort(self.distances, axis=1)[:, :k]
+        return np.take_along_axis(self.rows, order, axis=1).tolist()
+
+def _recall(found_ids: list[list[str]], exact_ids: list[set[str]], k: int) -> float:
+    return float(np.mean([len(set(found[:k]) & exact) / max(len(exact), 1) for found, exact in zip(found_ids, exact_ids)]))
+
+def _make_embedder(args: argparse.Namespace, corpus: SyntheticCorpus) -> Any:
+    if args.embedder == "model":
+        from Infrastructure.resource_registry import get_registry
+        return get_registry().get_embedding_manager(model_name=os.getenv("Embedding_Model_Name", "all-MiniLM-L6-v2"))
+    return HashEmbedder(corpus.vocabulary, dimension=args.dimension, seed=args.seed)
+
+def benchmark_chunking(corpus: SyntheticCorpus, page_count: int) -> dict[str, Any]:
+
+    # summarizer.genreate_pdf_chunks on loader-shaped pages, without the PDF parsing, per chunker
+    try:
+        from langchain_core.documents import Document
+        from Services.summarizer import CHUNKERS, genreate_pdf_chunks
+
+        documents = [Document(page_content=text, metadata=metadata) for text, metadata in corpus.pages(page_count)]
+        results = {}
+        for chunker in CHUNKERS:
+            genreate_pdf_chunks(documents[:1], chunker=chunker)  # loads the tokenizer outside the timing
+            start_time = time.perf_counter()
+            chunks = genreate_pdf_chunks(documents, chunker=chunker)
+            elapsed = time.perf_counter() - start_time
+            results[chunker] = {"pages": len(documents), "chunks": len(chunks), "seconds": elapsed,
+                                "pages_per_second": len(documents) / elapsed if elapsed > 0 else float(len(documents))}
+        return results
+    except Exception as e:
+        return {"skipped": f"{type(e).__name__}: {e}"}
+
+def benchmark_ingest(args: argparse.Namespace, corpus: SyntheticCorpus, embedder: Any, layout: Any,
+                     exact: ExactSearch) -> dict[str, Any]:
+
+    from Infrastructure.resource_registry import get_registry, local_index_directory
+    from Services.VectorStore import ShardedVectorStore
+    from Services.VectorIndex import LocalVectorIndex
+
+    layout.save()
+    vector_store = ShardedVectorStore(layout, batch_size=args.write_batch_size)
+    lexical_index = get_registry().get_lexical_index(layout.collection_name, layout.persist_directory) if args.hybrid else None
+
+    stage_seconds = {"generate": 0.0, "embed": 0.0, "vector_store": 0.0, "lexical_index": 0.0, "exact_search": 0.0}
+    start_time = time.perf_counter()
+    for batch_start in range(0, corpus.chunk_count, args.ingest_batch_size):
+        batch_end = min(batch_start + args.ingest_batch_size, corpus.chunk_count)
+
+        stage_start = time.perf_counter()
+        chunks = corpus.chunks(batch_start, batch_end)
+        stage_seconds["generate"] += time.perf_counter() - stage_start
+
+        stage_start = time.perf_counter()
+        embeddings = embedder.generate_embeddings([chunk["text"] for chunk in chunks], show_progress_bar=False)
+        stage_seconds["embed"] += time.perf_counter() - stage_start
+
+        stage_start = time.perf_counter()
+        vector_store.add_documents(documents=chunks, embeddings=embeddings)
+        stage_seconds["vector_store"] += time.perf_counter() - stage_start
+
+        if lexical_index is not None:
+            stage_start = time.perf_counter()
+            lexical_index.add_documents(chunks)
+            stage_seconds["lexical_index"] += time.perf_counter() - stage_start
+
+        stage_start = time.perf_counter()
+        exact.add(batch_start, embeddings)
+        stage_seconds["exact_search"] += time.perf_counter() - stage_start
+
+    # Corpus generation and the ground-truth bookkeeping are benchmark overhead, not ingestion
+    ingest_seconds = time.perf_counter() - start_time - stage_seconds.pop("generate") - stage_seconds.pop("exact_search")
+    if lexical_index is None:
+        stage_seconds.pop("lexical_index")
+    report = {"total": _throughput(corpus.chunk_count, ingest_seconds),
+              "stages": {stage: _throughput(corpus.chunk_count, seconds) for stage, seconds in stage_seconds.items()}}
+
+    if os.getenv("VECTOR_INDEX_BACKEND", "chroma").lower() == "local":
+        stage_start = time.perf_counter()
+        for shard in vector_store.shards:
+            LocalVectorIndex.build_from_collection(shard.collection,
+                                                   local_index_directory(shard.collection_name, layout.persist_directory),
+                                                   search_dtype=os.getenv("VECTOR_INDEX_DTYPE", "float32"))
+        report["stages"]["local_index_build"] = _throughput(corpus.chunk_count, time.perf_counter() - stage_start)
+
+    report["rss_bytes_after_ingest"] = current_rss_bytes()
+    return report
+
+def _generate(llm: Any, model_name: str, messages: list[dict[str, str]]) -> tuple[float, float]:
+    # Streams the answer like the app does; returns (time to first token, total generation time)
+    start_time = time.perf_counter()
+    first_token_seconds = None
+    stream = llm.chat.completions.create(model=model_name, messages=messages, stream=True)
+    try:
+        for chunk in stream:
+            if chunk.choices and chunk.choices[0].delta.content and first_token_seconds is None:
+                first_token_seconds = time.perf_counter() - start_time
+    finally:
+        stream.close()
+    total_seconds = time.perf_counter() - start_time
+    return (first_token_seconds if first_token_seconds is not None else total_seconds), total_seconds
+
+def benchmark_queries(args: argparse.Namespace, corpus: SyntheticCorpus, embedder: Any, layout: Any,
+                      queries: list[str], exact: ExactSearch) -> dict[str, Any]:
+
+    from Infrastructure.resource_registry import get_registry
+    from Services.RetrieverPipeline import RetrieverPipeline
+    from Services.ProcessSearchResults import SYSTEM_PROMPT, build_messages
+
+    registry = get_registry()
+    lexical_index = registry.get_retrieval_lexical_index(layout.collection_name, layout.persist_directory) if args.hybrid else None
+    pipeline = RetrieverPipeline(
+        vector_store=registry.get_vector_index(collection_name=layout.collection_name, persist_directory=layout.persist_directory),
+        embeddings=embedder, lexical_index=lexical_index, reranker=registry.get_retrieval_reranker())
+    llm = registry.get_llm_client()
+    model_name = os.getenv("Model", "gpt-5")
+
+    # The tokenizer behind the context builder may be unavailable offline; fall back to plain joining
+    context_error = None
+    try:
+        build_messages("warm-up", [{"id": "warm-up", "text": "warm-up", "metadata": {}}])
+    except Exception as e:
+        context_error = f"{type(e).__name__}: {e}"
+
+    stages = ["embed", "vector_search", "lexical_search", "retrieve", "context", "time_to_first_token", "generation", "total"]
+    seconds: dict[str, list[float]] = {stage: [] for stage in stages}
+    dense_ids, retrieved_ids = [], []
+    context_tokens = []
+
+    for i, query in enumerate(queries):
+        measured = i >= args.warmup_queries
+        timings: dict[str, float] = {}
+
+        stage_start = time.perf_counter()
+        query_embedding = pipeline.embed_query(query)
+        timings["embed"] = time.perf_counter() - stage_start
+
+        # Dense and lexical searches on their own, for the breakdown and recall@k
+        stage_start = time.perf_counter()
+        dense = pipeline.vector_store.query(query_embeddings=[query_embedding.tolist()], n_results=args.k, include=["distances"])
+        timings["vector_search"] = time.perf_counter() - stage_start
+        if lexical_index is not None:
+            stage_start = time.perf_counter()
+            lexical_index.search(query, args.k)
+            timings["lexical_search"] = time.perf_counter() - stage_start
+
+        # What a query actually pays: candidates, fusion, scoring (and re-ranking when enabled)
+        stage_start = time.perf_counter()
+        results = pipeline.retrieve_by_embedding(query_embedding, args.top_k, query=query)
+        timings["retrieve"] = time.perf_counter() - stage_start
+
+        stage_start = time.perf_counter()
+        message_timings: dict[str, Any] = {}
+        if context_error is None:
+            messages = build_messages(query, results, message_timings)
+        else:
+            messages = [{"role": "system", "content": SYSTEM_PROMPT},
+                        {"role": "user", "content": "Context: " + "\n\n".join(doc["text"] for doc in results) + f"\n\nQuestion: {query}"}]
+        timings["context"] = time.perf_counter() - stage_start
+
+        timings["time_to_first_token"], timings["generation"] = _generate(llm, model_name, messages)
+        timings["total"] = timings["embed"] + timings["retrieve"] + timings["context"] + timings["generation"]
+
+        if measured:
+            for stage, value in timings.items():
+                seconds[stage].append(value)
+            dense_ids.append(dense["ids"][0])
+            retrieved_ids.append([doc["id"] for doc in results])
+            if "context_tokens" in message_timings:
+                context_tokens.append(message_timings["context_tokens"])
+
+    def exact_ids(k: int) -> list[set[str]]:
+        return [{corpus.chunk_id(row) for row in rows} for rows in exact.top_rows(k)[args.warmup_queries:]]
+
+    report = {
+        "latency": {stage: _latency_summary(values) for stage, values in seconds.items() if len(values) > 0},
+        f"vector_recall@{args.k}": _recall(dense_ids, exact_ids(args.k), args.k),
+        # Overlap of the final top_k with the exact dense neighbours; hybrid fusion and
+        # re-ranking lower it on purpose, so it is a drift signal rather than a target
+        f"retrieve_overlap@{args.top_k}": _recall(retrieved_ids, exact_ids(args.top_k), args.top_k),
+        "queries": len(dense_ids)
+    }
+    if context_error is not None:
+        report["context_skipped"] = context_error
+    if len(context_tokens) > 0:
+        report["mean_context_tokens"] = float(np.mean(context_tokens))
+    return report
+
+def run_scale(args: argparse.Namespace) -> dict[str, Any]:
+
+    from Services.NamespaceLayout import NamespaceLayout
+    from Infrastructure.telemetry import get_metrics
+
+    # Generation goes to the stub and nothing is served from, or written to, the caches
+    os.environ["OPENAI_BASE_URL"] = args.llm_base_url
+    os.environ["OPENAI_API_KEY"] = "benchmark"
+    os.environ.pop("KeyVault_Name", None)
+    os.environ["ANSWER_CACHE_ENABLED"] = "false"
+    os.environ["EMBEDDING_CACHE_ENABLED"] = "false"
+    os.environ["HYBRID_RETRIEVAL"] = "true" if args.hybrid else "false"
+
+    namespace = f"benchmark-{args.scale}"
+    layout = NamespaceLayout(namespace=namespace, base_persist_directory=args.persist_directory)
+    shutil.rmtree(layout.persist_directory, ignore_errors=True)
+    layout = NamespaceLayout(namespace=namespace, base_persist_directory=args.persist_directory, shard_count=args.shards)
+
+    corpus = SyntheticCorpus(args.scale, seed=args.seed)
+    embedder = _make_embedder(args, corpus)
+    queries = corpus.queries(args.queries + args.warmup_queries)
+    exact = ExactSearch(embedder.generate_embeddings(queries, show_progress_bar=False), max(args.k, args.top_k))
+
+    try:
+        result = {
+            "scale": args.scale,
+            "namespace": namespace,
+            "shards": layout.shard_count,
+            "vector_index_backend": os.getenv("VECTOR_INDEX_BACKEND", "chroma"),
+            "chunking": benchmark_chunking(corpus, args.chunking_pages),
+            "ingest": benchmark_ingest(args, corpus, embedder, layout, exact),
+            "query": benchmark_queries(args, corpus, embedder, layout, queries, exact),
+            "peak_rss_bytes": peak_rss_bytes(),
+            # The same per-stage counters and timings the services export on /metrics
+            "stage_metrics": get_metrics().snapshot()
+        }
+    finally:
+        if not args.keep_data:
+            shutil.rmtree(layout.persist_directory, ignore_errors=True)
+    return result
+
+def _environment() -> dict[str, Any]:
+    try:
+        commit = subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True, text=True, check=True).stdout.strip()
+    except Exception:
+        commit = None
+    return {"git_commit": commit, "python": platform.python_version(), "platform": platform.platform(),
+            "cpu_count": os.cpu_count(), "numpy": np.__version__,
+            "settings": {name: os.getenv(name) for name in ("VECTOR_INDEX_BACKEND", "VECTOR_INDEX_SEARCH_MODE", "VECTOR_INDEX_DTYPE",
+                                                            "VECTOR_INDEX_NPROBE", "VECTOR_STORE_SHARDS", "RERANKER_ENABLED",
+                                                            "Embedding_Model_Name", "Model") if os.getenv(name) is not None}}
+
+def _scale_arguments(args: argparse.Namespace, scale: int, llm_base_url: str, output: str) -> list[str]:
+    arguments = ["--scale", str(scale), "--llm-base-url", llm_base_url, "--output", output]
+    for name in ("queries", "warmup_queries", "k", "top_k", "embedder", "dimension", "seed", "shards",
+                 "ingest_batch_size", "write_batch_size", "chunking_pages", "persist_directory"):
+        value = getattr(args, name)
+        if value is not None:
+            arguments += [f"--{name.replace('_', '-')}", str(value)]
+    arguments.append("--hybrid" if args.hybrid else "--no-hybrid")
+    if args.keep_data:
+        arguments.append("--keep-data")
+    return arguments
+
+def parse_arguments(argv: list[str] | None = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Offline ingestion and query benchmark on synthetic chunk sets")
+    parser.add_argument("--scales", default="1000,10000,100000", help="comma separated chunk counts, e.g. 1000,10000,1000000")
+    parser.add_argument("--scale", type=int, default=None, help="run a single scale in this process")
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--warmup-queries", type=int, default=10)
+    parser.add_argument("--k", type=int, default=10, help="k for vector recall@k against exact search")
+    parser.add_argument("--top-k", type=int, default=3, help="chunks retrieved per question, as in the app")
+    parser.add_argument("--embedder", choices=("hash", "model"), default="hash",
+                        help="hash: offline random-projection embedder; model: the configured sentence-transformer")
+    parser.add_argument("--dimension", type=int, default=384)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--shards", type=int, default=None, help="default VECTOR_STORE_SHARDS")
+    parser.add_argument("--hybrid", action=argparse.BooleanOptionalAction, default=True)
+    parser.add_argument("--ingest-batch-size", type=int, default=4096)
+    parser.add_argument("--write-batch-size", type=int, default=1024)
+    parser.add_argument("--chunking-pages", type=int, default=250)
+    parser.add_argument("--persist-directory", default="data/vector_store")
+    parser.add_argument("--keep-data", action="store_true", help="keep the benchmark namespace after the run")
+    parser.add_argument("--llm-base-url", default=None, help="OpenAI-compatible endpoint; a local stub is started when omitted")
+    parser.add_argument("--llm-first-token-ms", type=float, default=0.0)
+    parser.add_argument("--llm-token-interval-ms", type=float, default=0.0)
+    parser.add_argument("--llm-answer-tokens", type=int, default=64)
+    parser.add_argument("--output", default=None, help="JSON results file (default data/benchmarks/benchmark_<time>.json)")
+    return parser.parse_args(argv)
+
+def main(argv: list[str] | None = None) -> dict[str, Any]:
+
+    args = parse_arguments(argv)
+    output = args.output or os.path.join("data", "benchmarks", f"benchmark_{time.strftime('%Y%m%d_%H%M%S')}.json")
+
+    stub = None
+    if args.llm_base_url is None:
+        stub = StubLLMServer(first_token_ms=args.llm_first_token_ms, token_interval_ms=args.llm_token_interval_ms,
+                             answer_tokens=args.llm_answer_tokens)
+        args.llm_base_url = stub.start()
+
+    try:
+        if args.scale is not None:
+            report = run_scale(args)
+        else:
+            results = []
+            for scale in [int(value) for value in args.scales.split(",") if value.strip()]:
+                print(f"Benchmarking {scale} chunks")
+                with tempfile.TemporaryDirectory() as temp_directory:
+                    scale_output = os.path.join(temp_directory, "result.json")
+                    completed = subprocess.run([sys.executable, "-m", "Benchmarks.run_benchmarks",
+                                                *_scale_arguments(args, scale, args.llm_base_url, scale_output)])
+                    if completed.returncode == 0 and os.path.exists(scale_output):
+                        with open(scale_output, "r", encoding="utf-8") as result_file:
+                            results.append(json.load(result_file))
+                    else:
+                        results.append({"scale": scale, "error": f"benchmark process exited with code {completed.returncode}"})
+            report = {"environment": _environment(),
+                      "arguments": {name: value for name, value in vars(args).items() if name not in ("scale", "output")},
+                      "results": results}
+    finally:
+        if stub is not None:
+            stub.stop()
+
+    output_directory = os.path.dirname(output)
+    if output_directory:
+        os.makedirs(output_directory, exist_ok=True)
+    with open(output, "w", encoding="utf-8") as output_file:
+        json.dump(report, output_file, indent=2)
+
+    if args.scale is None:
+        for result in report["results"]:
+            if "error" in result:
+                print(f"{result['scale']:>9} chunks: {result['error']}")
+                continue
+            latency = result["query"]["latency"]
+            print(f"{result['scale']:>9} chunks: ingest {result['ingest']['total']['rows_per_second']:.0f} rows/s, "
+                  f"retrieve p50/p95/p99 {latency['retrieve']['p50_ms']:.1f}/{latency['retrieve']['p95_ms']:.1f}/"
+                  f"{latency['retrieve']['p99_ms']:.1f} ms, recall@{args.k} {result['query'][f'vector_recall@{args.k}']:.3f}, "
+                  f"peak RSS {result['peak_rss_bytes'] / 2**20:.0f} MiB")
+        print(f"Results written to {output}")
+    return report
+
+if __name__ == "__main__":
+    main()
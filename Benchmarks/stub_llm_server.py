@@ -0,0 +1,110 @@
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any
+
+class StubLLMServer:
+
+    # OpenAI-compatible POST /v1/chat/completions that answers with canned tokens at a fixed pace.
+    # Point the OpenAI client at it with OPENAI_BASE_URL=<base_url> to benchmark generation offline.
+    def __init__(self,
+                 host: str = "127.0.0.1",
+                 port: int = 0,
+                 first_token_ms: float = 0.0,
+                 token_interval_ms: float = 0.0,
+                 answer_tokens: int = 64) -> None:
+        self.first_token_seconds = first_token_ms / 1000.0
+        self.token_interval_seconds = token_interval_ms / 1000.0
+        self.answer_tokens = answer_tokens
+        self.counters = {"requests": 0, "stream_requests": 0, "prompt_characters": 0}
+        self._lock = threading.Lock()
+        self._server = ThreadingHTTPServer((host, port), self._handler_class())
+        self._server.daemon_threads = True
+        self._thread: threading.Thread | None = None
+
+    @property
+    def base_url(self) -> str:
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}/v1"
+
+    def start(self) -> str:
+        self._thread = threading.Thread(target=self._server.serve_forever, name="stub-llm-server", daemon=True)
+        self._thread.start()
+        return self.base_url
+
+    def stop(self) -> None:
+        self._server.shutdown()
+        self._server.server_close()
+
+    def _record(self, payload: dict[str, Any]) -> None:
+        with self._lock:
+            self.counters["requests"] += 1
+            self.counters["stream_requests"] += int(bool(payload.get("stream")))
+            self.counters["prompt_characters"] += sum(len(str(message.get("content", "")))
+                                                      for message in payload.get("messages", []))
+
+    def _tokens(self) -> list[str]:
+        return [f"token{i} " for i in range(self.answer_tokens)]
+
+    def _handler_class(self) -> type[BaseHTTPRequestHandler]:
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, format: str, *args: Any) -> None:
+                return
+
+            def _send_json(self, status: int, body: dict[str, Any]) -> None:
+                data = json.dumps(body).encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def _send_event(self, body: Any) -> None:
+                # One SSE event per HTTP chunk
+                data = f"data: {body if isinstance(body, str) else json.dumps(body)}\n\n".encode("utf-8")
+                self.wfile.write(f"{len(data):x}\r\n".encode("ascii") + data + b"\r\n")
+                self.wfile.flush()
+
+            def do_POST(self) -> None:
+                payload = json.loads(self.rfile.read(int(self.headers.get("Content-Length", "0"))) or b"{}")
+                if not self.path.rstrip("/").endswith("/chat/completions"):
+                    self._send_json(404, {"error": {"message": f"Unknown path {self.path}"}})
+                    return
+                stub._record(payload)
+
+                created = int(time.time())
+                model = payload.get("model", "stub")
+                tokens = stub._tokens()
+                time.sleep(stub.first_token_seconds)
+
+                if not payload.get("stream"):
+                    time.sleep(stub.token_interval_seconds * max(len(tokens) - 1, 0))
+                    self._send_json(200, {
+                        "id": "chatcmpl-stub", "object": "chat.completion", "created": created, "model": model,
+                        "choices": [{"index": 0, "message": {"role": "assistant", "content": "".join(tokens)},
+                                     "finish_reason": "stop"}],
+                        "usage": {"prompt_tokens": 0, "completion_tokens": len(tokens), "total_tokens": len(tokens)}})
+                    return
+
+                self.send_response(200)
+                self.send_header("Content-Type", "text/event-stream")
+                self.send_header("Transfer-Encoding", "chunked")
+                self.end_headers()
+                for i, token in enumerate(tokens):
+                    if i > 0:
+                        time.sleep(stub.token_interval_seconds)
+                    delta = {"role": "assistant", "content": token} if i == 0 else {"content": token}
+                    self._send_event({"id": "chatcmpl-stub", "object": "chat.completion.chunk", "created": created,
+                                      "model": model, "choices": [{"index": 0, "delta": delta, "finish_reason": None}]})
+                self._send_event({"id": "chatcmpl-stub", "object": "chat.completion.chunk", "created": created,
+                                  "model": model, "choices": [{"index": 0, "delta": {}, "finish_reason": "stop"}]})
+                self._send_event("[DONE]")
+                self.wfile.write(b"0\r\n\r\n")
+                self.wfile.flush()
+
+        return Handler
@@ -0,0 +1,145 @@
+import zlib
+from typing import Any
+
+import numpy as np
+
+_SYLLABLES = ["ka", "lo", "mi", "ne", "ru", "ta", "vo", "si", "de", "pa", "go", "li", "ma", "no", "re",
+              "sa", "te", "vi", "ba", "co", "du", "fe", "hi", "jo", "ku", "le", "mo", "nu", "pe", "zi"]
+
+class SyntheticCorpus:
+
+    # Deterministic chunk sets of any size without PDFs or a model. Every document belongs to one topic
+    # and its chunks draw most words from that topic's vocabulary, so nearest neighbours are meaningful;
+    # each chunk also carries a unique part number, the kind of exact token BM25 is there for.
+    # Chunks are generated batch by batch, a 1M chunk corpus is never held in memory at once.
+    def __init__(self,
+                 chunk_count: int,
+                 seed: int = 0,
+                 vocabulary_size: int = 20000,
+                 topic_count: int = 256,
+                 topic_words: int = 300,
+                 words_per_chunk: int = 80,
+                 topic_share: float = 0.7,
+                 chunks_per_page: int = 4,
+                 pages_per_document: int = 20) -> None:
+        self.chunk_count = chunk_count
+        self.seed = seed
+        self.topic_count = topic_count
+        self.words_per_chunk = words_per_chunk
+        self.topic_word_count = int(words_per_chunk * topic_share)
+        self.chunks_per_page = chunks_per_page
+        self.chunks_per_document = chunks_per_page * pages_per_document
+        self.ingested_at_base = 1_700_000_000.0
+
+        rng = np.random.default_rng(seed)
+        self.vocabulary = self._make_vocabulary(rng, vocabulary_size)
+        self.topic_vocabulary = rng.integers(0, vocabulary_size, size=(topic_count, topic_words))
+        # Zipf-like word frequencies, inside a topic and over the whole vocabulary
+        self.topic_weights = self._zipf_weights(topic_words)
+        self.general_weights = self._zipf_weights(vocabulary_size)
+
+    @staticmethod
+    def _zipf_weights(size: int) -> np.ndarray:
+        weights = 1.0 / np.arange(1, size + 1)
+        return weights / weights.sum()
+
+    @staticmethod
+    def _make_vocabulary(rng: np.random.Generator, size: int) -> np.ndarray:
+        words: dict[str, None] = {}
+        while len(words) < size:
+            syllable_count = int(rng.integers(2, 5))
+            words["".join(_SYLLABLES[i] for i in rng.integers(0, len(_SYLLABLES), size=syllable_count))] = None
+        return np.asarray(list(words), dtype=object)
+
+    def chunk_id(self, index: int) -> str:
+        return f"bench{self.seed}_{index:08d}"
+
+    def part_number(self, index: int) -> str:
+        return f"PN-{zlib.crc32(f'{self.seed}:{index}'.encode('utf-8')):08X}"
+
+    def topic_of(self, indexes: np.ndarray) -> np.ndarray:
+        documents = np.asarray(indexes) // self.chunks_per_document
+        return (documents * 2654435761 + self.seed) % self.topic_count
+
+    def chunks(self, start: int, end: int) -> list[dict[str, Any]]:
+
+        # Same (seed, start) always yields the same chunks, whatever batch size came before
+        rng = np.random.default_rng([self.seed, start])
+        indexes = np.arange(start, end)
+        topics = self.topic_of(indexes)
+        topic_words = self.topic_vocabulary[topics[:, None],
+                                            rng.choice(self.topic_vocabulary.shape[1], p=self.topic_weights,
+                                                       size=(len(indexes), self.topic_word_count))]
+        general_words = rng.choice(len(self.vocabulary), p=self.general_weights,
+                                   size=(len(indexes), self.words_per_chunk - self.topic_word_count))
+        words = rng.permuted(np.hstack([topic_words, general_words]), axis=1)
+
+        chunks = []
+        for row, index in enumerate(indexes.tolist()):
+            document = index // self.chunks_per_document
+            chunks.append({
+                "id": self.chunk_id(index),
+                "text": " ".join(self.vocabulary[words[row]]) + f" Reference {self.part_number(index)}.",
+                "metadata": {
+                    "source": f"synthetic_{document:06d}.pdf",
+                    "page_number": (index % self.chunks_per_document) // self.chunks_per_page + 1,
+                    "chunk_index": index,
+                    "ingested_at": self.ingested_at_base + document
+                }
+            })
+        return chunks
+
+    def queries(self, count: int, words_per_query: int = 8, part_number_share: float = 0.2) -> list[str]:
+
+        # Topic questions, and a share that ask for one chunk's part number (a lexical match)
+        rng = np.random.default_rng([self.seed, 0x51])
+        queries = []
+        for _ in range(count):
+            index = int(rng.integers(0, self.chunk_count))
+            topic = int(self.topic_of(np.asarray([index]))[0])
+            words = self.topic_vocabulary[topic, rng.choice(self.topic_vocabulary.shape[1], p=self.topic_weights,
+                                                            size=words_per_query)]
+            query = " ".join(self.vocabulary[words])
+            if rng.random() < part_number_share:
+                query += f" {self.part_number(index)}"
+            queries.append(query)
+        return queries
+
+    def pages(self, page_count: int) -> list[tuple[str, dict[str, Any]]]:
+        # Page texts and metadata for the chunking benchmark, as a PDF loader would return them
+        chunk_count = min(page_count * self.chunks_per_page, self.chunk_count)
+        chunks = self.chunks(0, chunk_count)
+        pages = []
+        for first in range(0, len(chunks), self.chunks_per_page):
+            page_chunks = chunks[first:first + self.chunks_per_page]
+            pages.append(("\n".join(chunk["text"] for chunk in page_chunks),
+                          {"source": page_chunks[0]["metadata"]["source"],
+                           "page_number": page_chunks[0]["metadata"]["page_number"]}))
+        return pages
+
+class HashEmbedder:
+
+    # Offline stand-in for EmbeddingManager with the same interface: a text embeds as the normalised
+    # sum of fixed random word vectors. Texts sharing a topic share words, so they end up close.
+    def __init__(self, vocabulary: np.ndarray, dimension: int = 384, seed: int = 0) -> None:
+        self.model_name = f"hash-embedder-{dimension}"
+        # RetrieverPipeline only scores hits when a model is loaded
+        self.model = self.model_name
+        self.dimension = dimension
+        self.word_rows = {word: row for row, word in enumerate(vocabulary.tolist())}
+        rng = np.random.default_rng([seed, dimension])
+        self.word_vectors = rng.standard_normal((len(vocabulary), dimension)).astype(np.float32)
+
+    def _row(self, word: str) -> int:
+        row = self.word_rows.get(word)
+        return row if row is not None else zlib.crc32(word.encode("utf-8")) % len(self.word_vectors)
+
+    def generate_embeddings(self, text: list[str], show_progress_bar: bool = False) -> np.ndarray:
+        embeddings = np.empty((len(text), self.dimension), dtype=np.float32)
+        for i, t in enumerate(text):
+            embeddings[i] = self.word_vectors[[self._row(word) for word in t.split()]].sum(axis=0)
+        norms = np.linalg.norm(embeddings, axis=1, keepdims=True)
+        return embeddings / np.maximum(norms, np.finfo(np.float32).tiny)
+
+    def generate_query_embedding(self, text: str) -> np.ndarray:
+        return self.generate_embeddings([text])[0]
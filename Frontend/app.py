@@ -1,15 +1,45 @@
-import sys
+import time
+_import_started = time.perf_counter()
+
+import os
 import streamlit as slt
 from pathlib import Path
 from typing import List
-import time
+import threading
 
-sys.path.append("Services")
-from Services.ProcessDocument import ProcessDocument
-from Services.ProcessSearchResults import ProcessSearchResults
+# Only light modules here; the query and ingestion stacks (torch, chromadb, openai, langchain)
+# are imported by the feature that needs them, or ahead of time by the background warm-up
+from Services.IngestionManifest import IngestionManifest
+from Services.MetadataFilter import build_where
+from Services.NamespaceLayout import DEFAULT_NAMESPACE, NamespaceLayout
+from Infrastructure.resource_registry import ResourceRegistry, get_registry
+from Infrastructure.telemetry import configure_logging
+from Infrastructure.warmup import get_startup_report, start_warm_up
+
+get_startup_report().record("app_imports", time.perf_counter() - _import_started)
 
 upload_dir = Path("Uploads")
 
+@slt.cache_resource
+def get_resource_registry() -> ResourceRegistry:
+    # Same process-wide registry the services use, kept alive across script reruns.
+    # Logging, the optional Prometheus endpoint (METRICS_PORT) and the ingestion workers are set up once with it.
+    configure_logging()
+    registry = get_registry()
+    registry.get_metrics_server()
+    registry.get_ingestion_workers()
+    return registry
+
+@slt.cache_resource
+def start_app_warm_up() -> threading.Thread | None:
+    # Once per process, after the first page has been sent: model, indexes and LLM client
+    return start_warm_up()
+
+@slt.cache_resource
+def released_ingestion_jobs() -> set:
+    # Finished jobs whose namespace has already been reopened in this process
+    return set()
+
 def setup_page() ->None:
     slt.set_page_config(
      page_title="Multiple File Uploader", page_icon="📤", layout="wide")
@@ -17,41 +47,117 @@ def setup_page() ->None:
 
 def ensure_upload_directory() ->None:
     upload_dir.mkdir(parents=True, exist_ok=True)
+
+def namespace_picker() -> NamespaceLayout:
+    # Each namespace is a separate corpus with its own uploads and vector store
+    with slt.sidebar:
+        namespaces = NamespaceLayout.list_namespaces()
+        new_namespace = slt.text_input("New namespace", placeholder="e.g. finance-team").strip()
+        if new_namespace and new_namespace not in namespaces:
+            namespaces.append(new_namespace)
+        namespace = slt.selectbox("Namespace", namespaces,
+                                  index=namespaces.index(new_namespace) if new_namespace in namespaces else 0)
+    try:
+        return NamespaceLayout(namespace=namespace)
+    except ValueError as e:
+        slt.sidebar.error(str(e))
+        return NamespaceLayout(namespace=DEFAULT_NAMESPACE)
     
 def file_uploader_ui():
     return slt.file_uploader(
         "Upload PDF file(s) only", type="pdf", accept_multiple_files=True)
 
-def save_uploaded_files(uploaded_files) -> None:
+def save_uploaded_files(uploaded_files, layout: NamespaceLayout) -> None:
     total = len(uploaded_files)
     progress = slt.progress(0)
     status = slt.empty()
 
+    namespace_upload_dir = Path(layout.upload_directory)
+    namespace_upload_dir.mkdir(parents=True, exist_ok=True)
     for i, f in enumerate(uploaded_files, start=1):
         status.write(f"Saving **{f.name}** ({i}/{total})...")
-        (upload_dir / f.name).write_bytes(f.getbuffer())
+        (namespace_upload_dir / f.name).write_bytes(f.getbuffer())
+        progress.progress(int(i / total * 100))
 
-        # Call the process function from ProcessDocument.py
-        process_document = ProcessDocument()
-        process_document.process()
+    # Indexing runs in a worker process, so the page stays usable and survives a closed browser tab
+    job_id = get_registry().get_ingestion_job_queue().enqueue(layout.namespace, [f.name for f in uploaded_files])
+    status.success(f"✅ Saved {total} file(s). Indexing job {job_id} is queued for namespace '{layout.namespace}'.")
 
-        progress.progress(int(i / total * 100))
-        time.sleep(0.05)  # optional: makes progress visible even for tiny files
-        status.success(f"✅ Processing of {total} file(s) successfully!")
-        del process_document
+_JOB_ICONS = {"queued": "⏳", "running": "⚙️", "succeeded": "✅", "failed": "❌"}
+
+@slt.fragment(run_every=2)
+def ingestion_jobs_panel(layout: NamespaceLayout) -> None:
+    # Polls the job queue without rerunning the rest of the page
+    jobs = get_registry().get_ingestion_job_queue().list_jobs(namespace=layout.namespace, limit=5)
+    if len(jobs) == 0:
+        return
 
-def text_input_with_button() -> str:
+    slt.caption("Indexing jobs")
+    for job in jobs:
+        label = f"{_JOB_ICONS.get(job['status'], '')} {job['job_id']} · {len(job['files'])} file(s) · {job['message'] or job['status']}"
+        if job["status"] in ("queued", "running"):
+            slt.progress(job["progress"], text=label)
+        elif job["status"] == "failed":
+            slt.error(f"{label}: {job['error']}")
+        else:
+            summary = job["summary"] or {}
+            slt.write(f"{label} ({summary.get('added', 0)} indexed, {summary.get('unchanged', 0)} unchanged, "
+                      f"{summary.get('removed', 0)} removed)")
+
+    # The worker wrote to this namespace from another process; reopen it once and refresh the page
+    released = released_ingestion_jobs()
+    finished = [job["job_id"] for job in jobs if job["status"] == "succeeded" and job["job_id"] not in released]
+    if len(finished) > 0:
+        released.update(finished)
+        get_registry().release_persist_directory(layout.persist_directory)
+        slt.rerun()
+
+def create_query_processor(query: str, top_k: int, where: dict | None = None, namespace: str = DEFAULT_NAMESPACE):
+    # With QUERY_SERVICE_URL set the page is a thin client of Services/QueryService.py
+    service_url = os.getenv("QUERY_SERVICE_URL")
+    if service_url:
+        from Services.QueryServiceClient import QueryServiceClient
+        return QueryServiceClient(query=query, top_k=top_k, service_url=service_url, where=where, namespace=namespace)
+    from Services.ProcessSearchResults import ProcessSearchResults
+    return ProcessSearchResults(query=query, top_k=top_k, where=where, namespace=namespace)
+
+def indexed_files(layout: NamespaceLayout) -> List[str]:
+    # Files that are fully indexed, as recorded by ProcessDocument (same keys as the chunk "source")
+    manifest = IngestionManifest(os.path.join(layout.persist_directory, "ingestion_manifest.json"))
+    return sorted(file_key for file_key, entry in manifest.files.items() if entry.get("status", "complete") == "complete")
+
+def scope_selector(layout: NamespaceLayout) -> dict | None:
+    selected_files = slt.multiselect("Only search in these files (leave empty for all)",
+                                     options=indexed_files(layout), format_func=os.path.basename)
+    return build_where(sources=selected_files)
+
+def text_input_with_button(layout: NamespaceLayout) -> str:
     # Text box + button on the side
     c1, c2 = slt.columns([4, 1])
     with c1:
         user_text = slt.text_input("Enter a value", placeholder="Type something (e.g., What skills are needed...)")
+        where = scope_selector(layout)
     with c2:
         clicked = slt.button("Submit", use_container_width=True)
     if clicked:
+        # A new submit cancels the answer that is still streaming for the previous one
+        previous_cancel_event = slt.session_state.get("answer_cancel_event")
+        if previous_cancel_event is not None:
+            previous_cancel_event.set()
+        cancel_event = threading.Event()
+        slt.session_state["answer_cancel_event"] = cancel_event
+
         slt.session_state["last_submitted"] = user_text
-        process_query = ProcessSearchResults(query=user_text, top_k=3)
-        
-        slt.text_area("output_text", value=str(process_query.process_query_results()))
+        process_query = create_query_processor(query=user_text, top_k=3, where=where, namespace=layout.namespace)
+
+        # Render the answer token by token as the LLM produces it
+        answer = slt.write_stream(process_query.stream_query_results(cancel_event=cancel_event))
+        slt.session_state["last_answer"] = answer
+
+        timings = process_query.timings
+        slt.caption(f"Retrieval {timings.get('retrieval_seconds', 0.0):.2f}s · "
+                    f"first token {timings.get('time_to_first_token_seconds', 0.0):.2f}s · "
+                    f"total {timings.get('total_seconds', 0.0):.2f}s")
 
     return slt.session_state.get("last_submitted", "")
 
@@ -72,24 +178,37 @@ def auto_expanding_text_area() -> str:
     )
     return slt.session_state["output_text"]
 
+def startup_timings_panel() -> None:
+    report = get_startup_report().snapshot()
+    with slt.sidebar.expander("Startup timings", expanded=False):
+        if report["ready"]:
+            slt.caption(f"Warm {report['ready_seconds']:.1f}s after start-up")
+        else:
+            slt.caption("Warming up in the background...")
+        for name, step in report["steps"].items():
+            slt.text(f"{name}: {step['seconds']:.2f}s" + (f" ({step['error']})" if step["error"] else ""))
+
 def main():
     setup_page()
     ensure_upload_directory()
+    get_resource_registry()
+    layout = namespace_picker()
 
     uploaded_files = file_uploader_ui()
 
     # Save uploaded files button + progress
     if uploaded_files:
         if slt.button("Save uploaded files", type="primary"):
-            save_uploaded_files(uploaded_files)
+            save_uploaded_files(uploaded_files, layout)
     else:
         slt.caption("Upload files to enable saving.")
+    ingestion_jobs_panel(layout)
 
     col_a, col_b = slt.columns([1, 1], vertical_alignment="top")
 
     with col_a:
         slt.subheader("Text box + button (side-by-side)")
-        submitted_value = text_input_with_button()
+        submitted_value = text_input_with_button(layout)
 
         # Demo action: append submitted text into output area
         if submitted_value:
@@ -119,6 +238,9 @@ def main():
                 else:
                     slt.session_state["output_text"] = slt.session_state.get("output_text", "") + "No files uploaded.\n"
 
+    startup_timings_panel()
+    start_app_warm_up()
+
     # if uploaded_files:
     #     slt.success(f"{len(uploaded_files)} PDF(s) selected!")
 
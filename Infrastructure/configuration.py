@@ -3,9 +3,9 @@ import logging
 from azure.identity import ClientSecretCredential #DefaultAzureCredential
 from azure.keyvault.secrets import SecretClient
 
+logger = logging.getLogger(__name__)
+
 class GetConfiguration:
-    
-    logging.basicConfig(level=logging.DEBUG)
 
     def __init__(self, secret_name: str = "", keyvault_name: str = "") -> None:
         self.secret_name = secret_name
@@ -31,9 +31,10 @@ class GetConfiguration:
 
             client = SecretClient(vault_url=keyvault_uri, credential=credentials)
             secret = client.get_secret(self.secret_name)
-            logging.debug(f"Secret '{self.secret_name}' value: {secret.value}")
+            # Never log the value itself
+            logger.debug("Secret '%s' read from Key Vault '%s'", self.secret_name, self.keyvault_name)
 
             return str(secret.value)
         except Exception as e:
-            logging.error(f"Error retrieving secret '{self.secret_name}' from Key Vault '{self.keyvault_name}': {e}")
+            logger.error("Error retrieving secret '%s' from Key Vault '%s': %s", self.secret_name, self.keyvault_name, e)
             return ""
\ No newline at end of file
@@ -0,0 +1,336 @@
+import os
+import logging
+import threading
+from typing import Any, Callable
+
+logger = logging.getLogger(__name__)
+
+# Process-wide owner of the expensive clients (embedding models, Chroma, OpenAI).
+# Each resource is created once per key on first use and shared afterwards.
+class ResourceRegistry:
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._key_locks: dict[str, threading.Lock] = {}
+        self._resources: dict[str, Any] = {}
+        self._manifest_mtimes: dict[str, int] = {}
+
+    def _get_or_create(self, key: str, factory: Callable[[], Any]) -> Any:
+        resource = self._resources.get(key)
+        if resource is not None:
+            return resource
+
+        with self._lock:
+            key_lock = self._key_locks.setdefault(key, threading.Lock())
+
+        # Per-key lock so loading a model does not block creating a Chroma client
+        with key_lock:
+            resource = self._resources.get(key)
+            if resource is None:
+                resource = factory()
+                self._resources[key] = resource
+            return resource
+
+    def get_embedding_cache(self) -> Any:
+
+        def factory():
+            from Utilities.embedding_cache import EmbeddingCache
+            return EmbeddingCache(
+                cache_path=os.getenv("EMBEDDING_CACHE_PATH", "data/embedding_cache/embeddings.sqlite3"),
+                memory_budget_bytes=int(os.getenv("EMBEDDING_CACHE_MEMORY_MB", "64")) * 1024 * 1024)
+
+        return self._get_or_create("embedding_cache", factory)
+
+    def get_embedding_manager(self, model_name: str = "all-MiniLM-L6-v2") -> Any:
+
+        def factory():
+            from Services.EmbeddingManager import EmbeddingManager
+            cache = None
+            if os.getenv("EMBEDDING_CACHE_ENABLED", "true").lower() != "false":
+                cache = self.get_embedding_cache()
+            embedding_manager = EmbeddingManager(model_name=model_name, cache=cache,
+                                                 backend=os.getenv("EMBEDDING_BACKEND", "torch").lower(),
+                                                 num_threads=int(os.getenv("EMBEDDING_THREADS", "0")),
+                                                 batch_size=int(os.getenv("EMBEDDING_BATCH_SIZE", "32")),
+                                                 onnx_directory=os.getenv("EMBEDDING_ONNX_DIR", "data/models/onnx"))
+            if os.getenv("EMBEDDING_MICRO_BATCHING", "true").lower() != "false":
+                embedding_manager.enable_micro_batching(
+                    max_batch_size=int(os.getenv("EMBEDDING_MAX_BATCH_SIZE", "32")),
+                    max_wait_ms=float(os.getenv("EMBEDDING_MAX_WAIT_MS", "5")))
+            return embedding_manager
+
+        return self._get_or_create(f"embedding_manager:{model_name}", factory)
+
+    def get_answer_cache(self) -> Any:
+
+        def factory():
+            from Utilities.answer_cache import SemanticAnswerCache
+            return SemanticAnswerCache(
+                similarity_threshold=float(os.getenv("ANSWER_CACHE_SIMILARITY", "0.92")),
+                ttl_seconds=float(os.getenv("ANSWER_CACHE_TTL_SECONDS", "3600")),
+                max_entries=int(os.getenv("ANSWER_CACHE_MAX_ENTRIES", "1000")))
+
+        return self._get_or_create("answer_cache", factory)
+
+    def get_context_builder(self) -> Any:
+
+        def factory():
+            from Services.ContextBuilder import ContextBuilder
+            return ContextBuilder(model_name=os.getenv("Model", "gpt-5"),
+                                  token_budget=int(os.getenv("CONTEXT_TOKEN_BUDGET", "3000")))
+
+        return self._get_or_create("context_builder", factory)
+
+    def get_reranker(self) -> Any:
+
+        def factory():
+            from Services.Reranker import CrossEncoderReranker
+            return CrossEncoderReranker(
+                model_name=os.getenv("RERANKER_MODEL", "cross-encoder/ms-marco-MiniLM-L-6-v2"),
+                candidate_count=int(os.getenv("RERANK_CANDIDATES", "50")),
+                batch_size=int(os.getenv("RERANK_BATCH_SIZE", "16")),
+                latency_budget_ms=float(os.getenv("RERANK_LATENCY_BUDGET_MS", "300")),
+                cache_entries=int(os.getenv("RERANK_CACHE_ENTRIES", "10000")))
+
+        return self._get_or_create("reranker", factory)
+
+    def get_retrieval_reranker(self) -> Any:
+        # Cross-encoder re-ranking is opt-in, it loads a second model
+        if os.getenv("RERANKER_ENABLED", "false").lower() != "true":
+            return None
+        return self.get_reranker()
+
+    def get_chroma_client(self, persist_directory: str = "data/vector_store") -> Any:
+
+        def factory():
+            import chromadb
+            os.makedirs(persist_directory, exist_ok=True) # check if the directory exists, if not create it
+            return chromadb.PersistentClient(path=persist_directory)
+
+        return self._get_or_create(f"chroma_client:{os.path.abspath(persist_directory)}", factory)
+
+    def get_vector_collection(self, collection_name: str = "pdf_documents", persist_directory: str = "data/vector_store") -> Any:
+
+        def factory():
+            return self.get_chroma_client(persist_directory).get_collection(name=collection_name)
+
+        return self._get_or_create(f"chroma_collection:{os.path.abspath(persist_directory)}:{collection_name}", factory)
+
+    def _get_shard_index(self, collection_name: str, persist_directory: str) -> Any:
+
+        def factory():
+            from Services.VectorIndex import ChromaVectorIndex, LocalVectorIndex
+            if os.getenv("VECTOR_INDEX_BACKEND", "chroma").lower() == "local":
+                index_directory = local_index_directory(collection_name, persist_directory)
+                if not LocalVectorIndex.has_index(index_directory):
+                    # First use after switching backends (or an index from before segments): copy what is already in Chroma
+                    LocalVectorIndex.build_from_collection(self.get_vector_collection(collection_name, persist_directory),
+                                                           index_directory,
+                                                           search_dtype=os.getenv("VECTOR_INDEX_DTYPE", "float32"))
+                return LocalVectorIndex(
+                    index_directory=index_directory,
+                    search_mode=os.getenv("VECTOR_INDEX_SEARCH_MODE", "exact"),
+                    search_dtype=os.getenv("VECTOR_INDEX_DTYPE", "float32"),
+                    nprobe=int(os.getenv("VECTOR_INDEX_NPROBE", "8")),
+                    rescore_factor=int(os.getenv("VECTOR_INDEX_RESCORE_FACTOR", "4")))
+            return ChromaVectorIndex(self.get_vector_collection(collection_name, persist_directory))
+
+        return self._get_or_create(f"shard_index:{os.path.abspath(persist_directory)}:{collection_name}", factory)
+
+    def get_vector_index(self, collection_name: str = "pdf_documents", persist_directory: str = "data/vector_store") -> Any:
+
+        def factory():
+            from Services.NamespaceLayout import NamespaceLayout, shard_collection_name
+            from Services.VectorIndex import ShardedVectorIndex
+
+            # A sharded namespace is queried through all of its shard collections at once
+            shard_count = NamespaceLayout.stored_shard_count(persist_directory) or 1
+            if shard_count == 1:
+                return self._get_shard_index(collection_name, persist_directory)
+            return ShardedVectorIndex([self._get_shard_index(shard_collection_name(collection_name, shard), persist_directory)
+                                       for shard in range(shard_count)])
+
+        return self._get_or_create(f"vector_index:{os.path.abspath(persist_directory)}:{collection_name}", factory)
+
+    def get_lexical_index(self, collection_name: str = "pdf_documents", persist_directory: str = "data/vector_store") -> Any:
+
+        def factory():
+            from Services.LexicalIndex import BM25Index
+            return BM25Index(index_path=os.path.join(persist_directory, "bm25", f"{collection_name}.sqlite3"))
+
+        return self._get_or_create(f"lexical_index:{os.path.abspath(persist_directory)}:{collection_name}", factory)
+
+    def get_retrieval_lexical_index(self, collection_name: str = "pdf_documents", persist_directory: str = "data/vector_store") -> Any:
+        # The BM25 side of hybrid retrieval, or None when HYBRID_RETRIEVAL=false
+        if os.getenv("HYBRID_RETRIEVAL", "true").lower() == "false":
+            return None
+        return self.get_lexical_index(collection_name, persist_directory)
+
+    def get_openai_api_key(self) -> str:
+
+        def factory():
+            from Infrastructure.configuration import GetConfiguration
+
+            keyvault_name = os.getenv("KeyVault_Name")
+            secret_name = os.getenv("secret_name")
+
+            if keyvault_name and secret_name:
+                config = GetConfiguration(secret_name=secret_name, keyvault_name=keyvault_name)
+                openai_api_key = config.get_openai_api_key()
+                # GetConfiguration returns "" when Key Vault cannot be read; None is not cached, so the next call tries again
+                return openai_api_key or None
+
+            return os.getenv("OPENAI_API_KEY") or None
+
+        # Until Key Vault answers, OPENAI_API_KEY (if set) serves this call only
+        return self._get_or_create("openai_api_key", factory) or os.getenv("OPENAI_API_KEY", "")
+
+    def _require_openai_api_key(self) -> str:
+        # A client built without a key would be cached and fail every request, so fail this one instead
+        openai_api_key = self.get_openai_api_key()
+        if not openai_api_key:
+            raise ValueError("OpenAI API key is not available. Set OPENAI_API_KEY or check the Key Vault settings.")
+        return openai_api_key
+
+    def get_llm_client(self) -> Any:
+
+        def factory():
+            from openai import OpenAI, DefaultHttpxClient
+            import httpx
+
+            # One keep-alive connection pool for every completion request in the process
+            http_client = DefaultHttpxClient(limits=httpx.Limits(
+                max_connections=int(os.getenv("LLM_MAX_CONNECTIONS", "20")),
+                max_keepalive_connections=int(os.getenv("LLM_MAX_KEEPALIVE_CONNECTIONS", "10"))))
+            return OpenAI(api_key=self._require_openai_api_key(), http_client=http_client)
+
+        return self._get_or_create("llm_client", factory)
+
+    def get_async_llm_client(self) -> Any:
+
+        def factory():
+            from openai import AsyncOpenAI, DefaultAsyncHttpxClient
+            import httpx
+
+            # Used by the asyncio query service; must be used from a single event loop
+            http_client = DefaultAsyncHttpxClient(limits=httpx.Limits(
+                max_connections=int(os.getenv("LLM_MAX_CONNECTIONS", "20")),
+                max_keepalive_connections=int(os.getenv("LLM_MAX_KEEPALIVE_CONNECTIONS", "10"))))
+            return AsyncOpenAI(api_key=self._require_openai_api_key(), http_client=http_client)
+
+        return self._get_or_create("async_llm_client", factory)
+
+    def get_metrics_server(self) -> Any:
+        # GET /metrics for the Streamlit process when METRICS_PORT is set; the query service has its own route
+        metrics_port = os.getenv("METRICS_PORT")
+        if not metrics_port:
+            return None
+
+        def factory():
+            from Infrastructure.telemetry import start_metrics_server
+            return start_metrics_server(int(metrics_port), host=os.getenv("METRICS_HOST", "0.0.0.0"))
+
+        return self._get_or_create("metrics_server", factory)
+
+    def get_ingestion_job_queue(self) -> Any:
+
+        def factory():
+            from Services.IngestionJobQueue import IngestionJobQueue
+            return IngestionJobQueue(db_path=os.getenv("INGESTION_JOBS_PATH", "data/jobs/ingestion_jobs.sqlite3"),
+                                     max_running_jobs=int(os.getenv("INGESTION_MAX_CONCURRENT_JOBS", "1")))
+
+        return self._get_or_create("ingestion_job_queue", factory)
+
+    def get_ingestion_workers(self) -> Any:
+        # Worker processes next to the app, unless they run elsewhere (python main.py ingest-worker)
+        if os.getenv("INGESTION_EXTERNAL_WORKERS", "false").lower() == "true":
+            return None
+
+        def factory():
+            import atexit
+            from Services.IngestionJobQueue import IngestionWorkerPool, worker_options_from_env
+            job_queue = self.get_ingestion_job_queue()
+            workers = IngestionWorkerPool(job_queue.db_path, worker_count=job_queue.max_running_jobs,
+                                          **worker_options_from_env())
+            workers.start()
+            atexit.register(workers.stop)
+            return workers
+
+        return self._get_or_create("ingestion_workers", factory)
+
+    def release_persist_directory(self, persist_directory: str) -> None:
+        # Another process (an ingestion worker) changed this directory: drop the clients and indexes
+        # opened on it so the next query opens them again, and the answers that may now be outdated.
+        # Keys are "<kind>:<abspath>" or "<kind>:<abspath>:<collection>"; nested namespace directories
+        # under the same path are left alone.
+        path = os.path.abspath(persist_directory)
+        with self._lock:
+            for key in list(self._resources):
+                key_path = key.partition(":")[2]
+                if key_path == path or key_path.startswith(f"{path}:"):
+                    del self._resources[key]
+        if _release_chroma_system(path):
+            # Every Chroma system was dropped, so clients and indexes on other paths are reopened as well
+            with self._lock:
+                for key in list(self._resources):
+                    if key.partition(":")[0] in _CHROMA_RESOURCE_KINDS:
+                        del self._resources[key]
+        if "answer_cache" in self._resources:
+            self._resources["answer_cache"].invalidate()
+
+    def release_if_ingested(self, persist_directory: str) -> bool:
+        # Cheap per-request check for processes that do not run the ingestion themselves (the query
+        # service): ProcessDocument saves the manifest after every batch it writes
+        try:
+            modified = os.stat(os.path.join(persist_directory, "ingestion_manifest.json")).st_mtime_ns
+        except OSError:
+            return False
+        path = os.path.abspath(persist_directory)
+        with self._lock:
+            previous = self._manifest_mtimes.get(path)
+            self._manifest_mtimes[path] = modified
+        if previous is None or previous == modified:
+            return False
+        self.release_persist_directory(persist_directory)
+        return True
+
+    def clear(self) -> None:
+        with self._lock:
+            self._resources.clear()
+            self._key_locks.clear()
+
+
+# Registry entries that hold a Chroma client or collection
+_CHROMA_RESOURCE_KINDS = ("chroma_client", "chroma_collection", "shard_index", "vector_index")
+
+def _release_chroma_system(persist_directory: str) -> bool:
+    # chromadb keeps one System per path for the whole process and hands it to every new
+    # PersistentClient, so a client opened again would still see the data as it was loaded.
+    # Returns True when the whole cache had to be cleared instead of this path's entry.
+    try:
+        from chromadb.api.shared_system_client import SharedSystemClient
+    except ImportError:
+        return False
+    systems = getattr(SharedSystemClient, "_identifier_to_system", None)
+    if not isinstance(systems, dict):
+        # The per-path cache is private and may be renamed; the public call drops every system
+        SharedSystemClient.clear_system_cache()
+        return True
+    for identifier in [identifier for identifier in systems if os.path.abspath(identifier) == persist_directory]:
+        system = systems.pop(identifier, None)
+        if system is None:
+            continue
+        # Closes its SQLite connections and executor threads; otherwise each release leaks a live System
+        try:
+            system.stop()
+        except Exception as e:
+            logger.warning("Error stopping the Chroma system for '%s': %s", identifier, e)
+    return False
+
+def local_index_directory(collection_name: str, persist_directory: str = "data/vector_store") -> str:
+    return os.path.join(persist_directory, "local_index", collection_name)
+
+_registry = ResourceRegistry()
+
+def get_registry() -> ResourceRegistry:
+    return _registry
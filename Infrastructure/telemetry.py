@@ -0,0 +1,305 @@
+import os
+import sys
+import time
+import uuid
+import bisect
+import random
+import asyncio
+import logging
+import threading
+import contextvars
+from collections import Counter
+from contextlib import contextmanager
+from typing import Any, Callable, Iterator
+
+# Structured, low-overhead instrumentation for the RAG pipeline:
+# - request ids carried in a context variable and added to every log record,
+# - per-stage latency histograms and counters, exported in the Prometheus text format,
+# - an opt-in sampling profiler that writes folded stacks for a fraction of the requests.
+
+logger = logging.getLogger(__name__)
+
+_request_id: contextvars.ContextVar[str | None] = contextvars.ContextVar("request_id", default=None)
+
+# Thread ident -> id of the request the thread is working for; other threads cannot read a context
+# variable, so this is what the sampling profiler uses to pick a request's threads
+_thread_requests: dict[int, str] = {}
+
+# Seconds; query stages are milliseconds, ingestion stages can take minutes
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 300.0)
+
+_METRIC_HELP = {
+    "rag_stage_seconds": "Time spent in each pipeline stage",
+    "rag_stage_total": "Pipeline stage executions by outcome",
+    "rag_stage_items_total": "Items (texts, rows, candidates) processed by each pipeline stage",
+    "rag_requests_total": "Query requests by entry point and outcome",
+    "rag_answer_cache_total": "Answer cache lookups by outcome"
+}
+
+def get_request_id() -> str | None:
+    return _request_id.get()
+
+def new_request_id() -> str:
+    return uuid.uuid4().hex[:16]
+
+@contextmanager
+def _attribute_thread(request_id: str | None) -> Iterator[None]:
+    thread_id = threading.get_ident()
+    previous = _thread_requests.get(thread_id)
+    if request_id is not None:
+        _thread_requests[thread_id] = request_id
+    try:
+        yield
+    finally:
+        if previous is None:
+            _thread_requests.pop(thread_id, None)
+        else:
+            _thread_requests[thread_id] = previous
+
+def bind_request(function: Callable[..., Any]) -> Callable[..., Any]:
+
+    # For work handed to another thread (executors, pipeline workers): runs function in a copy of the
+    # caller's context, so its logs carry the request id, and counts the thread as the request's
+    # while it runs, so the request's profile includes it
+    context = contextvars.copy_context()
+    request_id = _request_id.get()
+
+    def run(*args: Any, **kwargs: Any) -> Any:
+        with _attribute_thread(request_id):
+            return context.run(function, *args, **kwargs)
+    return run
+
+class _RequestIdFilter(logging.Filter):
+    def filter(self, record: logging.LogRecord) -> bool:
+        record.request_id = _request_id.get() or "-"
+        return True
+
+def configure_logging() -> None:
+
+    # Entry points (the Streamlit app, the query service) call this once; library modules only log.
+    # LOG_LEVEL defaults to INFO, so per-query DEBUG records cost a level check and nothing else.
+    root = logging.getLogger()
+    if not any(getattr(handler, "_rag_handler", False) for handler in root.handlers):
+        handler = logging.StreamHandler()
+        handler._rag_handler = True
+        handler.addFilter(_RequestIdFilter())
+        handler.setFormatter(logging.Formatter("%(asctime)s %(levelname)s %(name)s [%(request_id)s] %(message)s"))
+        root.addHandler(handler)
+    root.setLevel(os.getenv("LOG_LEVEL", "INFO").upper())
+
+class MetricsRegistry:
+
+    # Counters and fixed-bucket histograms keyed by (name, labels). One short lock and no I/O,
+    # so recording a stage costs a few microseconds.
+    def __init__(self, buckets: tuple[float, ...] = DEFAULT_BUCKETS) -> None:
+        self.buckets = buckets
+        self._lock = threading.Lock()
+        self._counters: dict[tuple[str, tuple[tuple[str, str], ...]], float] = {}
+        self._histograms: dict[tuple[str, tuple[tuple[str, str], ...]], list[float]] = {}
+
+    @staticmethod
+    def _key(name: str, labels: dict[str, Any]) -> tuple[str, tuple[tuple[str, str], ...]]:
+        return name, tuple(sorted((label, str(value)) for label, value in labels.items()))
+
+    def increment(self, name: str, value: float = 1.0, **labels: Any) -> None:
+        key = self._key(name, labels)
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0.0) + value
+
+    def observe(self, name: str, value: float, **labels: Any) -> None:
+        key = self._key(name, labels)
+        with self._lock:
+            # Per-bucket counts, then sum and count
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = [0.0] * (len(self.buckets) + 2)
+            bucket = bisect.bisect_left(self.buckets, value)
+            if bucket < len(self.buckets):
+                histogram[bucket] += 1
+            histogram[-2] += value
+            histogram[-1] += 1
+
+    def snapshot(self) -> dict[str, Any]:
+        with self._lock:
+            return {"counters": {self._format_name(name, labels): value for (name, labels), value in self._counters.items()},
+                    "histograms": {self._format_name(name, labels): {"sum": histogram[-2], "count": histogram[-1]}
+                                   for (name, labels), histogram in self._histograms.items()}}
+
+    @staticmethod
+    def _format_name(name: str, labels: tuple[tuple[str, str], ...]) -> str:
+        if len(labels) == 0:
+            return name
+        rendered = ",".join(f'{label}="{value}"'.replace("\n", " ") for label, value in labels)
+        return f"{name}{{{rendered}}}"
+
+    def render_prometheus(self) -> str:
+
+        with self._lock:
+            counters = sorted(self._counters.items())
+            histograms = sorted((key, list(histogram)) for key, histogram in self._histograms.items())
+
+        lines = []
+        described = set()
+        for (name, labels), value in counters:
+            if name not in described:
+                described.add(name)
+                lines += [f"# HELP {name} {_METRIC_HELP.get(name, name)}", f"# TYPE {name} counter"]
+            lines.append(f"{self._format_name(name, labels)} {value:g}")
+
+        for (name, labels), histogram in histograms:
+            if name not in described:
+                described.add(name)
+                lines += [f"# HELP {name} {_METRIC_HELP.get(name, name)}", f"# TYPE {name} histogram"]
+            cumulative = 0.0
+            for bound, count in zip(self.buckets, histogram):
+                cumulative += count
+                lines.append(f"{self._format_name(name + '_bucket', labels + (('le', f'{bound:g}'),))} {cumulative:g}")
+            lines.append(f"{self._format_name(name + '_bucket', labels + (('le', '+Inf'),))} {histogram[-1]:g}")
+            lines.append(f"{self._format_name(name + '_sum', labels)} {histogram[-2]:.6f}")
+            lines.append(f"{self._format_name(name + '_count', labels)} {histogram[-1]:g}")
+        return "\n".join(lines) + "\n"
+
+_metrics = MetricsRegistry()
+
+def get_metrics() -> MetricsRegistry:
+    return _metrics
+
+def record_stage(stage: str, seconds: float, outcome: str = "ok", items: int | None = None) -> None:
+    _metrics.observe("rag_stage_seconds", seconds, stage=stage)
+    _metrics.increment("rag_stage_total", stage=stage, outcome=outcome)
+    if items is not None:
+        _metrics.increment("rag_stage_items_total", items, stage=stage)
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug("stage=%s seconds=%.6f outcome=%s items=%s", stage, seconds, outcome, items)
+
+@contextmanager
+def stage(name: str, items: int | None = None) -> Iterator[None]:
+    start_time = time.perf_counter()
+    outcome = "ok"
+    try:
+        yield
+    except BaseException:
+        outcome = "error"
+        raise
+    finally:
+        record_stage(name, time.perf_counter() - start_time, outcome=outcome, items=items)
+
+class SamplingProfiler:
+
+    # Statistical profiler: a daemon thread snapshots Python stacks each interval and counts the folded
+    # stacks ("a;b;c 42"), the input format of flamegraph.pl and speedscope. With a request_id only
+    # the threads working for that request are sampled (see bind_request), otherwise every other thread.
+    def __init__(self, interval_ms: float = 5.0, max_depth: int = 64, request_id: str | None = None) -> None:
+        self.interval_seconds = interval_ms / 1000.0
+        self.max_depth = max_depth
+        self.request_id = request_id
+        self.samples: Counter[str] = Counter()
+        self._stop_event = threading.Event()
+        self._thread: threading.Thread | None = None
+
+    def _sample(self) -> None:
+        own_thread = threading.get_ident()
+        for thread_id, frame in sys._current_frames().items():
+            if thread_id == own_thread:
+                continue
+            if self.request_id is not None and _thread_requests.get(thread_id) != self.request_id:
+                continue
+            stack = []
+            while frame is not None and len(stack) < self.max_depth:
+                code = frame.f_code
+                stack.append(f"{os.path.basename(code.co_filename)}:{code.co_name}")
+                frame = frame.f_back
+            self.samples[";".join(reversed(stack))] += 1
+
+    def _run(self) -> None:
+        while not self._stop_event.wait(self.interval_seconds):
+            self._sample()
+
+    def start(self) -> None:
+        self._thread = threading.Thread(target=self._run, name="sampling-profiler", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop_event.set()
+        if self._thread is not None:
+            self._thread.join()
+
+    def write_folded(self, path: str) -> None:
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        with open(path, "w", encoding="utf-8") as folded_file:
+            for stack, count in self.samples.most_common():
+                folded_file.write(f"{stack} {count}\n")
+
+def _start_profiler_if_sampled(request_id: str) -> SamplingProfiler | None:
+    # PROFILE_SAMPLE_RATE=0.01 profiles one request in a hundred; off by default
+    sample_rate = float(os.getenv("PROFILE_SAMPLE_RATE", "0"))
+    if sample_rate <= 0 or random.random() >= sample_rate:
+        return None
+    profiler = SamplingProfiler(interval_ms=float(os.getenv("PROFILE_INTERVAL_MS", "5")), request_id=request_id)
+    profiler.start()
+    return profiler
+
+@contextmanager
+def request_scope(request_id: str | None = None, entry_point: str = "query") -> Iterator[str]:
+
+    # Binds a request id for the logs of everything called inside, counts the request and times it
+    request_id = request_id or new_request_id()
+    token = _request_id.set(request_id)
+    # An event loop thread serves every request in turn, so only a thread without one is the request's own
+    try:
+        asyncio.get_running_loop()
+        own_thread = None
+    except RuntimeError:
+        own_thread = request_id
+    profiler = _start_profiler_if_sampled(request_id)
+    start_time = time.perf_counter()
+    outcome = "ok"
+    try:
+        with _attribute_thread(own_thread):
+            yield request_id
+    except GeneratorExit:
+        # A streamed answer abandoned by its consumer
+        outcome = "cancelled"
+        raise
+    except BaseException:
+        outcome = "error"
+        raise
+    finally:
+        record_stage("request", time.perf_counter() - start_time, outcome=outcome)
+        _metrics.increment("rag_requests_total", entry_point=entry_point, outcome=outcome)
+        if profiler is not None:
+            profiler.stop()
+            path = os.path.join(os.getenv("PROFILE_OUTPUT_DIR", "data/profiles"), f"{request_id}.folded")
+            profiler.write_folded(path)
+            logger.info("Profile of request %s written to %s", request_id, path)
+        try:
+            _request_id.reset(token)
+        except (ValueError, RuntimeError):
+            # Closed from another context, e.g. an abandoned generator collected later
+            pass
+
+def start_metrics_server(port: int, host: str = "0.0.0.0") -> Any:
+
+    # Serves GET /metrics for processes without their own HTTP server (the Streamlit app)
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    class MetricsHandler(BaseHTTPRequestHandler):
+        def do_GET(self) -> None:
+            if self.path.split("?")[0] != "/metrics":
+                self.send_error(404)
+                return
+            body = _metrics.render_prometheus().encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format: str, *args: Any) -> None:
+            return
+
+    server = ThreadingHTTPServer((host, port), MetricsHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name="metrics-server", daemon=True).start()
+    logger.info("Prometheus metrics served on http://%s:%d/metrics", host, port)
+    return server
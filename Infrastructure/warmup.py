@@ -0,0 +1,108 @@
+import os
+import time
+import logging
+import importlib
+import threading
+from contextlib import contextmanager
+from typing import Any, Iterator
+
+from Infrastructure.telemetry import record_stage
+
+logger = logging.getLogger(__name__)
+
+# Cold-start accounting and background pre-warming. Entry points import heavy libraries (torch,
+# sentence-transformers, chromadb, openai, azure) only when a feature first needs them; warm_up()
+# pays those costs on a background thread right after start-up, so the first query does not.
+
+class StartupReport:
+
+    # Seconds per start-up step ("app_imports", "embedding_model", ...), safe to read while warming
+    def __init__(self) -> None:
+        self.created_at = time.perf_counter()
+        self.steps: dict[str, dict[str, Any]] = {}
+        self.ready_seconds: float | None = None
+        self.ready = threading.Event()
+        self._lock = threading.Lock()
+
+    def record(self, name: str, seconds: float, status: str = "ok", error: str | None = None) -> None:
+        with self._lock:
+            # A step is reported once, by the process start that paid for it
+            if name not in self.steps:
+                self.steps[name] = {"seconds": seconds, "status": status, "error": error}
+
+    @contextmanager
+    def step(self, name: str) -> Iterator[None]:
+        start_time = time.perf_counter()
+        try:
+            yield
+        except Exception as e:
+            seconds = time.perf_counter() - start_time
+            self.record(name, seconds, status="error", error=f"{type(e).__name__}: {e}")
+            record_stage("warmup", seconds, outcome="error")
+            logger.warning("Warm-up step '%s' failed after %.2fs: %s", name, seconds, e)
+            return
+        seconds = time.perf_counter() - start_time
+        self.record(name, seconds)
+        record_stage("warmup", seconds)
+        logger.info("Warm-up step '%s' took %.2fs", name, seconds)
+
+    def mark_ready(self) -> None:
+        with self._lock:
+            self.ready_seconds = time.perf_counter() - self.created_at
+        self.ready.set()
+        logger.info("Warm-up finished %.2fs after start-up", self.ready_seconds)
+
+    def snapshot(self) -> dict[str, Any]:
+        with self._lock:
+            return {"ready": self.ready.is_set(), "ready_seconds": self.ready_seconds,
+                    "steps": {name: dict(step) for name, step in self.steps.items()}}
+
+_startup_report = StartupReport()
+
+def get_startup_report() -> StartupReport:
+    return _startup_report
+
+def warm_up(namespace: str | None = None, persist_directory: str = "data/vector_store",
+            collection_name: str = "pdf_documents") -> StartupReport:
+
+    from Infrastructure.resource_registry import get_registry
+    from Services.NamespaceLayout import DEFAULT_NAMESPACE, NamespaceLayout
+
+    # Same order as a first query: code, embedding model, indexes, LLM client. A failing step (e.g.
+    # a namespace that was never ingested) is recorded and the rest still runs.
+    registry = get_registry()
+    report = _startup_report
+    with report.step("import Services.ProcessSearchResults"):
+        importlib.import_module("Services.ProcessSearchResults")
+
+    embedding_manager = None
+    with report.step("embedding_model"):
+        embedding_manager = registry.get_embedding_manager(model_name=os.getenv("Embedding_Model_Name", "all-MiniLM-L6-v2"))
+    if embedding_manager is not None:
+        with report.step("first_encode"):
+            embedding_manager.warm_up()
+
+    layout = NamespaceLayout(namespace=namespace or DEFAULT_NAMESPACE, base_persist_directory=persist_directory,
+                             collection_name=collection_name)
+    if os.path.isdir(layout.persist_directory):
+        with report.step("vector_index"):
+            registry.get_vector_index(collection_name=layout.collection_name, persist_directory=layout.persist_directory)
+        with report.step("lexical_index"):
+            registry.get_retrieval_lexical_index(collection_name=layout.collection_name,
+                                                 persist_directory=layout.persist_directory)
+    with report.step("reranker"):
+        registry.get_retrieval_reranker()
+    with report.step("llm_client"):
+        registry.get_llm_client()
+
+    report.mark_ready()
+    return report
+
+def start_warm_up(**warm_up_arguments: Any) -> threading.Thread | None:
+    # PREWARM_ENABLED=false keeps start-up lazy: everything is then loaded by the first query
+    if os.getenv("PREWARM_ENABLED", "true").lower() == "false":
+        _startup_report.mark_ready()
+        return None
+    thread = threading.Thread(target=warm_up, kwargs=warm_up_arguments, name="warm-up", daemon=True)
+    thread.start()
+    return thread
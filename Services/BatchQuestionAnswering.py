@@ -0,0 +1,332 @@
+import os
+import json
+import time
+import hashlib
+import logging
+import argparse
+import threading
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from typing import Any
+
+from Services.RetrieverPipeline import RetrieverPipeline
+from Services.ProcessSearchResults import build_messages
+from Services.MetadataFilter import build_where
+from Services.NamespaceLayout import DEFAULT_NAMESPACE, NamespaceLayout
+from Infrastructure.resource_registry import get_registry
+from Infrastructure.telemetry import configure_logging, get_request_id, request_scope, stage
+
+logger = logging.getLogger(__name__)
+
+# Bulk question answering for evaluations and reports:
+#   python main.py batch --input questions.txt --output answers.jsonl
+# Questions are retrieved in blocks (one batched encode and one multi-query vector search per block),
+# answers are generated concurrently under request and token rate limits, and every record is
+# appended to the JSONL output as soon as it is done, so a restarted run skips what is already there.
+
+# Records with these statuses are final; failed questions are tried again by the next run
+FINAL_STATUSES = ("ok", "no_results")
+
+class TokenBucketRateLimiter:
+
+    # Requests and tokens per minute as two token buckets. Tokens are reserved with an estimate
+    # before a call and corrected with the reported usage after it.
+    def __init__(self, requests_per_minute: float = 0.0, tokens_per_minute: float = 0.0) -> None:
+        self.requests_per_minute = requests_per_minute
+        self.tokens_per_minute = tokens_per_minute
+        self._requests = requests_per_minute
+        self._tokens = tokens_per_minute
+        self._updated_at = time.monotonic()
+        self._condition = threading.Condition()
+
+    def _refill(self) -> None:
+        # Caller holds the condition
+        now = time.monotonic()
+        elapsed_minutes = (now - self._updated_at) / 60.0
+        self._updated_at = now
+        if self.requests_per_minute > 0:
+            self._requests = min(self.requests_per_minute, self._requests + elapsed_minutes * self.requests_per_minute)
+        if self.tokens_per_minute > 0:
+            self._tokens = min(self.tokens_per_minute, self._tokens + elapsed_minutes * self.tokens_per_minute)
+
+    def _wait_seconds(self, tokens: float) -> float:
+        # Caller holds the condition; a request larger than the bucket waits for a full bucket only
+        waits = [0.0]
+        if self.requests_per_minute > 0 and self._requests < 1:
+            waits.append((1 - self._requests) * 60.0 / self.requests_per_minute)
+        needed_tokens = min(tokens, self.tokens_per_minute)
+        if self.tokens_per_minute > 0 and self._tokens < needed_tokens:
+            waits.append((needed_tokens - self._tokens) * 60.0 / self.tokens_per_minute)
+        return max(waits)
+
+    def acquire(self, tokens: float) -> None:
+        with self._condition:
+            while True:
+                self._refill()
+                wait_seconds = self._wait_seconds(tokens)
+                if wait_seconds <= 0:
+                    break
+                self._condition.wait(wait_seconds)
+            if self.requests_per_minute > 0:
+                self._requests -= 1
+            if self.tokens_per_minute > 0:
+                self._tokens -= tokens
+
+    def settle(self, estimated_tokens: float, actual_tokens: float) -> None:
+        if self.tokens_per_minute <= 0:
+            return
+        with self._condition:
+            # Can go negative after an underestimate; the next callers then wait for the refill
+            self._tokens = min(self.tokens_per_minute, self._tokens + estimated_tokens - actual_tokens)
+            self._condition.notify_all()
+
+def question_id(question: str) -> str:
+    return hashlib.sha256(question.strip().encode("utf-8")).hexdigest()[:16]
+
+def read_questions(input_path: str) -> list[dict[str, str]]:
+
+    # .jsonl: {"question": ..., "id": optional}; anything else: one question per line.
+    # Without an explicit id the question text is the id, so edits to the file do not break resume.
+    questions: dict[str, dict[str, str]] = {}
+    with open(input_path, "r", encoding="utf-8") as input_file:
+        for line_number, line in enumerate(input_file, start=1):
+            line = line.strip()
+            if not line:
+                continue
+            if input_path.endswith(".jsonl"):
+                try:
+                    item = json.loads(line)
+                except json.JSONDecodeError as e:
+                    raise ValueError(f"{input_path}:{line_number} is not valid JSON: {e}")
+                question = str(item.get("question", "")).strip()
+                item_id = str(item.get("id") or question_id(question))
+            else:
+                question, item_id = line, question_id(line)
+            if question and item_id not in questions:
+                questions[item_id] = {"id": item_id, "question": question}
+    return list(questions.values())
+
+def completed_ids(output_path: str) -> set[str]:
+    # The last record per id wins; a line cut off by a crash is ignored and its question redone
+    statuses: dict[str, str] = {}
+    if os.path.exists(output_path):
+        with open(output_path, "r", encoding="utf-8") as output_file:
+            for line in output_file:
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError:
+                    continue
+                statuses[record.get("id")] = record.get("status")
+    return {record_id for record_id, status in statuses.items() if status in FINAL_STATUSES}
+
+class BatchQuestionAnswering:
+
+    def __init__(self,
+                 namespace: str = DEFAULT_NAMESPACE,
+                 top_k: int = 3,
+                 where: dict | None = None,
+                 concurrency: int = 8,
+                 requests_per_minute: float = 0.0,
+                 tokens_per_minute: float = 0.0,
+                 max_total_tokens: int = 0,
+                 retrieval_batch_size: int = 256,
+                 search_batch_size: int = 64,
+                 max_completion_tokens: int | None = None,
+                 expected_completion_tokens: int = 300) -> None:
+        self.layout = NamespaceLayout(namespace=namespace)
+        self.top_k = top_k
+        # Optional metadata filter (see MetadataFilter.build_where) applied to every question
+        self.where = where
+        self.concurrency = concurrency
+        self.rate_limiter = TokenBucketRateLimiter(requests_per_minute, tokens_per_minute)
+        # 0 means unlimited; once the run has spent or reserved this many tokens no new call starts
+        self.max_total_tokens = max_total_tokens
+        self.retrieval_batch_size = retrieval_batch_size
+        self.search_batch_size = search_batch_size
+        self.max_completion_tokens = max_completion_tokens
+        self.expected_completion_tokens = expected_completion_tokens
+        self.model_name = os.getenv("Model", "gpt-5")
+        self._budget_lock = threading.Lock()
+        self._tokens_spent = 0
+        self._tokens_reserved = 0
+
+    def _retriever_pipeline(self) -> RetrieverPipeline:
+        registry = get_registry()
+        return RetrieverPipeline(
+            vector_store=registry.get_vector_index(collection_name=self.layout.collection_name,
+                                                   persist_directory=self.layout.persist_directory),
+            embeddings=registry.get_embedding_manager(model_name=os.getenv("Embedding_Model_Name", "all-MiniLM-L6-v2")),
+            lexical_index=registry.get_retrieval_lexical_index(collection_name=self.layout.collection_name,
+                                                               persist_directory=self.layout.persist_directory),
+            reranker=registry.get_retrieval_reranker())
+
+    def _estimate_tokens(self, question: str, timings: dict[str, Any]) -> int:
+        context_builder = get_registry().get_context_builder()
+        return timings.get("context_tokens", 0) + context_builder.count_tokens(question) + 50 + self.expected_completion_tokens
+
+    def _reserve(self, tokens: int) -> bool:
+        with self._budget_lock:
+            if self.max_total_tokens > 0 and self._tokens_spent + self._tokens_reserved + tokens > self.max_total_tokens:
+                return False
+            self._tokens_reserved += tokens
+            return True
+
+    def _release(self, reserved_tokens: int, spent_tokens: int) -> None:
+        with self._budget_lock:
+            self._tokens_reserved -= reserved_tokens
+            self._tokens_spent += spent_tokens
+
+    @staticmethod
+    def _sources(results: list[dict]) -> list[dict[str, Any]]:
+        return [{"id": doc["id"], "source": doc["metadata"].get("source"), "page_number": doc["metadata"].get("page_number"),
+                 "similarity_score": doc["similarity_score"]} for doc in results]
+
+    def _answer(self, item: dict[str, str], results: list[dict], messages: list[dict[str, str]],
+                estimated_tokens: int, timings: dict[str, Any]) -> dict[str, Any]:
+
+        with request_scope(entry_point="batch"):
+            record = {"id": item["id"], "question": item["question"], "sources": self._sources(results),
+                      "request_id": get_request_id()}
+            spent_tokens = 0
+            try:
+                self.rate_limiter.acquire(estimated_tokens)
+                completion_arguments = {}
+                if self.max_completion_tokens:
+                    completion_arguments["max_completion_tokens"] = self.max_completion_tokens
+                generation_start = time.perf_counter()
+                with stage("llm_generation"):
+                    response = get_registry().get_llm_client().chat.completions.create(
+                        model=self.model_name, messages=messages, **completion_arguments)
+                timings["generation_seconds"] = time.perf_counter() - generation_start
+
+                usage = getattr(response, "usage", None)
+                spent_tokens = getattr(usage, "total_tokens", None) or estimated_tokens
+                record.update({"status": "ok", "answer": response.choices[0].message.content,
+                               "usage": {"prompt_tokens": getattr(usage, "prompt_tokens", None),
+                                         "completion_tokens": getattr(usage, "completion_tokens", None)}})
+            except Exception as e:
+                logger.error("Question %s failed: %s", item["id"], e)
+                record.update({"status": "error", "error": f"{type(e).__name__}: {e}"})
+            finally:
+                self.rate_limiter.settle(estimated_tokens, spent_tokens)
+                self._release(estimated_tokens, spent_tokens)
+
+            record["timings"] = timings
+            return record
+
+    def run(self, input_path: str, output_path: str) -> dict[str, Any]:
+
+        questions = read_questions(input_path)
+        done = completed_ids(output_path)
+        pending = [item for item in questions if item["id"] not in done]
+        summary = {"questions": len(questions), "already_done": len(questions) - len(pending),
+                   "ok": 0, "no_results": 0, "error": 0, "not_started": 0}
+        logger.info("%d of %d questions to answer, %d already in %s", len(pending), len(questions),
+                    summary["already_done"], output_path)
+        if len(pending) == 0:
+            return summary
+
+        os.makedirs(os.path.dirname(output_path) or ".", exist_ok=True)
+        pipeline = self._retriever_pipeline()
+        start_time = time.perf_counter()
+        in_flight: set[Future] = set()
+        executor = ThreadPoolExecutor(max_workers=self.concurrency, thread_name_prefix="batch-llm")
+
+        with open(output_path, "a", encoding="utf-8") as output_file:
+
+            def write(record: dict[str, Any]) -> None:
+                # One line per question, flushed at once so a crash loses at most the lines in flight
+                output_file.write(json.dumps(record, ensure_ascii=False) + "\n")
+                output_file.flush()
+                summary[record["status"]] += 1
+
+            def drain(limit: int) -> None:
+                nonlocal in_flight
+                while len(in_flight) > limit:
+                    finished, in_flight = wait(in_flight, return_when=FIRST_COMPLETED)
+                    for future in finished:
+                        write(future.result())
+
+            try:
+                budget_exhausted = False
+                for block_start in range(0, len(pending), self.retrieval_batch_size):
+                    block = pending[block_start:block_start + self.retrieval_batch_size]
+                    retrieval_start = time.perf_counter()
+                    with stage("retrieve", items=len(block)):
+                        block_results = pipeline.retrieve_batch([item["question"] for item in block], self.top_k,
+                                                                where=self.where, search_batch_size=self.search_batch_size)
+                    retrieval_seconds = (time.perf_counter() - retrieval_start) / len(block)
+
+                    for position, (item, results) in enumerate(zip(block, block_results)):
+                        timings: dict[str, Any] = {"retrieval_seconds": retrieval_seconds}
+                        if len(results) == 0:
+                            write({"id": item["id"], "question": item["question"], "status": "no_results",
+                                   "answer": None, "sources": [], "timings": timings})
+                            continue
+
+                        messages = build_messages(item["question"], results, timings)
+                        estimated_tokens = self._estimate_tokens(item["question"], timings)
+                        if not self._reserve(estimated_tokens):
+                            summary["not_started"] = len(pending) - block_start - position
+                            budget_exhausted = True
+                            break
+                        in_flight.add(executor.submit(self._answer, item, results, messages, estimated_tokens, timings))
+
+                    if budget_exhausted:
+                        logger.warning("Token budget of %d reached, %d questions left for the next run",
+                                       self.max_total_tokens, summary["not_started"])
+                        break
+                    # Retrieval of the next block overlaps with generation for this one
+                    drain(self.retrieval_batch_size)
+                drain(0)
+            finally:
+                # Interrupted: answers already written are kept, queued calls are dropped
+                executor.shutdown(wait=True, cancel_futures=True)
+
+        summary["tokens_spent"] = self._tokens_spent
+        summary["seconds"] = time.perf_counter() - start_time
+        logger.info("Batch finished: %s", summary)
+        return summary
+
+def parse_arguments(argv: list[str] | None = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Answer a file of questions and write the answers as JSONL")
+    parser.add_argument("--input", required=True, help="one question per line, or .jsonl with {\"id\", \"question\"}")
+    parser.add_argument("--output", default=None, help="JSONL answers, appended to and resumed from (default data/batch/<input>_answers.jsonl)")
+    parser.add_argument("--namespace", default=DEFAULT_NAMESPACE)
+    parser.add_argument("--top-k", type=int, default=3)
+    parser.add_argument("--sources", default=None, help="comma separated source files to restrict retrieval to")
+    parser.add_argument("--concurrency", type=int, default=int(os.getenv("BATCH_CONCURRENCY", "8")))
+    parser.add_argument("--requests-per-minute", type=float, default=float(os.getenv("BATCH_REQUESTS_PER_MINUTE", "0")),
+                        help="0 = no limit")
+    parser.add_argument("--tokens-per-minute", type=float, default=float(os.getenv("BATCH_TOKENS_PER_MINUTE", "0")),
+                        help="0 = no limit")
+    parser.add_argument("--max-total-tokens", type=int, default=int(os.getenv("BATCH_MAX_TOTAL_TOKENS", "0")),
+                        help="stop starting new questions once this many tokens are spent; 0 = no limit")
+    parser.add_argument("--retrieval-batch-size", type=int, default=256, help="questions encoded and searched per block")
+    parser.add_argument("--search-batch-size", type=int, default=64, help="query vectors per vector search call")
+    parser.add_argument("--max-completion-tokens", type=int, default=None)
+    parser.add_argument("--expected-completion-tokens", type=int, default=300, help="completion size assumed when reserving tokens")
+    return parser.parse_args(argv)
+
+def main(argv: list[str] | None = None) -> dict[str, Any]:
+
+    configure_logging()
+    args = parse_arguments(argv)
+    output = args.output or os.path.join("data", "batch", f"{os.path.splitext(os.path.basename(args.input))[0]}_answers.jsonl")
+    batch = BatchQuestionAnswering(namespace=args.namespace,
+                                   top_k=args.top_k,
+                                   where=build_where(sources=args.sources.split(",") if args.sources else None),
+                                   concurrency=args.concurrency,
+                                   requests_per_minute=args.requests_per_minute,
+                                   tokens_per_minute=args.tokens_per_minute,
+                                   max_total_tokens=args.max_total_tokens,
+                                   retrieval_batch_size=args.retrieval_batch_size,
+                                   search_batch_size=args.search_batch_size,
+                                   max_completion_tokens=args.max_completion_tokens,
+                                   expected_completion_tokens=args.expected_completion_tokens)
+    summary = batch.run(args.input, output)
+    print(json.dumps(summary, indent=2))
+    print(f"Answers written to {output}")
+    return summary
+
+if __name__ == "__main__":
+    main()
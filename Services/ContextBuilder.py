@@ -0,0 +1,112 @@
+from typing import Any
+
+from Utilities.tokenization import get_encoding
+
+class ContextBuilder:
+
+    # Packs retrieved chunks into a prompt context of at most token_budget tokens.
+    # Chunks that follow each other in the same file are merged and the overlap the splitter
+    # repeated between them (chunk_size_overlap) is kept once; passages go in by best rank, i.e. the
+    # order of the results, which is the re-ranker's, the fused or the vector ranking.
+    def __init__(self,
+                 model_name: str = "gpt-5",
+                 token_budget: int = 3000,
+                 separator: str = "\n\n",
+                 min_overlap_chars: int = 16) -> None:
+        self.model_name = model_name
+        self.token_budget = token_budget
+        self.separator = separator
+        self.min_overlap_chars = min_overlap_chars
+        self.encoding = get_encoding(model_name)
+
+    def count_tokens(self, text: str) -> int:
+        return len(self.encoding.encode(text, disallowed_special=()))
+
+    def _overlap_length(self, left: str, right: str) -> int:
+        # Longest suffix of left that is also a prefix of right
+        probe = right[:self.min_overlap_chars]
+        if len(probe) < self.min_overlap_chars:
+            return 0
+
+        start = max(0, len(left) - len(right))
+        position = left.find(probe, start)
+        while position != -1:
+            if right.startswith(left[position:]):
+                return len(left) - position
+            position = left.find(probe, position + 1)
+        return 0
+
+    def _merge_text(self, left: str, right: str) -> str:
+        overlap = self._overlap_length(left, right)
+        if overlap > 0:
+            return left + right[overlap:]
+        return left + self.separator + right
+
+    @staticmethod
+    def _position(doc: dict) -> tuple[str, int | None]:
+        metadata = doc.get('metadata') or {}
+        chunk_index = metadata.get('chunk_index')
+        return str(metadata.get('source', '')), int(chunk_index) if chunk_index is not None else None
+
+    def _passages(self, results: list[dict]) -> list[dict[str, Any]]:
+
+        # Exact duplicates (e.g. the same chunk under two ids) are only kept once
+        unique_docs = []
+        seen_texts = set()
+        for rank, doc in enumerate(results):
+            if doc['text'] not in seen_texts:
+                seen_texts.add(doc['text'])
+                unique_docs.append((rank, doc))
+
+        # Chunks without a chunk_index (ingested before it was stored) stay single passages
+        ordered = sorted(unique_docs, key=lambda item: (self._position(item[1])[0], self._position(item[1])[1] or 0))
+        passages: list[dict[str, Any]] = []
+        previous_position = None
+        for rank, doc in ordered:
+            source, chunk_index = self._position(doc)
+            if (passages and chunk_index is not None and previous_position is not None
+                    and previous_position == (source, chunk_index - 1)):
+                passage = passages[-1]
+                passage["text"] = self._merge_text(passage["text"], doc['text'])
+                passage["ids"].append(doc['id'])
+                passage["rank"] = min(passage["rank"], rank)
+            else:
+                passages.append({"text": doc['text'], "ids": [doc['id']], "rank": rank, "source": source})
+            previous_position = (source, chunk_index) if chunk_index is not None else None
+
+        # Best passage first, so a tight budget drops the weakest evidence
+        passages.sort(key=lambda passage: passage["rank"])
+        return passages
+
+    def build(self, results: list[dict]) -> tuple[str, dict[str, int]]:
+
+        naive_tokens = self.count_tokens(self.separator.join(doc['text'] for doc in results))
+        separator_tokens = self.count_tokens(self.separator)
+
+        selected_texts = []
+        used_tokens = 0
+        dropped_passages = 0
+        for passage in self._passages(results):
+            passage_tokens = self.count_tokens(passage["text"])
+            extra_tokens = passage_tokens + (separator_tokens if selected_texts else 0)
+            if used_tokens + extra_tokens <= self.token_budget:
+                selected_texts.append(passage["text"])
+                used_tokens += extra_tokens
+            elif not selected_texts:
+                # A single passage over the budget is cut rather than leaving the context empty
+                tokens = self.encoding.encode(passage["text"], disallowed_special=())[:self.token_budget]
+                selected_texts.append(self.encoding.decode(tokens))
+                used_tokens = len(tokens)
+            else:
+                dropped_passages += 1
+
+        context = self.separator.join(selected_texts)
+        context_tokens = self.count_tokens(context)
+        return context, {
+            "chunks": len(results),
+            "passages": len(selected_texts),
+            "dropped_passages": dropped_passages,
+            "naive_context_tokens": naive_tokens,
+            "context_tokens": context_tokens,
+            "context_tokens_saved": max(naive_tokens - context_tokens, 0)
+        }
@@ -1,35 +1,302 @@
 from sentence_transformers import SentenceTransformer
+from concurrent.futures import Future
+from typing import Any, Callable
 import numpy as np
-import summarizer as sb
+import logging
+import queue
+import threading
+import time
+import os
+import re
+
+from Infrastructure.telemetry import stage
+
+logger = logging.getLogger(__name__)
+
+# Below line is used only for testing purpose of EmbeddingManager class
+# import summarizer as sb
+
+class EmbeddingBatcher:
+
+    # Collects concurrent single-text encode requests for up to max_wait_ms (or max_batch_size texts)
+    # and runs them as one batched encode; every caller gets back its own vector.
+    def __init__(self, encode_batch: Callable[[list[str]], np.ndarray], max_batch_size: int = 32, max_wait_ms: float = 5.0) -> None:
+        self.encode_batch = encode_batch
+        self.max_batch_size = max_batch_size
+        self.max_wait_seconds = max_wait_ms / 1000.0
+        self.counters = {"requests": 0, "batches": 0, "largest_batch": 0}
+        self.batch_size_histogram: dict[int, int] = {}
+        self._queue: queue.Queue = queue.Queue()
+        self._lock = threading.Lock()
+        self._worker = threading.Thread(target=self._run, name="embedding-batcher", daemon=True)
+        self._worker.start()
+
+    def submit(self, text: str) -> Future:
+        future: Future = Future()
+        self._queue.put((text, future))
+        return future
+
+    def _collect_batch(self) -> list[tuple[str, Future]]:
+        batch = [self._queue.get()]
+        deadline = time.perf_counter() + self.max_wait_seconds
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.perf_counter()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self._queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self) -> None:
+        while True:
+            batch = self._collect_batch()
+            texts = [text for text, _ in batch]
+            try:
+                embeddings = self.encode_batch(texts)
+                for (_, future), embedding in zip(batch, embeddings):
+                    future.set_result(embedding)
+                # A caller without a vector would otherwise wait forever
+                if len(embeddings) < len(batch):
+                    raise RuntimeError(f"Encoder returned {len(embeddings)} vectors for {len(batch)} texts")
+            except Exception as e:
+                for _, future in batch:
+                    if not future.done():
+                        future.set_exception(e)
+
+            with self._lock:
+                self.counters["requests"] += len(batch)
+                self.counters["batches"] += 1
+                self.counters["largest_batch"] = max(self.counters["largest_batch"], len(batch))
+                self.batch_size_histogram[len(batch)] = self.batch_size_histogram.get(len(batch), 0) + 1
+
+    def stats(self) -> dict[str, Any]:
+        with self._lock:
+            batches = self.counters["batches"]
+            return {
+                **self.counters,
+                "queue_depth": self._queue.qsize(),
+                "average_batch_size": self.counters["requests"] / batches if batches > 0 else 0.0,
+                "batch_size_histogram": dict(self.batch_size_histogram),
+                "max_batch_size": self.max_batch_size,
+                "max_wait_ms": self.max_wait_seconds * 1000.0
+            }
+
+EMBEDDING_BACKENDS = ("torch", "torch-int8", "onnx", "onnx-int8")
+
+class OnnxSentenceEncoder:
+
+    # Runs the transformer of a SentenceTransformer as an ONNX Runtime graph (optionally with int8
+    # dynamically quantized weights) and keeps the model's own tokenizer, pooling and normalization,
+    # so the vectors match the PyTorch model up to numerical drift. The graph is exported once per
+    # model and reused from onnx_directory.
+    def __init__(self, model: SentenceTransformer, model_name: str, quantize: bool = False,
+                 onnx_directory: str = "data/models/onnx", num_threads: int = 0, batch_size: int = 32) -> None:
+        self.model = model
+        self.batch_size = batch_size
+        model_directory = os.path.join(onnx_directory, re.sub(r"[^A-Za-z0-9_.-]+", "_", model_name))
+        self.model_path = self._export(model_directory)
+        if quantize:
+            self.model_path = self._quantize(self.model_path, os.path.join(model_directory, "model_int8.onnx"))
+        self.session = self._create_session(self.model_path, num_threads)
+        self.input_names = [session_input.name for session_input in self.session.get_inputs()]
+
+    def _export(self, model_directory: str) -> str:
+        import torch
+
+        model_path = os.path.join(model_directory, "model.onnx")
+        if os.path.exists(model_path):
+            return model_path
+
+        os.makedirs(model_directory, exist_ok=True)
+        features = self.model.tokenize(["export"])
+        input_names = [name for name in ("input_ids", "attention_mask", "token_type_ids") if name in features]
+
+        # Inputs by name, so the graph does not depend on the positional order of forward()
+        class TransformerGraph(torch.nn.Module):
+            def __init__(self, auto_model: torch.nn.Module) -> None:
+                super().__init__()
+                self.auto_model = auto_model
+
+            def forward(self, *inputs: torch.Tensor) -> torch.Tensor:
+                return self.auto_model(**dict(zip(input_names, inputs)), return_dict=True).last_hidden_state
+
+        transformer = TransformerGraph(self.model[0].auto_model).eval()
+        dynamic_axes = {name: {0: "batch", 1: "sequence"} for name in input_names}
+        dynamic_axes["last_hidden_state"] = {0: "batch", 1: "sequence"}
+
+        # Written next to the target and renamed, so a concurrent loader never sees half a file
+        temporary_path = f"{model_path}.{os.getpid()}.tmp"
+        with torch.inference_mode():
+            torch.onnx.export(transformer, tuple(features[name] for name in input_names), temporary_path,
+                              input_names=input_names, output_names=["last_hidden_state"],
+                              dynamic_axes=dynamic_axes, opset_version=17, dynamo=False)
+        os.replace(temporary_path, model_path)
+        logger.info("Exported ONNX graph to %s", model_path)
+        return model_path
+
+    @staticmethod
+    def _quantize(model_path: str, quantized_path: str) -> str:
+        from onnxruntime.quantization import QuantType, quantize_dynamic
+
+        if not os.path.exists(quantized_path):
+            temporary_path = f"{quantized_path}.{os.getpid()}.tmp"
+            quantize_dynamic(model_path, temporary_path, weight_type=QuantType.QInt8)
+            os.replace(temporary_path, quantized_path)
+            logger.info("Quantized ONNX graph written to %s", quantized_path)
+        return quantized_path
+
+    @staticmethod
+    def _create_session(model_path: str, num_threads: int) -> Any:
+        import onnxruntime
+
+        options = onnxruntime.SessionOptions()
+        options.graph_optimization_level = onnxruntime.GraphOptimizationLevel.ORT_ENABLE_ALL
+        if num_threads > 0:
+            options.intra_op_num_threads = num_threads
+        options.inter_op_num_threads = 1
+        return onnxruntime.InferenceSession(model_path, sess_options=options, providers=["CPUExecutionProvider"])
+
+    def encode(self, texts: list[str]) -> np.ndarray:
+        import torch
+
+        # Length bucketing: batches of similar length, each padded only to its own longest text
+        order = np.argsort([len(text) for text in texts], kind="stable")
+        embeddings: list[np.ndarray | None] = [None] * len(texts)
+        with torch.inference_mode():
+            for batch_start in range(0, len(texts), self.batch_size):
+                batch = order[batch_start:batch_start + self.batch_size]
+                features = self.model.tokenize([texts[i] for i in batch])
+                token_embeddings = self.session.run(
+                    None, {name: features[name].numpy().astype(np.int64) for name in self.input_names})[0]
+
+                # Pooling and normalization are the model's own modules after the transformer
+                features["token_embeddings"] = torch.from_numpy(token_embeddings)
+                for module in list(self.model)[1:]:
+                    features = module(features)
+                for i, embedding in zip(batch, features["sentence_embedding"].numpy()):
+                    embeddings[i] = embedding
+
+        return np.vstack(embeddings).astype(np.float32, copy=False) if len(texts) > 0 else np.array([])
 
 class EmbeddingManager:
     
-    def __init__(self, model_name : str = "all-MiniLM-L6-v2") -> None:
+    def __init__(self,
+                 model_name : str = "all-MiniLM-L6-v2",
+                 cache: Any = None,
+                 backend: str = "torch",
+                 num_threads: int = 0,
+                 batch_size: int = 32,
+                 onnx_directory: str = "data/models/onnx") -> None:
+        if backend not in EMBEDDING_BACKENDS:
+            raise ValueError(f"Unknown embedding backend '{backend}', expected one of {', '.join(EMBEDDING_BACKENDS)}")
         self.model_name = model_name
         self.model = None
+        # Optional Utilities.embedding_cache.EmbeddingCache shared by ingestion and queries
+        self.cache = cache
+        self.batcher = None
+        # torch: stock SentenceTransformer; torch-int8: int8 dynamically quantized Linear layers;
+        # onnx / onnx-int8: ONNX Runtime, see OnnxSentenceEncoder
+        self.backend = backend
+        self.num_threads = num_threads
+        self.batch_size = batch_size
+        self.onnx_directory = onnx_directory
+        self.onnx_encoder = None
+        # Quantized vectors drift slightly from the float model, so they are cached apart from it
+        self.cache_model_name = model_name if backend == "torch" else f"{model_name}@{backend}"
         self._load_model()
     
     def _load_model(self):
         
         try:
             
-            print(f"Loading model: {self.model_name}")
-            self.model = SentenceTransformer(self.model_name)
-            print(f"Model {self.model_name} loaded successfully. The Embedding dimension is {self.model.get_sentence_embedding_dimension()}")
+            logger.info("Loading model: %s (backend %s)", self.model_name, self.backend)
+            with stage("model_load"):
+                if self.num_threads > 0:
+                    import torch
+                    torch.set_num_threads(self.num_threads)
+                self.model = SentenceTransformer(self.model_name, device="cpu")
+                if self.backend == "torch-int8":
+                    import torch
+                    self.model = torch.ao.quantization.quantize_dynamic(self.model, {torch.nn.Linear}, dtype=torch.qint8)
+                elif self.backend in ("onnx", "onnx-int8"):
+                    self.onnx_encoder = OnnxSentenceEncoder(self.model, self.model_name,
+                                                            quantize=self.backend == "onnx-int8",
+                                                            onnx_directory=self.onnx_directory,
+                                                            num_threads=self.num_threads,
+                                                            batch_size=self.batch_size)
+            logger.info("Model %s loaded successfully. The Embedding dimension is %d",
+                        self.model_name, self.model.get_sentence_embedding_dimension())
         except Exception as e:
-            print(f"Error loading model {self.model_name}: {e}")
+            logger.error("Error loading model %s: %s", self.model_name, e)
             self.model_name = "all-MiniLM-L6-v2"
             raise e
+
+    def _encode(self, text: list[str], show_progress_bar: bool) -> np.ndarray:
+        if self.onnx_encoder is not None:
+            return self.onnx_encoder.encode(text)
+        # SentenceTransformer.encode already sorts each call by length before batching
+        return self.model.encode(text, batch_size=self.batch_size, show_progress_bar=show_progress_bar)
     
-    def generate_embeddings(self, text: list[str]) -> np.ndarray:
+    def _encode_with_cache(self, text: list[str], show_progress_bar: bool) -> np.ndarray:
+
+        cached = self.cache.get_many(self.cache_model_name, text)
+
+        # Encode each distinct missing text once, in a single batch
+        missing_texts = list(dict.fromkeys(t for t, vector in zip(text, cached) if vector is None))
+        if len(missing_texts) > 0:
+            with stage("embed", items=len(missing_texts)):
+                missing_embeddings = self._encode(missing_texts, show_progress_bar)
+            self.cache.put_many(self.cache_model_name, missing_texts, missing_embeddings)
+            encoded = dict(zip(missing_texts, missing_embeddings))
+            cached = [vector if vector is not None else encoded[t] for t, vector in zip(text, cached)]
+
+        return np.vstack(cached).astype(np.float32, copy=False)
+
+    # Progress bars are opt-in: they write to stderr on every call, including single-query encodes
+    def generate_embeddings(self, text: list[str], show_progress_bar: bool = False) -> np.ndarray:
         
         embeddings = np.array([])
         if self.model is not None:
-            embeddings = self.model.encode(text, show_progress_bar=True)
+            if self.cache is not None and len(text) > 0:
+                embeddings = self._encode_with_cache(text, show_progress_bar)
+            else:
+                with stage("embed", items=len(text)):
+                    embeddings = self._encode(text, show_progress_bar)
         else:
             self._load_model()
         
         return embeddings
+
+    def warm_up(self) -> None:
+        # One forward pass outside the cache, so lazy initialisation is done before the first query
+        if self.model is not None:
+            with stage("embed", items=1):
+                self._encode(["warm up"], show_progress_bar=False)
+
+    def enable_micro_batching(self, max_batch_size: int = 32, max_wait_ms: float = 5.0) -> None:
+        if self.batcher is None:
+            self.batcher = EmbeddingBatcher(
+                lambda texts: self.generate_embeddings(texts, show_progress_bar=False),
+                max_batch_size=max_batch_size,
+                max_wait_ms=max_wait_ms)
+
+    def submit_query_embedding(self, text: str) -> Future | None:
+        # For callers on an event loop (await asyncio.wrap_future(...)), so no thread is held while
+        # the batcher waits; None when micro-batching is off
+        if self.batcher is None or self.model is None:
+            return None
+        return self.batcher.submit(text)
+
+    def generate_query_embedding(self, text: str) -> np.ndarray:
+
+        # Concurrent queries share one forward pass when micro-batching is enabled
+        if self.batcher is not None and self.model is not None:
+            return self.batcher.submit(text).result()
+
+        embeddings = self.generate_embeddings([text], show_progress_bar=False)
+        return embeddings[0] if len(embeddings) > 0 else np.array([])
         
 #**********************************************************************************************************
 # This is only for the testing purpose of Embedding Manager class
@@ -0,0 +1,272 @@
+import os
+import json
+import time
+import uuid
+import signal
+import sqlite3
+import logging
+import threading
+import multiprocessing
+from typing import Any
+
+logger = logging.getLogger(__name__)
+
+JOB_STATUSES = ("queued", "running", "succeeded", "failed")
+
+class IngestionJobQueue:
+
+    # Persistent queue of ingestion jobs in SQLite, shared by the Streamlit process (which enqueues
+    # and polls) and the worker processes (which claim and run them). A job is "index the uploads of
+    # one namespace"; at most max_running_jobs run at once and never two for the same namespace,
+    # since one namespace has a single manifest and BM25 index.
+    def __init__(self,
+                 db_path: str = "data/jobs/ingestion_jobs.sqlite3",
+                 max_running_jobs: int = 1,
+                 stale_after_seconds: float = 120.0,
+                 max_attempts: int = 3) -> None:
+        self.db_path = db_path
+        self.max_running_jobs = max_running_jobs
+        self.stale_after_seconds = stale_after_seconds
+        self.max_attempts = max_attempts
+        self._lock = threading.Lock()
+        os.makedirs(os.path.dirname(db_path) or ".", exist_ok=True)
+        self._connection = sqlite3.connect(db_path, timeout=30.0, check_same_thread=False, isolation_level=None)
+        self._connection.row_factory = sqlite3.Row
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.execute("PRAGMA synchronous=NORMAL")
+        self._connection.execute(
+            "CREATE TABLE IF NOT EXISTS jobs ("
+            "job_id TEXT PRIMARY KEY, namespace TEXT NOT NULL, status TEXT NOT NULL, files TEXT NOT NULL, "
+            "created_at REAL NOT NULL, started_at REAL, finished_at REAL, heartbeat_at REAL, worker TEXT, "
+            "attempts INTEGER NOT NULL DEFAULT 0, progress REAL NOT NULL DEFAULT 0, message TEXT, summary TEXT, error TEXT)")
+        self._connection.execute("CREATE INDEX IF NOT EXISTS jobs_by_status ON jobs (status, created_at)")
+
+    @staticmethod
+    def _job(row: sqlite3.Row | None) -> dict[str, Any] | None:
+        if row is None:
+            return None
+        job = dict(row)
+        job["files"] = json.loads(job["files"])
+        job["summary"] = json.loads(job["summary"]) if job["summary"] else None
+        return job
+
+    def enqueue(self, namespace: str, files: list[str] | None = None) -> str:
+
+        # An identical job that has not started yet already covers the new uploads
+        with self._lock:
+            queued = self._connection.execute(
+                "SELECT job_id, files FROM jobs WHERE namespace = ? AND status = 'queued' ORDER BY created_at LIMIT 1",
+                (namespace,)).fetchone()
+            if queued is not None:
+                merged = sorted(set(json.loads(queued["files"])) | set(files or []))
+                self._connection.execute("UPDATE jobs SET files = ? WHERE job_id = ?", (json.dumps(merged), queued["job_id"]))
+                return queued["job_id"]
+
+            job_id = uuid.uuid4().hex[:16]
+            self._connection.execute(
+                "INSERT INTO jobs (job_id, namespace, status, files, created_at, message) VALUES (?, ?, 'queued', ?, ?, ?)",
+                (job_id, namespace, json.dumps(sorted(files or [])), time.time(), "Waiting for a worker"))
+            return job_id
+
+    def claim(self, worker: str) -> dict[str, Any] | None:
+
+        # BEGIN IMMEDIATE takes the write lock first, so two workers cannot claim the same job
+        with self._lock:
+            self._connection.execute("BEGIN IMMEDIATE")
+            try:
+                self._requeue_stale_locked()
+                running = self._connection.execute(
+                    "SELECT namespace FROM jobs WHERE status = 'running'").fetchall()
+                if len(running) >= self.max_running_jobs:
+                    self._connection.execute("COMMIT")
+                    return None
+
+                busy_namespaces = [row["namespace"] for row in running]
+                placeholders = ",".join("?" * len(busy_namespaces))
+                row = self._connection.execute(
+                    "SELECT * FROM jobs WHERE status = 'queued'"
+                    + (f" AND namespace NOT IN ({placeholders})" if busy_namespaces else "")
+                    + " ORDER BY created_at LIMIT 1", busy_namespaces).fetchone()
+                if row is None:
+                    self._connection.execute("COMMIT")
+                    return None
+
+                now = time.time()
+                self._connection.execute(
+                    "UPDATE jobs SET status = 'running', worker = ?, started_at = ?, heartbeat_at = ?, "
+                    "attempts = attempts + 1, progress = 0, message = ? WHERE job_id = ?",
+                    (worker, now, now, "Starting", row["job_id"]))
+                self._connection.execute("COMMIT")
+            except Exception:
+                self._connection.execute("ROLLBACK")
+                raise
+        return self.get(row["job_id"])
+
+    def _requeue_stale_locked(self) -> None:
+        # A running job whose worker stopped sending heartbeats (killed, crashed) is retried
+        stale_before = time.time() - self.stale_after_seconds
+        self._connection.execute(
+            "UPDATE jobs SET status = 'failed', finished_at = ?, error = 'The worker stopped responding' "
+            "WHERE status = 'running' AND heartbeat_at < ? AND attempts >= ?",
+            (time.time(), stale_before, self.max_attempts))
+        self._connection.execute(
+            "UPDATE jobs SET status = 'queued', worker = NULL, message = 'Retrying after the worker stopped responding' "
+            "WHERE status = 'running' AND heartbeat_at < ?", (stale_before,))
+
+    def update_progress(self, job_id: str, progress: float, message: str) -> None:
+        with self._lock:
+            self._connection.execute(
+                "UPDATE jobs SET progress = ?, message = ?, heartbeat_at = ? WHERE job_id = ? AND status = 'running'",
+                (max(0.0, min(1.0, progress)), message, time.time(), job_id))
+
+    def heartbeat(self, job_id: str) -> None:
+        with self._lock:
+            self._connection.execute("UPDATE jobs SET heartbeat_at = ? WHERE job_id = ? AND status = 'running'",
+                                     (time.time(), job_id))
+
+    def complete(self, job_id: str, summary: dict[str, Any]) -> None:
+        with self._lock:
+            self._connection.execute(
+                "UPDATE jobs SET status = 'succeeded', progress = 1, finished_at = ?, summary = ?, message = ? WHERE job_id = ?",
+                (time.time(), json.dumps(summary), "Done", job_id))
+
+    def fail(self, job_id: str, error: str, summary: dict[str, Any] | None = None) -> None:
+        with self._lock:
+            self._connection.execute(
+                "UPDATE jobs SET status = 'failed', finished_at = ?, summary = ?, error = ?, message = ? WHERE job_id = ?",
+                (time.time(), json.dumps(summary) if summary is not None else None, error, "Failed", job_id))
+
+    def get(self, job_id: str) -> dict[str, Any] | None:
+        with self._lock:
+            return self._job(self._connection.execute("SELECT * FROM jobs WHERE job_id = ?", (job_id,)).fetchone())
+
+    def list_jobs(self, namespace: str | None = None, limit: int = 20) -> list[dict[str, Any]]:
+        with self._lock:
+            if namespace is None:
+                rows = self._connection.execute("SELECT * FROM jobs ORDER BY created_at DESC LIMIT ?", (limit,)).fetchall()
+            else:
+                rows = self._connection.execute("SELECT * FROM jobs WHERE namespace = ? ORDER BY created_at DESC LIMIT ?",
+                                                (namespace, limit)).fetchall()
+        return [self._job(row) for row in rows]
+
+    def counts(self) -> dict[str, int]:
+        with self._lock:
+            rows = self._connection.execute("SELECT status, COUNT(*) AS jobs FROM jobs GROUP BY status").fetchall()
+        return {status: 0 for status in JOB_STATUSES} | {row["status"]: row["jobs"] for row in rows}
+
+def _lower_priority(nice_increment: int, torch_threads: int) -> None:
+    # Ingestion competes with query traffic for the same cores; let the scheduler favour queries
+    if nice_increment > 0 and hasattr(os, "nice"):
+        try:
+            os.nice(nice_increment)
+        except OSError as e:
+            logger.warning("Could not lower the ingestion worker priority: %s", e)
+    if torch_threads > 0:
+        import torch
+        torch.set_num_threads(torch_threads)
+
+def _run_job(job_queue: IngestionJobQueue, job: dict[str, Any], heartbeat_seconds: float) -> None:
+
+    from Services.ProcessDocument import ProcessDocument
+    from Infrastructure.telemetry import request_scope
+
+    # Progress writes double as heartbeats; this covers the long silent stretches (model load, big PDFs)
+    stop_heartbeat = threading.Event()
+    def send_heartbeats() -> None:
+        while not stop_heartbeat.wait(heartbeat_seconds):
+            job_queue.heartbeat(job["job_id"])
+    heartbeat_thread = threading.Thread(target=send_heartbeats, name="ingestion-heartbeat", daemon=True)
+    heartbeat_thread.start()
+
+    try:
+        with request_scope(job["job_id"], entry_point="ingestion_job"):
+            process_document = ProcessDocument(
+                namespace=job["namespace"],
+                progress_callback=lambda progress, message: job_queue.update_progress(job["job_id"], progress, message))
+            summary = process_document.process()
+        if process_document.last_error is not None:
+            job_queue.fail(job["job_id"], f"{type(process_document.last_error).__name__}: {process_document.last_error}", summary)
+        else:
+            job_queue.complete(job["job_id"], summary)
+    except Exception as e:
+        logger.exception("Ingestion job %s failed: %s", job["job_id"], e)
+        job_queue.fail(job["job_id"], f"{type(e).__name__}: {e}")
+    finally:
+        stop_heartbeat.set()
+        heartbeat_thread.join()
+
+def run_worker(db_path: str,
+               max_running_jobs: int = 1,
+               poll_seconds: float = 1.0,
+               heartbeat_seconds: float = 10.0,
+               nice_increment: int = 10,
+               torch_threads: int = 0,
+               parent_pid: int | None = None) -> None:
+
+    # Entry point of one worker process: claim a job, run it, repeat. Exits on SIGTERM (after the
+    # current job) or, when started by the app, once the app process is gone.
+    from Infrastructure.telemetry import configure_logging
+    configure_logging()
+    _lower_priority(nice_increment, torch_threads)
+
+    stopping = threading.Event()
+    signal.signal(signal.SIGTERM, lambda signum, frame: stopping.set())
+
+    job_queue = IngestionJobQueue(db_path, max_running_jobs=max_running_jobs,
+                                  stale_after_seconds=max(120.0, heartbeat_seconds * 6))
+    worker = f"{os.uname().nodename if hasattr(os, 'uname') else 'local'}:{os.getpid()}"
+    logger.info("Ingestion worker %s started", worker)
+    while not stopping.is_set():
+        if parent_pid is not None and os.getppid() != parent_pid:
+            break
+        job = job_queue.claim(worker)
+        if job is None:
+            stopping.wait(poll_seconds)
+            continue
+        logger.info("Ingestion job %s started for namespace '%s'", job["job_id"], job["namespace"])
+        _run_job(job_queue, job, heartbeat_seconds)
+    logger.info("Ingestion worker %s stopped", worker)
+
+class IngestionWorkerPool:
+
+    # Worker processes started next to the app. Not daemonic: ingestion starts its own process pool
+    # for PDF parsing, which daemonic processes are not allowed to do. They stop with the app.
+    def __init__(self, db_path: str, worker_count: int = 1, **worker_options: Any) -> None:
+        self.db_path = db_path
+        self.worker_count = worker_count
+        self.worker_options = worker_options
+        self.processes: list[multiprocessing.Process] = []
+
+    def start(self) -> None:
+        context = multiprocessing.get_context("spawn")
+        for i in range(self.worker_count):
+            process = context.Process(target=run_worker, name=f"ingestion-worker-{i}",
+                                      args=(self.db_path, self.worker_count),
+                                      kwargs={**self.worker_options, "parent_pid": os.getpid()})
+            process.start()
+            self.processes.append(process)
+
+    def alive(self) -> int:
+        return sum(process.is_alive() for process in self.processes)
+
+    def stop(self, timeout_seconds: float = 5.0) -> None:
+        # SIGTERM lets an idle worker exit at once; one busy with a job is killed after the timeout
+        # and its job is retried from the manifest checkpoint once the heartbeat goes stale
+        for process in self.processes:
+            if process.is_alive():
+                process.terminate()
+        for process in self.processes:
+            process.join(timeout_seconds)
+            if process.is_alive():
+                process.kill()
+                process.join()
+
+def worker_options_from_env() -> dict[str, Any]:
+    return {"nice_increment": int(os.getenv("INGESTION_WORKER_NICE", "10")),
+            "torch_threads": int(os.getenv("INGESTION_WORKER_TORCH_THREADS", "0"))}
+
+if __name__ == "__main__":
+    # python -m Services.IngestionJobQueue runs a standalone worker (INGESTION_EXTERNAL_WORKERS=true)
+    run_worker(os.getenv("INGESTION_JOBS_PATH", "data/jobs/ingestion_jobs.sqlite3"),
+               max_running_jobs=int(os.getenv("INGESTION_MAX_CONCURRENT_JOBS", "1")),
+               **worker_options_from_env())
@@ -0,0 +1,95 @@
+import os
+import json
+import hashlib
+import logging
+from typing import Any
+
+logger = logging.getLogger(__name__)
+
+class IngestionManifest:
+
+    def __init__(self, manifest_path: str = "data/vector_store/ingestion_manifest.json") -> None:
+        self.manifest_path = manifest_path
+        self.files: dict[str, dict[str, Any]] = {}
+        self._load()
+
+    def _load(self) -> None:
+        try:
+            if os.path.exists(self.manifest_path):
+                with open(self.manifest_path, "r", encoding="utf-8") as manifest_file:
+                    self.files = json.load(manifest_file).get("files", {})
+        except Exception as e:
+            # A corrupt manifest only costs a full re-ingest, the chunk ids are deterministic
+            logger.warning("Error reading ingestion manifest '%s', starting from scratch: %s", self.manifest_path, e)
+            self.files = {}
+
+    def save(self) -> None:
+        try:
+            os.makedirs(os.path.dirname(self.manifest_path) or ".", exist_ok=True)
+            temp_path = f"{self.manifest_path}.tmp"
+            with open(temp_path, "w", encoding="utf-8") as manifest_file:
+                json.dump({"files": self.files}, manifest_file, indent=2)
+            os.replace(temp_path, self.manifest_path)
+        except Exception as e:
+            logger.error("Error writing ingestion manifest '%s': %s", self.manifest_path, e)
+            raise e
+
+    @staticmethod
+    def hash_file(file_path: str, block_size: int = 1 << 20) -> str:
+        file_hash = hashlib.sha256()
+        with open(file_path, "rb") as pdf_file:
+            for block in iter(lambda: pdf_file.read(block_size), b""):
+                file_hash.update(block)
+        return file_hash.hexdigest()
+
+    @staticmethod
+    def settings_key(settings: dict[str, Any]) -> str:
+        # Any change to the chunker or embedding model invalidates the stored vectors
+        return hashlib.sha256(json.dumps(settings, sort_keys=True).encode("utf-8")).hexdigest()[:16]
+
+    @staticmethod
+    def chunk_id(file_key: str, content_hash: str, settings_key: str, chunk_index: int) -> str:
+        # The manifest is keyed by file, so two uploads with the same bytes must not share chunk ids:
+        # removing or replacing one would otherwise delete the other's vectors
+        file_hash = hashlib.sha256(file_key.encode("utf-8")).hexdigest()[:8]
+        return f"{file_hash}_{content_hash[:16]}_{settings_key}_{chunk_index}"
+
+    def _matches(self, file_key: str, content_hash: str, settings_key: str) -> bool:
+        entry = self.files.get(file_key)
+        return (entry is not None
+                and entry.get("content_hash") == content_hash
+                and entry.get("settings_key") == settings_key)
+
+    def is_current(self, file_key: str, content_hash: str, settings_key: str) -> bool:
+        return (self._matches(file_key, content_hash, settings_key)
+                and self.files[file_key].get("status", "complete") == "complete")
+
+    def resume_offset(self, file_key: str, content_hash: str, settings_key: str) -> int:
+        # Number of chunks of this exact file version already written by an interrupted run
+        if self._matches(file_key, content_hash, settings_key) and self.files[file_key].get("status") == "in_progress":
+            return int(self.files[file_key].get("written_chunks", 0))
+        return 0
+
+    def chunk_ids(self, file_key: str) -> list[str]:
+        return list(self.files.get(file_key, {}).get("chunk_ids", []))
+
+    def record(self, file_key: str, content_hash: str, settings_key: str, chunk_ids: list[str]) -> None:
+        self.files[file_key] = {
+            "content_hash": content_hash,
+            "settings_key": settings_key,
+            "status": "complete",
+            "chunk_ids": chunk_ids
+        }
+
+    def record_progress(self, file_key: str, content_hash: str, settings_key: str,
+                        chunk_ids: list[str], written_chunks: int) -> None:
+        self.files[file_key] = {
+            "content_hash": content_hash,
+            "settings_key": settings_key,
+            "status": "in_progress",
+            "written_chunks": written_chunks,
+            "chunk_ids": chunk_ids
+        }
+
+    def remove(self, file_key: str) -> None:
+        self.files.pop(file_key, None)
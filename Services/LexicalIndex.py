@@ -0,0 +1,333 @@
+import os
+import re
+import math
+import time
+import logging
+import sqlite3
+import threading
+from collections import Counter, OrderedDict
+from typing import Any
+
+import numpy as np
+
+from Services.MetadataFilter import where_mask
+from Infrastructure.telemetry import record_stage
+
+logger = logging.getLogger(__name__)
+
+# Chunk metadata stored per document so retrieval filters can be applied to BM25 as well
+FILTER_FIELDS = ("source", "page_number", "ingested_at")
+
+# Keeps part numbers and dotted names ("AB-1234", "v2.1") as one token; their pieces are indexed too
+_TOKEN_PATTERN = re.compile(r"\w+(?:[-./]\w+)*")
+_STOPWORDS = frozenset("a an and are as at be by for from has have in is it its of on or that the this to was were will with".split())
+
+def tokenize(text: str) -> list[str]:
+    tokens = []
+    for token in _TOKEN_PATTERN.findall(text.lower()):
+        if token not in _STOPWORDS:
+            tokens.append(token)
+        if not token.isalnum():
+            tokens.extend(part for part in re.split(r"[-./]", token) if part and part not in _STOPWORDS)
+    return tokens
+
+class BM25Index:
+
+    # Okapi BM25 over the chunk texts, kept in SQLite next to the Chroma collection.
+    # Terms are interned in a terms table; postings are (term_id, doc_key, tf) rows in a WITHOUT ROWID
+    # table clustered by term_id, so one term's postings are read with a single range scan when a query
+    # asks for it. Document lengths and filter fields are held in memory and kept current from a change
+    # log, so a search after another batch was written only reads the documents that batch touched.
+    def __init__(self,
+                 index_path: str,
+                 k1: float = 1.2,
+                 b: float = 0.75,
+                 postings_cache_entries: int = 4096,
+                 change_log_versions: int = 10000) -> None:
+        self.index_path = index_path
+        self.k1 = k1
+        self.b = b
+        self.postings_cache_entries = postings_cache_entries
+        self.change_log_versions = change_log_versions
+        self._lock = threading.Lock()
+        self._postings_cache: OrderedDict[str, tuple[np.ndarray, np.ndarray]] = OrderedDict()
+        # Term ids never change once assigned, so this never goes stale
+        self._term_ids: dict[str, int] = {}
+        self._loaded_version = None
+        self._doc_lengths = np.zeros(0, dtype=np.float32)
+        self._alive = np.zeros(0, dtype=bool)
+        self._filter_columns: dict[str, np.ndarray] = {field: np.empty(0, dtype=object) for field in FILTER_FIELDS}
+        self._total_length = 0.0
+        self._document_count = 0
+
+        os.makedirs(os.path.dirname(self.index_path) or ".", exist_ok=True)
+        self._connection = sqlite3.connect(self.index_path, check_same_thread=False)
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.execute("PRAGMA synchronous=NORMAL")
+        # Postings inserts land all over the term-clustered b-tree; a larger page cache keeps them in memory
+        self._connection.execute("PRAGMA cache_size=-65536")
+        self._connection.execute(
+            "CREATE TABLE IF NOT EXISTS documents (doc_key INTEGER PRIMARY KEY, chunk_id TEXT NOT NULL UNIQUE, "
+            "length INTEGER NOT NULL, terms TEXT NOT NULL, source TEXT, page_number INTEGER, ingested_at REAL)")
+        self._connection.execute("CREATE TABLE IF NOT EXISTS terms (term_id INTEGER PRIMARY KEY, term TEXT NOT NULL UNIQUE)")
+        postings_columns = {row[1] for row in self._connection.execute("PRAGMA table_info(postings)")}
+        if "term" in postings_columns:
+            self._intern_terms()
+        self._connection.execute(
+            "CREATE TABLE IF NOT EXISTS postings (term_id INTEGER NOT NULL, doc_key INTEGER NOT NULL, tf INTEGER NOT NULL, "
+            "PRIMARY KEY (term_id, doc_key)) WITHOUT ROWID")
+        # Indexes created before the filter columns existed get them added; their rows stay NULL until re-ingested
+        existing_columns = {row[1] for row in self._connection.execute("PRAGMA table_info(documents)")}
+        for field, field_type in zip(FILTER_FIELDS, ("TEXT", "INTEGER", "REAL")):
+            if field not in existing_columns:
+                self._connection.execute(f"ALTER TABLE documents ADD COLUMN {field} {field_type}")
+        self._connection.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value INTEGER NOT NULL)")
+        self._connection.execute("INSERT OR IGNORE INTO meta (key, value) VALUES ('version', 0)")
+        # Documents added or deleted per version; readers at an older version than log_start reload everything
+        self._connection.execute("CREATE TABLE IF NOT EXISTS changes (version INTEGER NOT NULL, doc_key INTEGER NOT NULL)")
+        self._connection.execute("CREATE INDEX IF NOT EXISTS changes_version ON changes (version)")
+        self._connection.execute("INSERT OR IGNORE INTO meta (key, value) SELECT 'log_start', value FROM meta WHERE key = 'version'")
+        self._connection.commit()
+
+    def _intern_terms(self) -> None:
+        # One-off migration of an index whose postings repeat the term text in every row:
+        # terms get integer ids and documents.terms lists ids instead of words
+        logger.info("Moving the BM25 postings in %s to interned term ids", self.index_path)
+        self._connection.execute("INSERT OR IGNORE INTO terms (term) SELECT DISTINCT term FROM postings ORDER BY term")
+        self._connection.execute(
+            "CREATE TABLE postings_by_id (term_id INTEGER NOT NULL, doc_key INTEGER NOT NULL, tf INTEGER NOT NULL, "
+            "PRIMARY KEY (term_id, doc_key)) WITHOUT ROWID")
+        self._connection.execute("INSERT INTO postings_by_id (term_id, doc_key, tf) SELECT terms.term_id, postings.doc_key, postings.tf "
+                                 "FROM postings JOIN terms ON terms.term = postings.term ORDER BY terms.term_id, postings.doc_key")
+        self._connection.execute("DROP TABLE postings")
+        self._connection.execute("ALTER TABLE postings_by_id RENAME TO postings")
+        term_ids = dict(self._connection.execute("SELECT term, term_id FROM terms"))
+        self._connection.executemany("UPDATE documents SET terms = ? WHERE doc_key = ?",
+                                     [(" ".join(str(term_ids[term]) for term in terms.split(" ") if term), doc_key)
+                                      for doc_key, terms in self._connection.execute("SELECT doc_key, terms FROM documents").fetchall()])
+        self._connection.execute("UPDATE meta SET value = value + 1 WHERE key = 'version'")
+        self._connection.commit()
+
+    def _bump_version(self, doc_keys: list[int]) -> None:
+        # Caller holds the lock; readers in other processes apply the logged documents on their next search
+        self._connection.execute("UPDATE meta SET value = value + 1 WHERE key = 'version'")
+        version = self._connection.execute("SELECT value FROM meta WHERE key = 'version'").fetchone()[0]
+        self._connection.executemany("INSERT INTO changes (version, doc_key) VALUES (?, ?)", [(version, doc_key) for doc_key in doc_keys])
+        if version % 1000 == 0:
+            log_start = version - self.change_log_versions
+            self._connection.execute("DELETE FROM changes WHERE version <= ?", (log_start,))
+            self._connection.execute("UPDATE meta SET value = MAX(value, ?) WHERE key = 'log_start'", (log_start,))
+
+    def _term_ids_locked(self, terms: list[str], create: bool) -> dict[str, int]:
+        missing = [term for term in terms if term not in self._term_ids]
+        if create and len(missing) > 0:
+            self._connection.executemany("INSERT OR IGNORE INTO terms (term) VALUES (?)", [(term,) for term in missing])
+        for batch_start in range(0, len(missing), 500):
+            batch = missing[batch_start:batch_start + 500]
+            self._term_ids.update(self._connection.execute(
+                f"SELECT term, term_id FROM terms WHERE term IN ({','.join('?' * len(batch))})", batch))
+        return {term: self._term_ids[term] for term in terms if term in self._term_ids}
+
+    def _delete_locked(self, chunk_ids: list[str]) -> list[int]:
+        # Each document keeps its distinct term ids, so its postings are deleted by primary key
+        # without a second index over the postings table
+        rows = []
+        for batch_start in range(0, len(chunk_ids), 500):
+            batch = chunk_ids[batch_start:batch_start + 500]
+            rows.extend(self._connection.execute(
+                f"SELECT doc_key, terms FROM documents WHERE chunk_id IN ({','.join('?' * len(batch))})", batch))
+        self._connection.executemany("DELETE FROM postings WHERE term_id = ? AND doc_key = ?",
+                                     sorted((int(term_id), doc_key) for doc_key, terms in rows for term_id in terms.split(" ") if term_id))
+        self._connection.executemany("DELETE FROM documents WHERE doc_key = ?", [(doc_key,) for doc_key, _ in rows])
+        return [doc_key for doc_key, _ in rows]
+
+    def add_documents(self, documents: list[dict]) -> None:
+
+        # Upsert: a chunk id that is already indexed is replaced
+        if len(documents) == 0:
+            return
+        start_time = time.perf_counter()
+        try:
+            with self._lock:
+                changed_keys = self._delete_locked([doc['id'] for doc in documents])
+                term_counts = [Counter(tokenize(doc['text'])) for doc in documents]
+                term_ids = self._term_ids_locked(sorted(set().union(*term_counts)), create=True)
+                postings = []
+                for doc, counts in zip(documents, term_counts):
+                    metadata = doc.get('metadata') or {}
+                    cursor = self._connection.execute(
+                        "INSERT INTO documents (chunk_id, length, terms, source, page_number, ingested_at) VALUES (?, ?, ?, ?, ?, ?)",
+                        (doc['id'], sum(counts.values()), " ".join(str(term_ids[term]) for term in counts),
+                         *[metadata.get(field) for field in FILTER_FIELDS]))
+                    changed_keys.append(cursor.lastrowid)
+                    postings.extend((term_ids[term], cursor.lastrowid, tf) for term, tf in counts.items())
+                # Sorted by term id so the inserts walk the clustered key in order
+                postings.sort()
+                self._connection.executemany("INSERT INTO postings (term_id, doc_key, tf) VALUES (?, ?, ?)", postings)
+                self._bump_version(changed_keys)
+                self._connection.commit()
+            record_stage("lexical_write", time.perf_counter() - start_time, items=len(documents))
+        except Exception as e:
+            self._connection.rollback()
+            logger.error("Error adding documents to the BM25 index '%s': %s", self.index_path, e)
+            raise e
+
+    def delete_documents(self, chunk_ids: list[str]) -> None:
+        if len(chunk_ids) == 0:
+            return
+        try:
+            with self._lock:
+                deleted_keys = self._delete_locked(chunk_ids)
+                if len(deleted_keys) > 0:
+                    self._bump_version(deleted_keys)
+                self._connection.commit()
+        except Exception as e:
+            self._connection.rollback()
+            logger.error("Error deleting documents from the BM25 index '%s': %s", self.index_path, e)
+            raise e
+
+    def build_from_collection(self, collection: Any, page_size: int = 5000) -> None:
+        # Backfill for collections that were ingested before the BM25 index existed
+        total_rows = collection.count()
+        for offset in range(0, total_rows, page_size):
+            page = collection.get(include=["documents", "metadatas"], limit=page_size, offset=offset)
+            self.add_documents([{"id": chunk_id, "text": text or "", "metadata": metadata}
+                                for chunk_id, text, metadata in zip(page["ids"], page["documents"], page["metadatas"])])
+        logger.info("BM25 index with %d chunks written to %s", total_rows, self.index_path)
+
+    def count(self) -> int:
+        with self._lock:
+            return self._connection.execute("SELECT COUNT(*) FROM documents").fetchone()[0]
+
+    def _refresh_locked(self) -> None:
+        # Caller holds a read transaction, so the version, the change log and the postings are from one commit
+        meta = dict(self._connection.execute("SELECT key, value FROM meta"))
+        version = meta["version"]
+        if version == self._loaded_version:
+            return
+
+        if self._loaded_version is None or self._loaded_version < meta["log_start"]:
+            self._reload_locked()
+        else:
+            # Only the documents added or deleted since the loaded version are read
+            doc_keys = sorted({doc_key for (doc_key,) in self._connection.execute(
+                "SELECT doc_key FROM changes WHERE version > ?", (self._loaded_version,))})
+            self._apply_locked(doc_keys)
+        # Cached postings may include or miss changed documents; the next query reads its terms again
+        self._postings_cache.clear()
+        self._loaded_version = version
+
+    def _reload_locked(self) -> None:
+        self._doc_lengths = np.zeros(0, dtype=np.float32)
+        self._alive = np.zeros(0, dtype=bool)
+        self._filter_columns = {field: np.empty(0, dtype=object) for field in FILTER_FIELDS}
+        self._total_length = 0.0
+        self._document_count = 0
+        self._store_rows_locked(self._connection.execute(f"SELECT doc_key, length, {', '.join(FILTER_FIELDS)} FROM documents").fetchall())
+
+    def _apply_locked(self, doc_keys: list[int]) -> None:
+        # Every logged document is cleared first, then the ones that still exist are read back
+        known = np.asarray([doc_key for doc_key in doc_keys if doc_key < len(self._alive)], dtype=np.int64)
+        if len(known) > 0:
+            self._total_length -= float(self._doc_lengths[known][self._alive[known]].sum())
+            self._document_count -= int(self._alive[known].sum())
+            self._alive[known] = False
+            self._doc_lengths[known] = 0.0
+            for column in self._filter_columns.values():
+                column[known] = None
+        rows = []
+        for batch_start in range(0, len(doc_keys), 500):
+            batch = doc_keys[batch_start:batch_start + 500]
+            rows.extend(self._connection.execute(
+                f"SELECT doc_key, length, {', '.join(FILTER_FIELDS)} FROM documents WHERE doc_key IN ({','.join('?' * len(batch))})", batch))
+        self._store_rows_locked(rows)
+
+    def _store_rows_locked(self, rows: list[tuple]) -> None:
+        if len(rows) == 0:
+            return
+        doc_keys = np.fromiter((row[0] for row in rows), dtype=np.int64, count=len(rows))
+        slots = int(doc_keys.max()) + 1
+        if slots > len(self._alive):
+            # Grown geometrically so appending batches does not copy the arrays every time
+            capacity = max(slots, 2 * len(self._alive))
+            grow = capacity - len(self._alive)
+            self._doc_lengths = np.concatenate([self._doc_lengths, np.zeros(grow, dtype=np.float32)])
+            self._alive = np.concatenate([self._alive, np.zeros(grow, dtype=bool)])
+            self._filter_columns = {field: np.concatenate([column, np.full(grow, None, dtype=object)])
+                                    for field, column in self._filter_columns.items()}
+        lengths = np.fromiter((row[1] for row in rows), dtype=np.float32, count=len(rows))
+        self._doc_lengths[doc_keys] = lengths
+        self._alive[doc_keys] = True
+        for position, field in enumerate(FILTER_FIELDS, start=2):
+            values = np.empty(len(rows), dtype=object)
+            values[:] = [row[position] for row in rows]
+            self._filter_columns[field][doc_keys] = values
+        self._document_count += len(rows)
+        self._total_length += float(lengths.sum())
+
+    def _postings_locked(self, term: str) -> tuple[np.ndarray, np.ndarray]:
+        postings = self._postings_cache.get(term)
+        if postings is not None:
+            self._postings_cache.move_to_end(term)
+            return postings
+
+        term_id = self._term_ids_locked([term], create=False).get(term)
+        rows = self._connection.execute("SELECT doc_key, tf FROM postings WHERE term_id = ?", (term_id,)).fetchall() if term_id is not None else []
+        postings = (np.fromiter((row[0] for row in rows), dtype=np.int64, count=len(rows)),
+                    np.fromiter((row[1] for row in rows), dtype=np.float32, count=len(rows)))
+        self._postings_cache[term] = postings
+        if len(self._postings_cache) > self.postings_cache_entries:
+            self._postings_cache.popitem(last=False)
+        return postings
+
+    def _filter_column(self, name: str) -> np.ndarray:
+        column = self._filter_columns.get(name)
+        return column if column is not None else np.full(len(self._doc_lengths), None, dtype=object)
+
+    def search(self, query: str, top_k: int = 10, where: dict[str, Any] | None = None) -> list[tuple[str, float]]:
+
+        query_terms = Counter(tokenize(query))
+        if len(query_terms) == 0:
+            return []
+
+        with self._lock:
+            self._connection.execute("BEGIN")
+            try:
+                self._refresh_locked()
+                if self._document_count == 0:
+                    return []
+                average_length = max(self._total_length / self._document_count, 1e-6)
+
+                scores = np.zeros(len(self._doc_lengths), dtype=np.float32)
+                for term, query_tf in query_terms.items():
+                    doc_keys, tfs = self._postings_locked(term)
+                    if len(doc_keys) == 0:
+                        continue
+                    idf = math.log(1.0 + (self._document_count - len(doc_keys) + 0.5) / (len(doc_keys) + 0.5))
+                    length_norm = self.k1 * (1.0 - self.b + self.b * self._doc_lengths[doc_keys] / average_length)
+                    scores[doc_keys] += query_tf * idf * tfs * (self.k1 + 1.0) / (tfs + length_norm)
+
+                if where:
+                    # Same where clause as the vector search; filtered-out chunks never become candidates
+                    scores[~where_mask(where, self._filter_column, len(scores))] = 0.0
+                candidates = np.flatnonzero(scores)
+                if len(candidates) > top_k:
+                    candidates = candidates[np.argpartition(-scores[candidates], top_k - 1)[:top_k]]
+                candidates = candidates[np.lexsort((candidates, -scores[candidates]))]
+
+                placeholders = ",".join("?" * len(candidates))
+                chunk_ids = dict(self._connection.execute(
+                    f"SELECT doc_key, chunk_id FROM documents WHERE doc_key IN ({placeholders})",
+                    [int(doc_key) for doc_key in candidates]).fetchall()) if len(candidates) > 0 else {}
+            finally:
+                self._connection.commit()
+
+        return [(chunk_ids[int(doc_key)], float(scores[doc_key])) for doc_key in candidates if int(doc_key) in chunk_ids]
+
+def reciprocal_rank_fusion(rankings: list[list[str]], k: int = 60) -> list[str]:
+    # score(d) = sum over rankings of 1 / (k + rank); ties keep the order of the first ranking
+    scores: dict[str, float] = {}
+    for ranking in rankings:
+        for rank, chunk_id in enumerate(ranking, start=1):
+            scores[chunk_id] = scores.get(chunk_id, 0.0) + 1.0 / (k + rank)
+    return sorted(scores, key=lambda chunk_id: -scores[chunk_id])
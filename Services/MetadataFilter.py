@@ -0,0 +1,85 @@
+from typing import Any, Callable
+
+import numpy as np
+
+# Retrieval filters are expressed as Chroma "where" clauses so the same predicate can be passed
+# to Chroma, which applies it inside the search, and evaluated by LocalVectorIndex and BM25Index
+# as a row mask before scoring.
+def build_where(sources: list[str] | None = None,
+                page_range: tuple[int, int] | None = None,
+                ingested_after: float | None = None,
+                ingested_before: float | None = None) -> dict[str, Any] | None:
+
+    # page_range is inclusive and 1-based, like the stored page_number (the first page is 1)
+    clauses: list[dict[str, Any]] = []
+    if sources:
+        clauses.append({"source": {"$in": list(sources)}})
+    if page_range is not None:
+        first_page, last_page = page_range
+        if first_page is not None:
+            clauses.append({"page_number": {"$gte": int(first_page)}})
+        if last_page is not None:
+            clauses.append({"page_number": {"$lte": int(last_page)}})
+    if ingested_after is not None:
+        clauses.append({"ingested_at": {"$gte": float(ingested_after)}})
+    if ingested_before is not None:
+        clauses.append({"ingested_at": {"$lte": float(ingested_before)}})
+
+    if len(clauses) == 0:
+        return None
+    return clauses[0] if len(clauses) == 1 else {"$and": clauses}
+
+def _numeric(values: np.ndarray) -> np.ndarray:
+    # Missing or non-numeric values become NaN, which fails every comparison
+    numbers = np.full(len(values), np.nan, dtype=np.float64)
+    for i, value in enumerate(values):
+        if isinstance(value, (int, float)) and not isinstance(value, bool):
+            numbers[i] = value
+    return numbers
+
+def _field_mask(values: np.ndarray, condition: Any) -> np.ndarray:
+
+    if not isinstance(condition, dict):
+        condition = {"$eq": condition}
+
+    mask = np.ones(len(values), dtype=bool)
+    for operator, operand in condition.items():
+        if operator == "$eq":
+            mask &= values == operand
+        elif operator == "$ne":
+            mask &= values != operand
+        elif operator == "$in":
+            mask &= np.isin(values, np.asarray(list(operand), dtype=object))
+        elif operator == "$nin":
+            mask &= ~np.isin(values, np.asarray(list(operand), dtype=object))
+        elif operator in ("$gt", "$gte", "$lt", "$lte"):
+            numbers = _numeric(values)
+            with np.errstate(invalid="ignore"):
+                if operator == "$gt":
+                    mask &= numbers > operand
+                elif operator == "$gte":
+                    mask &= numbers >= operand
+                elif operator == "$lt":
+                    mask &= numbers < operand
+                else:
+                    mask &= numbers <= operand
+        else:
+            raise ValueError(f"Unsupported metadata filter operator '{operator}'")
+    return mask
+
+def where_mask(where: dict[str, Any], column: Callable[[str], np.ndarray], row_count: int) -> np.ndarray:
+
+    # column(name) returns one value per row as an object array (None where the field is missing)
+    mask = np.ones(row_count, dtype=bool)
+    for key, condition in where.items():
+        if key == "$and":
+            for clause in condition:
+                mask &= where_mask(clause, column, row_count)
+        elif key == "$or":
+            any_mask = np.zeros(row_count, dtype=bool)
+            for clause in condition:
+                any_mask |= where_mask(clause, column, row_count)
+            mask &= any_mask
+        else:
+            mask &= _field_mask(column(key), condition)
+    return mask
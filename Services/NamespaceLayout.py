@@ -0,0 +1,81 @@
+import os
+import re
+import json
+import zlib
+from typing import Any
+
+DEFAULT_NAMESPACE = "default"
+
+_NAMESPACE_PATTERN = re.compile(r"^[A-Za-z0-9][A-Za-z0-9_-]{0,62}$")
+_LAYOUT_FILE = "layout.json"
+
+class NamespaceLayout:
+
+    # Where one namespace (a team's corpus) lives and how its chunks are split over shard collections.
+    # The default namespace is the original single "pdf_documents" collection in data/vector_store,
+    # fed from Uploads; every other namespace gets its own persist directory and upload folder,
+    # so its Chroma files, manifest, BM25 and local indexes are separate.
+    def __init__(self,
+                 namespace: str = DEFAULT_NAMESPACE,
+                 base_persist_directory: str = "data/vector_store",
+                 base_upload_directory: str = "Uploads",
+                 collection_name: str = "pdf_documents",
+                 shard_count: int | None = None) -> None:
+        namespace = namespace or DEFAULT_NAMESPACE
+        if not _NAMESPACE_PATTERN.match(namespace):
+            raise ValueError(f"Invalid namespace '{namespace}': use letters, digits, '-' and '_' only")
+
+        self.namespace = namespace
+        self.collection_name = collection_name
+        if namespace == DEFAULT_NAMESPACE:
+            self.persist_directory = base_persist_directory
+            self.upload_directory = base_upload_directory
+        else:
+            self.persist_directory = os.path.join(base_persist_directory, "namespaces", namespace)
+            self.upload_directory = os.path.join(base_upload_directory, namespace)
+
+        # The shard count is fixed when a namespace is first ingested, chunk routing depends on it
+        stored_shard_count = self.stored_shard_count(self.persist_directory)
+        self.shard_count = stored_shard_count or shard_count or int(os.getenv("VECTOR_STORE_SHARDS", "1"))
+        if self.shard_count < 1:
+            raise ValueError(f"shard_count must be at least 1, got {self.shard_count}")
+
+    @staticmethod
+    def stored_shard_count(persist_directory: str) -> int | None:
+        layout_path = os.path.join(persist_directory, _LAYOUT_FILE)
+        if not os.path.exists(layout_path):
+            return None
+        with open(layout_path, "r", encoding="utf-8") as layout_file:
+            return int(json.load(layout_file)["shard_count"])
+
+    def save(self) -> None:
+        os.makedirs(self.persist_directory, exist_ok=True)
+        temp_path = os.path.join(self.persist_directory, f"{_LAYOUT_FILE}.tmp")
+        with open(temp_path, "w", encoding="utf-8") as layout_file:
+            json.dump({"namespace": self.namespace, "shard_count": self.shard_count}, layout_file)
+        os.replace(temp_path, os.path.join(self.persist_directory, _LAYOUT_FILE))
+
+    def collection_names(self) -> list[str]:
+        if self.shard_count == 1:
+            return [self.collection_name]
+        return [shard_collection_name(self.collection_name, shard) for shard in range(self.shard_count)]
+
+    def shard_of(self, chunk_id: str) -> int:
+        # Stable across processes and runs, unlike hash()
+        return zlib.crc32(chunk_id.encode("utf-8")) % self.shard_count
+
+    def collection_metadata(self, shard: int) -> dict[str, Any]:
+        # Constant size, whatever the number of documents in the collection
+        return {"namespace": self.namespace, "shard": shard, "shard_count": self.shard_count}
+
+    @staticmethod
+    def list_namespaces(base_persist_directory: str = "data/vector_store") -> list[str]:
+        namespaces_directory = os.path.join(base_persist_directory, "namespaces")
+        namespaces = []
+        if os.path.isdir(namespaces_directory):
+            namespaces = sorted(name for name in os.listdir(namespaces_directory)
+                                if _NAMESPACE_PATTERN.match(name) and os.path.isdir(os.path.join(namespaces_directory, name)))
+        return [DEFAULT_NAMESPACE] + [name for name in namespaces if name != DEFAULT_NAMESPACE]
+
+def shard_collection_name(collection_name: str, shard: int) -> str:
+    return f"{collection_name}_shard{shard:02d}"
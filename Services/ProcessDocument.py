@@ -1,30 +1,327 @@
 import os
+import glob
+import time
+import queue
+import logging
+import threading
+from typing import Callable
 
-from Services.VectorStore import VectorStore
+from Services.VectorStore import ShardedVectorStore
+from Services.NamespaceLayout import DEFAULT_NAMESPACE, NamespaceLayout
 import Services.summarizer as summarizer_object
-from Services.EmbeddingManager import EmbeddingManager
+from Services.IngestionManifest import IngestionManifest
+from Services.VectorIndex import LocalVectorIndex
+from Infrastructure.resource_registry import get_registry, local_index_directory
+from Infrastructure.telemetry import bind_request, record_stage
+
+logger = logging.getLogger(__name__)
+
+# Marks the end of the work on the encode and write queues
+_END_OF_STREAM = None
 
 class ProcessDocument:
 
-    def __init__(self):
-        pass
+    def __init__(self,
+                 upload_directory: str = "Uploads",
+                 collection_name: str = "pdf_documents",
+                 persist_directory: str = "data/vector_store",
+                 chunk_model_name: str = "gpt-5",
+                 chunk_size: int = 400,
+                 chunk_size_overlap: int = 50,
+                 write_batch_size: int = 1024,
+                 max_workers: int | None = None,
+                 batch_size: int = 256,
+                 queue_depth: int = 4,
+                 namespace: str = DEFAULT_NAMESPACE,
+                 shard_count: int | None = None,
+                 progress_callback: Callable[[float, str], None] | None = None) -> None:
+        # Each namespace has its own upload folder and persist directory, see NamespaceLayout
+        self.layout = NamespaceLayout(namespace=namespace,
+                                      base_persist_directory=persist_directory,
+                                      base_upload_directory=upload_directory,
+                                      collection_name=collection_name,
+                                      shard_count=shard_count)
+        self.upload_directory = self.layout.upload_directory
+        self.collection_name = collection_name
+        self.persist_directory = self.layout.persist_directory
+        self.chunk_model_name = chunk_model_name
+        self.chunk_size = chunk_size
+        self.chunk_size_overlap = chunk_size_overlap
+        self.chunker = os.getenv("CHUNKER", "recursive")
+        self.write_batch_size = write_batch_size
+        self.max_workers = max_workers or int(os.getenv("INGESTION_WORKERS", "0")) or None
+        self.batch_size = int(os.getenv("INGESTION_BATCH_SIZE", batch_size))
+        self.queue_depth = int(os.getenv("INGESTION_QUEUE_DEPTH", queue_depth))
+        self.transformer_model_name = os.getenv("TRANSFORMER_MODEL_NAME", "all-MiniLM-L6-v2")
+        # Called with (fraction done, message) as files are indexed, e.g. by the ingestion job queue
+        self.progress_callback = progress_callback
+        # process() logs and swallows errors; the last one is kept for callers that need to know
+        self.last_error: Exception | None = None
+        self._total_files = 0
+        # Chunk ids written and deleted by the current run, applied to the local vector index at the end
+        self._added_ids: list[str] = []
+        self._deleted_ids: list[str] = []
+
+    def _settings(self) -> dict:
+        return {
+            "chunk_model_name": self.chunk_model_name,
+            "chunk_size": self.chunk_size,
+            "chunk_size_overlap": self.chunk_size_overlap,
+            "chunker": self.chunker,
+            "transformer_model_name": self.transformer_model_name
+        }
+
+    def _report_progress(self, summary: dict[str, int], file_fraction: float = 0.0, message: str = "") -> None:
+        if self.progress_callback is None or self._total_files == 0:
+            return
+        files_done = summary["added"] + summary["removed"]
+        try:
+            self.progress_callback((files_done + file_fraction) / self._total_files,
+                                   message or f"{files_done}/{self._total_files} file(s), {summary['chunks']} chunks indexed")
+        except Exception as e:
+            # A failing progress sink must not fail the ingest
+            logger.warning("Progress callback failed: %s", e)
+
+    def _assign_chunk_ids(self, pdf_chunks: list[dict], file_path: str, content_hash: str, settings_key: str) -> list[dict]:
+        ingested_at = time.time()
+        for i, chunk in enumerate(pdf_chunks):
+            chunk['id'] = IngestionManifest.chunk_id(file_path, content_hash, settings_key, i)
+            chunk['metadata'] = dict(chunk['metadata'])
+            chunk['metadata']['chunk_index'] = i
+            chunk['metadata']['page_number'] = chunk['page_number']
+            chunk['metadata']['content_hash'] = content_hash
+            chunk['metadata']['ingested_at'] = ingested_at
+        return pdf_chunks
+
+    def _encode_worker(self, embeddings_manager, encode_queue: queue.Queue, write_queue: queue.Queue,
+                       stop_event: threading.Event, errors: list[Exception]) -> None:
+        item = _END_OF_STREAM
+        try:
+            while True:
+                item = encode_queue.get()
+                if item is _END_OF_STREAM or stop_event.is_set():
+                    break
+
+                if len(item["chunks"]) > 0:
+                    item["embeddings"] = embeddings_manager.generate_embeddings([chunk['text'] for chunk in item["chunks"]],
+                                                                                show_progress_bar=False)
+                write_queue.put(item)
+        except Exception as e:
+            errors.append(e)
+            stop_event.set()
+        finally:
+            write_queue.put(_END_OF_STREAM)
+            # Keep draining so a producer blocked on a full queue can see the stop and finish
+            while item is not _END_OF_STREAM:
+                item = encode_queue.get()
+
+    def _write_worker(self, vector_store: ShardedVectorStore, lexical_index, manifest: IngestionManifest, write_queue: queue.Queue,
+                      stop_event: threading.Event, errors: list[Exception], summary: dict[str, int]) -> None:
+        item = _END_OF_STREAM
+        try:
+            while True:
+                item = write_queue.get()
+                if item is _END_OF_STREAM or stop_event.is_set():
+                    break
+
+                if len(item["chunks"]) > 0:
+                    vector_store.add_documents(documents=item["chunks"], embeddings=item["embeddings"])
+                    lexical_index.add_documents(item["chunks"])
+                    self._added_ids.extend(chunk['id'] for chunk in item["chunks"])
+                    summary["chunks"] += len(item["chunks"])
+
+                # Checkpoint after every batch so an interrupted ingest resumes from here
+                if item["is_last"]:
+                    manifest.record(item["file_path"], item["content_hash"], item["settings_key"], item["chunk_ids"])
+                    summary["added"] += 1
+                    self._report_progress(summary)
+                else:
+                    manifest.record_progress(item["file_path"], item["content_hash"], item["settings_key"],
+                                             item["chunk_ids"], item["written_chunks"])
+                    self._report_progress(summary, item["written_chunks"] / len(item["chunk_ids"]))
+                manifest.save()
+        except Exception as e:
+            errors.append(e)
+            stop_event.set()
+        finally:
+            # Keep draining so the encoder is never blocked on a full queue
+            while item is not _END_OF_STREAM:
+                item = write_queue.get()
+
+    def _delete_chunks(self, vector_store: ShardedVectorStore, lexical_index, chunk_ids: list[str]) -> None:
+        vector_store.delete_documents(chunk_ids)
+        lexical_index.delete_documents(chunk_ids)
+        self._deleted_ids.extend(chunk_ids)
+
+    def _update_local_indexes(self, vector_store: ShardedVectorStore) -> None:
+        added_ids = [[] for _ in vector_store.shards]
+        deleted_ids = [[] for _ in vector_store.shards]
+        for chunk_id in self._added_ids:
+            added_ids[self.layout.shard_of(chunk_id)].append(chunk_id)
+        for chunk_id in self._deleted_ids:
+            deleted_ids[self.layout.shard_of(chunk_id)].append(chunk_id)
+
+        for shard, shard_added_ids, shard_deleted_ids in zip(vector_store.shards, added_ids, deleted_ids):
+            LocalVectorIndex.update_from_collection(shard.collection,
+                                                    local_index_directory(shard.collection_name, self.persist_directory),
+                                                    added_ids=shard_added_ids,
+                                                    deleted_ids=shard_deleted_ids,
+                                                    search_dtype=os.getenv("VECTOR_INDEX_DTYPE", "float32"))
+
+    def _produce_batches(self, chunked_files, content_hashes: dict[str, str], settings_key: str,
+                         manifest: IngestionManifest, vector_store: ShardedVectorStore, lexical_index,
+                         encode_queue: queue.Queue, stop_event: threading.Event) -> None:
+
+        for file_path, pdf_chunks in chunked_files:
+            if stop_event.is_set():
+                break
+
+            content_hash = content_hashes[file_path]
+            pdf_chunks = self._assign_chunk_ids(pdf_chunks, file_path, content_hash, settings_key)
+            chunk_ids = [chunk['id'] for chunk in pdf_chunks]
+
+            # Resume a partially written file, otherwise drop the vectors of its replaced version
+            resume_offset = manifest.resume_offset(file_path, content_hash, settings_key)
+            if manifest.chunk_ids(file_path)[:resume_offset] != chunk_ids[:resume_offset]:
+                # Written under an older chunk id scheme, start the file over
+                resume_offset = 0
+            if resume_offset == 0:
+                stale_ids = set(manifest.chunk_ids(file_path)) - set(chunk_ids)
+                self._delete_chunks(vector_store, lexical_index, sorted(stale_ids))
+            else:
+                logger.info("Resuming %s after %d of %d chunks.", file_path, resume_offset, len(chunk_ids))
+
+            # An empty or fully written file still sends one empty batch so it gets marked complete
+            batch_starts = list(range(resume_offset, len(pdf_chunks), self.batch_size)) or [len(pdf_chunks)]
+            for batch_start in batch_starts:
+                if stop_event.is_set():
+                    break
+
+                batch_end = min(batch_start + self.batch_size, len(pdf_chunks))
+                encode_queue.put({
+                    "file_path": file_path,
+                    "content_hash": content_hash,
+                    "settings_key": settings_key,
+                    "chunk_ids": chunk_ids,
+                    "chunks": pdf_chunks[batch_start:batch_end],
+                    "written_chunks": batch_end,
+                    "is_last": batch_end >= len(pdf_chunks)
+                })
+
+    def _embed_and_index(self, changed_files: list[tuple[str, str]], settings_key: str, manifest: IngestionManifest,
+                         vector_store: ShardedVectorStore, lexical_index, summary: dict[str, int]) -> None:
+
+        embeddings_manager = get_registry().get_embedding_manager(model_name = self.transformer_model_name)
+
+        # PDFs are parsed and chunked in worker processes and handed over one file at a time
+        chunked_files = summarizer_object.iter_pdf_chunks_parallel([file_path for file_path, _ in changed_files],
+                                                                   model_name=self.chunk_model_name,
+                                                                   chunk_size=self.chunk_size,
+                                                                   chunk_size_overlap=self.chunk_size_overlap,
+                                                                   max_workers=self.max_workers,
+                                                                   chunker=self.chunker)
+
+        # chunk -> encode -> write; the bounded queues hold at most queue_depth batches per stage
+        encode_queue = queue.Queue(maxsize=self.queue_depth)
+        write_queue = queue.Queue(maxsize=self.queue_depth)
+        stop_event = threading.Event()
+        errors: list[Exception] = []
+
+        encoder = threading.Thread(target=bind_request(self._encode_worker),
+                                   args=(embeddings_manager, encode_queue, write_queue, stop_event, errors),
+                                   name="ingestion-encoder", daemon=True)
+        writer = threading.Thread(target=bind_request(self._write_worker),
+                                  args=(vector_store, lexical_index, manifest, write_queue, stop_event, errors, summary),
+                                  name="ingestion-writer", daemon=True)
+        encoder.start()
+        writer.start()
+
+        try:
+            self._produce_batches(chunked_files, dict(changed_files), settings_key,
+                                  manifest, vector_store, lexical_index, encode_queue, stop_event)
+        except Exception as e:
+            errors.append(e)
+            stop_event.set()
+        finally:
+            encode_queue.put(_END_OF_STREAM)
+            encoder.join()
+            writer.join()
+
+        if len(errors) > 0:
+            raise errors[0]
+
+    def process(self) -> dict[str, int]:
+
+        summary = {"added": 0, "removed": 0, "unchanged": 0, "chunks": 0}
+        start_time = time.perf_counter()
+        self.last_error = None
+        self._added_ids, self._deleted_ids = [], []
+        vector_store = None
+        try:
+            logger.info("Starting document processing...")
+            manifest = IngestionManifest(os.path.join(self.persist_directory, "ingestion_manifest.json"))
+            settings_key = IngestionManifest.settings_key(self._settings())
+
+            # Work out which PDFs are new, changed or gone since the last run
+            pdf_files = sorted(os.path.normpath(path) for path in glob.glob(os.path.join(self.upload_directory, "*.pdf")))
+            present_files = set(pdf_files)
+            removed_files = [file_key for file_key in manifest.files if file_key not in present_files]
+            changed_files = []
+            for file_path in pdf_files:
+                content_hash = IngestionManifest.hash_file(file_path)
+                if manifest.is_current(file_path, content_hash, settings_key):
+                    summary["unchanged"] += 1
+                else:
+                    changed_files.append((file_path, content_hash))
+
+            # Collections ingested before the BM25 index existed get it backfilled once
+            lexical_index = get_registry().get_lexical_index(self.collection_name, self.persist_directory)
+            backfill_lexical_index = lexical_index.count() == 0 and len(manifest.files) > 0
+
+            if len(removed_files) == 0 and len(changed_files) == 0 and not backfill_lexical_index:
+                logger.info("All documents are already indexed, nothing to process.")
+                return summary
+
+            self._total_files = len(removed_files) + len(changed_files)
+            self._report_progress(summary, message=f"Indexing {len(changed_files)} file(s), removing {len(removed_files)}")
+            self.layout.save()
+            vector_store = ShardedVectorStore(self.layout, batch_size=self.write_batch_size)
+            if backfill_lexical_index:
+                for shard in vector_store.shards:
+                    lexical_index.build_from_collection(shard.collection)
+
+            for file_key in removed_files:
+                self._delete_chunks(vector_store, lexical_index, manifest.chunk_ids(file_key))
+                manifest.remove(file_key)
+                manifest.save()
+                summary["removed"] += 1
+                self._report_progress(summary)
+
+            if len(changed_files) > 0:
+                self._embed_and_index(changed_files, settings_key, manifest, vector_store, lexical_index, summary)
+
+            record_stage("ingest", time.perf_counter() - start_time, items=summary["chunks"])
+            logger.info("Document processing completed successfully: %s", summary)
+        except Exception as e:
+            self.last_error = e
+            record_stage("ingest", time.perf_counter() - start_time, outcome="error", items=summary["chunks"])
+            logger.exception("Error during document processing: %s", e)
+        finally:
+            # A failed run may already have written or deleted chunks (and marked files done in the
+            # manifest), so whatever reached Chroma is passed on either way
+            if vector_store is not None and (len(self._added_ids) > 0 or len(self._deleted_ids) > 0):
+                self._publish_changes(vector_store)
 
-    def process(self):
+        return summary
 
+    def _publish_changes(self, vector_store: ShardedVectorStore) -> None:
         try:
-            print("Starting document processing...")
-            # Load PDF and generate chunks
-            pdf_chunks = summarizer_object.genreate_pdf_chunks(summarizer_object.load_pdf())
-            generated_texts = [chunk['text'] for chunk in pdf_chunks]
-
-            # Generate embeddings
-            transformer_model_name = os.getenv("TRANSFORMER_MODEL_NAME")
-            embeddings_manager = EmbeddingManager(model_name = transformer_model_name)
-            final_embeddings = embeddings_manager.generate_embeddings(generated_texts)
-
-            # Create Vector Store and add documents
-            vector_store = VectorStore(documents=pdf_chunks, embeddings=final_embeddings)
-            vector_store.add_documents()   
-            print("Document processing completed successfully.")
+            # The in-process index gets one segment with this run's chunks; nothing else is read back from Chroma
+            if os.getenv("VECTOR_INDEX_BACKEND", "chroma").lower() == "local":
+                self._update_local_indexes(vector_store)
         except Exception as e:
-            print(f"Error during document processing: {e}")
\ No newline at end of file
+            self.last_error = self.last_error or e
+            logger.exception("Error updating the local vector index: %s", e)
+        finally:
+            # Cached answers may have been built from content that just changed
+            get_registry().get_answer_cache().invalidate()
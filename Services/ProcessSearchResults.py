@@ -1,94 +1,216 @@
 #from VectorStore import VectorStore
-from EmbeddingManager import EmbeddingManager
-from RetrieverPipeline import RetrieverPipeline
-from openai import OpenAI
+from Services.RetrieverPipeline import RetrieverPipeline
 
 import os
-import sys
-import chromadb
+import time
+import logging
+import threading
+from typing import TYPE_CHECKING, Iterator
+
+from Infrastructure.resource_registry import get_registry
+from Infrastructure.telemetry import get_metrics, new_request_id, record_stage, request_scope, stage
+from Services.NamespaceLayout import DEFAULT_NAMESPACE, NamespaceLayout
+
+if TYPE_CHECKING:
+    # Annotations only; the registry imports these when it first creates the clients
+    import chromadb
+    from openai import OpenAI
+    from Services.EmbeddingManager import EmbeddingManager
+
+logger = logging.getLogger(__name__)
+
+NO_RESULTS_MESSAGE = "I'm sorry, I couldn't find any relevant information to answer your query."
+
+SYSTEM_PROMPT = ("You are a helpful assistant that provides accurate and concise answers based on the provided context. "
+                 "If the answer is not contained within the context, respond with 'I don't know.'")
+
+def build_messages(query: str, results: list[dict], timings: dict | None = None) -> list[dict[str, str]]:
+
+    # Adjacent chunks are merged, repeated overlap removed and the context kept within CONTEXT_TOKEN_BUDGET
+    with stage("prompt_build", items=len(results)):
+        context, context_stats = get_registry().get_context_builder().build(results)
+    if timings is not None:
+        timings["context_tokens"] = context_stats["context_tokens"]
+        timings["context_tokens_saved"] = context_stats["context_tokens_saved"]
+    return [{"role": "system", "content": SYSTEM_PROMPT},
+            {"role": "user", "content": f"Context: {context}\n\nQuestion: {query}"}]
 
 class ProcessSearchResults:
     
-    def __init__(self, query: str, top_k: int) -> None:
+    def __init__(self, query: str, top_k: int, where: dict | None = None, namespace: str = DEFAULT_NAMESPACE) -> None:
         self.query = query
         self.top_k = top_k
+        # Optional metadata filter (see MetadataFilter.build_where), e.g. restrict to chosen files
+        self.where = where
+        self.layout = NamespaceLayout(namespace=namespace)
+        self.timings: dict[str, float] = {}
+        self.query_embedding = None
+        # Ties the log records and the profile of this query together, see Infrastructure/telemetry.py
+        self.request_id = new_request_id()
 
-    def _initialize_vector_store(self) -> chromadb.Collection:
+    def _initialize_vector_store(self) -> "chromadb.Collection":
 
-        sys.path.append('Utilities')
         from Utilities.utility_vector_store import UtilityVectorStore
 
-        vectorstore_instance = UtilityVectorStore(collection_name="pdf_documents", persist_directory="data/vector_store")
+        vectorstore_instance = UtilityVectorStore(collection_name=self.layout.collection_name,
+                                                  persist_directory=self.layout.persist_directory)
 
-        return_value = vectorstore_instance.get_vector_collection()
+        return_value = vectorstore_instance.get_vector_index()
         return return_value
         
-    def _intitialize_embedding_manager(self) -> EmbeddingManager:
-        embedding_manager = EmbeddingManager(model_name=os.getenv("Embedding_Model_Name", "all-MiniLM-L6-v2"))
+    def _intitialize_embedding_manager(self) -> "EmbeddingManager":
+        # Warm model shared across queries instead of a SentenceTransformer load per submit
+        embedding_manager = get_registry().get_embedding_manager(model_name=os.getenv("Embedding_Model_Name", "all-MiniLM-L6-v2"))
         return embedding_manager
     
     def _initialize_retriever_pipeline(self, 
-                                       vector_store: chromadb.Collection, 
-                                       embeddings: EmbeddingManager) -> RetrieverPipeline:
+                                       vector_store: "chromadb.Collection", 
+                                       embeddings: "EmbeddingManager") -> RetrieverPipeline:
         retrieverpipeline_instance = RetrieverPipeline(
-            vector_store=vector_store, embeddings=embeddings)
+            vector_store=vector_store, embeddings=embeddings,
+            lexical_index=get_registry().get_retrieval_lexical_index(collection_name=self.layout.collection_name,
+                                                                     persist_directory=self.layout.persist_directory),
+            reranker=get_registry().get_retrieval_reranker())
         return retrieverpipeline_instance
     
     def _retrieve_openai_api_key(self) -> str:
+        # The Key Vault lookup happens once per process, see ResourceRegistry
+        return get_registry().get_openai_api_key()
 
-        openai_api_key = None
-        keyvault_name = os.getenv("KeyVault_Name")
-        secret_name = os.getenv("secret_name")
+    def _initialize_llm(self) -> "OpenAI":
+        return get_registry().get_llm_client()
 
-        sys.path.append('Infrastructure')
-        from Infrastructure.configuration import GetConfiguration
+    def _retrieve_results(self) -> list[dict]:
 
-        if keyvault_name and secret_name:
-            config = GetConfiguration(secret_name=secret_name, keyvault_name=keyvault_name)
-            openai_api_key = config.get_openai_api_key()
-        
-        if openai_api_key:
-            return openai_api_key
+        vectorstore_instance = self._initialize_vector_store()
+        embedding_manager = self._intitialize_embedding_manager()
+        retrieverpipeline_instance = self._initialize_retriever_pipeline(
+            vector_store=vectorstore_instance, embeddings=embedding_manager)
         
-        return ""
-
-    def _initialize_llm(self) -> OpenAI:
-
-        openai_api_key = self._retrieve_openai_api_key()
-        llm = OpenAI(api_key = openai_api_key)
-        return llm
+        with stage("retrieve"):
+            results = retrieverpipeline_instance.retrieve(self.query, self.top_k, where=self.where)
+        self.query_embedding = retrieverpipeline_instance.last_query_embedding
+        self.timings.update(retrieverpipeline_instance.last_rerank_stats)
+        return results
+
+    def _answer_cache(self):
+        if os.getenv("ANSWER_CACHE_ENABLED", "true").lower() == "false" or self.query_embedding is None:
+            return None
+        return get_registry().get_answer_cache()
+
+    def _lookup_cached_answer(self, results: list[dict], model_name: str) -> str | None:
+        # Near-duplicate questions over the same retrieved chunks reuse the stored answer
+        answer_cache = self._answer_cache()
+        if answer_cache is None:
+            return None
+
+        answer = answer_cache.lookup(self.query_embedding, [doc['id'] for doc in results], model_name=model_name)
+        self.timings["answer_cache_hit"] = answer is not None
+        get_metrics().increment("rag_answer_cache_total", outcome="hit" if answer is not None else "miss")
+        return answer
+
+    def _store_cached_answer(self, results: list[dict], model_name: str, answer: str) -> None:
+        answer_cache = self._answer_cache()
+        if answer_cache is not None:
+            answer_cache.store(self.query_embedding, [doc['id'] for doc in results], answer, model_name=model_name)
+
+    def _build_messages(self, results: list[dict]) -> list[dict[str, str]]:
+        return build_messages(self.query, results, self.timings)
 
     def process_query_results(self):
 
-        try:
+        with request_scope(self.request_id, entry_point="app"):
+            try:
+                self.timings = {}
+                start_time = time.perf_counter()
 
-            vectorstore_instance = self._initialize_vector_store()
-            embedding_manager = self._intitialize_embedding_manager()
-            retrieverpipeline_instance = self._initialize_retriever_pipeline(
-                vector_store=vectorstore_instance, embeddings=embedding_manager)
-            
-            results = retrieverpipeline_instance.retrieve(self.query, self.top_k)
+                results = self._retrieve_results()
+                self.timings["retrieval_seconds"] = time.perf_counter() - start_time
 
-            if not results or len(results) == 0:
-                return "I'm sorry, I couldn't find any relevant information to answer your query."
-            
-            system_prompt = ("You are a helpful assistant that provides accurate and concise answers based on the provided context. "
-            "If the answer is not contained within the context, respond with 'I don't know.'")
+                if not results or len(results) == 0:
+                    return NO_RESULTS_MESSAGE
 
-            model_name = os.getenv('Model', 'gpt-5')
-            if model_name and len(model_name.strip()) > 0:
-                llm = self._initialize_llm()
+                model_name = os.getenv('Model', 'gpt-5')
+                if model_name and len(model_name.strip()) > 0:
+                    cached_answer = self._lookup_cached_answer(results, model_name)
+                    if cached_answer is not None:
+                        self.timings["total_seconds"] = time.perf_counter() - start_time
+                        return cached_answer
 
-                context = "\n\n".join([doc['text'] for doc in results])
+                    llm = self._initialize_llm()
 
-                response = llm.chat.completions.create(model=model_name,
-                                                    messages=[{"role": "system", "content": system_prompt},
-                                                              {"role": "user", "content": f"Context: {context}\n\nQuestion: {self.query}"}])
+                    messages = self._build_messages(results)
+                    generation_start = time.perf_counter()
+                    with stage("llm_generation"):
+                        response = llm.chat.completions.create(model=model_name, messages=messages)
+                    self.timings["generation_seconds"] = time.perf_counter() - generation_start
+                    self.timings["total_seconds"] = time.perf_counter() - start_time
                 
-                answer = response.choices[0].message.content
-                return answer
-        except Exception as e:
-            print(f"Error processing query results: {e}")
-            raise e
-        
+                    answer = response.choices[0].message.content
+                    self._store_cached_answer(results, model_name, answer)
+                    return answer
+            except Exception as e:
+                logger.error("Error processing query results: %s", e)
+                raise e
+
+    def stream_query_results(self, cancel_event: threading.Event | None = None) -> Iterator[str]:
+
+        # Yields the answer token by token; setting cancel_event stops generation and closes the stream
+        with request_scope(self.request_id, entry_point="app_stream"):
+            self.timings = {}
+            start_time = time.perf_counter()
+
+            try:
+                results = self._retrieve_results()
+                self.timings["retrieval_seconds"] = time.perf_counter() - start_time
+            except Exception as e:
+                logger.error("Error processing query results: %s", e)
+                raise e
+
+            if not results or len(results) == 0:
+                yield NO_RESULTS_MESSAGE
+                return
 
+            model_name = os.getenv('Model', 'gpt-5')
+            if not model_name or len(model_name.strip()) == 0:
+                return
+
+            cached_answer = self._lookup_cached_answer(results, model_name)
+            if cached_answer is not None:
+                self.timings["time_to_first_token_seconds"] = 0.0
+                self.timings["total_seconds"] = time.perf_counter() - start_time
+                yield cached_answer
+                return
+
+            answer_parts = []
+            llm = self._initialize_llm()
+            messages = self._build_messages(results)
+            generation_start = time.perf_counter()
+            stream = llm.chat.completions.create(model=model_name, messages=messages, stream=True)
+            try:
+                for chunk in stream:
+                    if cancel_event is not None and cancel_event.is_set():
+                        self.timings["cancelled"] = True
+                        logger.info("Answer generation cancelled")
+                        break
+
+                    if not chunk.choices:
+                        continue
+
+                    delta = chunk.choices[0].delta.content
+                    if delta:
+                        if "time_to_first_token_seconds" not in self.timings:
+                            self.timings["time_to_first_token_seconds"] = time.perf_counter() - generation_start
+                            record_stage("llm_first_token", self.timings["time_to_first_token_seconds"])
+                        answer_parts.append(delta)
+                        yield delta
+                else:
+                    # Only complete answers are cached, never a cancelled partial one
+                    self._store_cached_answer(results, model_name, "".join(answer_parts))
+            finally:
+                # Also runs when the consumer abandons the generator, e.g. a Streamlit rerun
+                stream.close()
+                self.timings["generation_seconds"] = time.perf_counter() - generation_start
+                self.timings["total_seconds"] = time.perf_counter() - start_time
+                record_stage("llm_generation", self.timings["generation_seconds"],
+                             outcome="cancelled" if self.timings.get("cancelled") else "ok")
@@ -0,0 +1,301 @@
+import os
+import time
+import asyncio
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, AsyncIterator
+
+from aiohttp import web
+
+from Services.RetrieverPipeline import RetrieverPipeline
+from Services.ProcessSearchResults import NO_RESULTS_MESSAGE, build_messages
+from Services.MetadataFilter import build_where
+from Services.NamespaceLayout import DEFAULT_NAMESPACE, NamespaceLayout
+from Infrastructure.resource_registry import get_registry
+from Infrastructure.telemetry import bind_request, configure_logging, get_metrics, record_stage, request_scope
+from Infrastructure.warmup import get_startup_report, start_warm_up
+
+logger = logging.getLogger(__name__)
+
+class QueryService:
+
+    def __init__(self,
+                 collection_name: str = "pdf_documents",
+                 persist_directory: str = "data/vector_store",
+                 top_k: int = 3,
+                 max_concurrency: int = 16,
+                 embedding_workers: int = 2,
+                 vector_store_workers: int = 8,
+                 request_timeout_seconds: float = 60.0) -> None:
+        self.collection_name = collection_name
+        self.persist_directory = persist_directory
+        self.top_k = top_k
+        self.request_timeout_seconds = request_timeout_seconds
+        self.model_name = os.getenv("Model", "gpt-5")
+        self.embedding_model_name = os.getenv("Embedding_Model_Name", "all-MiniLM-L6-v2")
+
+        # Embedding is CPU bound, so it gets a small dedicated pool; Chroma queries mostly wait on I/O
+        self.embedding_executor = ThreadPoolExecutor(max_workers=embedding_workers, thread_name_prefix="query-embedding")
+        self.vector_store_executor = ThreadPoolExecutor(max_workers=vector_store_workers, thread_name_prefix="query-vector-store")
+        self.concurrency_limit = asyncio.Semaphore(max_concurrency)
+
+    def _retriever_pipeline(self, namespace: str = DEFAULT_NAMESPACE) -> RetrieverPipeline:
+        registry = get_registry()
+        layout = NamespaceLayout(namespace=namespace, base_persist_directory=self.persist_directory,
+                                 collection_name=self.collection_name)
+        # Ingestion runs in other processes; reopen the namespace once it has written new chunks
+        registry.release_if_ingested(layout.persist_directory)
+        return RetrieverPipeline(
+            vector_store=registry.get_vector_index(collection_name=layout.collection_name,
+                                                   persist_directory=layout.persist_directory),
+            embeddings=registry.get_embedding_manager(model_name=self.embedding_model_name),
+            lexical_index=registry.get_retrieval_lexical_index(collection_name=layout.collection_name,
+                                                               persist_directory=layout.persist_directory),
+            reranker=registry.get_retrieval_reranker())
+
+    async def _retrieve(self, query: str, top_k: int, timings: dict[str, float],
+                        where: dict[str, Any] | None = None,
+                        namespace: str = DEFAULT_NAMESPACE) -> tuple[list[dict], Any]:
+
+        loop = asyncio.get_running_loop()
+        start_time = time.perf_counter()
+
+        # Executor threads do not inherit the request context; bind_request hands a copy over with every call
+        retriever_pipeline = await loop.run_in_executor(self.vector_store_executor, bind_request(self._retriever_pipeline),
+                                                        namespace)
+        # Submitted from the loop, any number of concurrent requests can share one micro-batch;
+        # a blocking call on the small embedding pool would cap a batch at the pool size
+        query_future = retriever_pipeline.embeddings.submit_query_embedding(query)
+        if query_future is not None:
+            embed_start = time.perf_counter()
+            query_embedding = await asyncio.wrap_future(query_future)
+            record_stage("query_embed", time.perf_counter() - embed_start)
+            if query_embedding.size == 0:
+                query_embedding = None
+        else:
+            query_embedding = await loop.run_in_executor(self.embedding_executor, bind_request(retriever_pipeline.embed_query),
+                                                         query)
+        timings["embedding_seconds"] = time.perf_counter() - start_time
+        if query_embedding is None:
+            return [], None
+
+        results = await loop.run_in_executor(self.vector_store_executor, bind_request(retriever_pipeline.retrieve_by_embedding),
+                                             query_embedding, top_k, query, where)
+        timings.update(retriever_pipeline.last_rerank_stats)
+        timings["retrieval_seconds"] = time.perf_counter() - start_time
+        record_stage("retrieve", timings["retrieval_seconds"])
+        return results, query_embedding
+
+    async def _build_messages(self, query: str, results: list[dict], timings: dict[str, float]) -> list[dict[str, str]]:
+        # Packing the context tokenizes every passage; off the loop, like retrieval, so other requests keep running
+        return await asyncio.get_running_loop().run_in_executor(self.vector_store_executor, bind_request(build_messages),
+                                                                query, results, timings)
+
+    async def answer(self, query: str, top_k: int | None = None, where: dict[str, Any] | None = None,
+                     namespace: str = DEFAULT_NAMESPACE) -> dict[str, Any]:
+
+        timings: dict[str, float] = {}
+        start_time = time.perf_counter()
+        async with self.concurrency_limit:
+            results, query_embedding = await self._retrieve(query, top_k or self.top_k, timings, where, namespace)
+            if len(results) == 0:
+                return {"answer": NO_RESULTS_MESSAGE, "sources": [], "timings": timings}
+
+            chunk_ids = [doc['id'] for doc in results]
+            answer_cache = get_registry().get_answer_cache()
+            answer = answer_cache.lookup(query_embedding, chunk_ids, model_name=self.model_name)
+            timings["answer_cache_hit"] = answer is not None
+            get_metrics().increment("rag_answer_cache_total", outcome="hit" if answer is not None else "miss")
+
+            if answer is None:
+                messages = await self._build_messages(query, results, timings)
+                generation_start = time.perf_counter()
+                response = await get_registry().get_async_llm_client().chat.completions.create(
+                    model=self.model_name, messages=messages)
+                answer = response.choices[0].message.content
+                timings["generation_seconds"] = time.perf_counter() - generation_start
+                record_stage("llm_generation", timings["generation_seconds"])
+                answer_cache.store(query_embedding, chunk_ids, answer, model_name=self.model_name)
+
+        timings["total_seconds"] = time.perf_counter() - start_time
+        return {
+            "answer": answer,
+            "sources": sorted({str(doc['metadata'].get('source', '')) for doc in results}),
+            "timings": timings
+        }
+
+    async def stream_answer(self, query: str, top_k: int | None = None, where: dict[str, Any] | None = None,
+                            namespace: str = DEFAULT_NAMESPACE) -> tuple[dict[str, float], AsyncIterator[str]]:
+
+        # Retrieval runs before the response starts, so its cost can be reported in the headers
+        timings: dict[str, float] = {}
+        results, query_embedding = await self._retrieve(query, top_k or self.top_k, timings, where, namespace)
+
+        async def generate() -> AsyncIterator[str]:
+            if len(results) == 0:
+                yield NO_RESULTS_MESSAGE
+                return
+
+            chunk_ids = [doc['id'] for doc in results]
+            answer_cache = get_registry().get_answer_cache()
+            cached_answer = answer_cache.lookup(query_embedding, chunk_ids, model_name=self.model_name)
+            get_metrics().increment("rag_answer_cache_total", outcome="hit" if cached_answer is not None else "miss")
+            if cached_answer is not None:
+                yield cached_answer
+                return
+
+            answer_parts = []
+            messages = await self._build_messages(query, results, timings)
+            generation_start = time.perf_counter()
+            stream = await get_registry().get_async_llm_client().chat.completions.create(
+                model=self.model_name, messages=messages, stream=True)
+            try:
+                async for chunk in stream:
+                    if chunk.choices and chunk.choices[0].delta.content:
+                        if len(answer_parts) == 0:
+                            record_stage("llm_first_token", time.perf_counter() - generation_start)
+                        answer_parts.append(chunk.choices[0].delta.content)
+                        yield chunk.choices[0].delta.content
+                answer_cache.store(query_embedding, chunk_ids, "".join(answer_parts), model_name=self.model_name)
+            finally:
+                await stream.close()
+                record_stage("llm_generation", time.perf_counter() - generation_start)
+
+        return timings, generate()
+
+    async def handle_health(self, request: web.Request) -> web.Response:
+        return web.json_response({"status": "ok", "startup": get_startup_report().snapshot()})
+
+    async def handle_ready(self, request: web.Request) -> web.Response:
+        # Readiness probe: 503 until the model, indexes and LLM client are warm
+        report = get_startup_report().snapshot()
+        return web.json_response(report, status=200 if report["ready"] else 503)
+
+    async def handle_metrics(self, request: web.Request) -> web.Response:
+        # Prometheus scrape endpoint
+        return web.Response(text=get_metrics().render_prometheus(), content_type="text/plain")
+
+    @staticmethod
+    def _request_id(request: web.Request) -> str | None:
+        # A caller-supplied X-Request-Id (QueryServiceClient sends one) is reused, within reason
+        request_id = request.headers.get("X-Request-Id", "")
+        return request_id if 0 < len(request_id) <= 64 and request_id.isprintable() else None
+
+    async def _read_query(self, request: web.Request, request_id: str) -> tuple[str, int, dict[str, Any] | None, str]:
+
+        # Runs inside the request scope, so a rejected request is counted and carries its id too
+        def bad_request(text: str) -> web.HTTPBadRequest:
+            return web.HTTPBadRequest(text=text, headers={"X-Request-Id": request_id})
+
+        try:
+            payload = await request.json()
+        except ValueError:
+            # json.JSONDecodeError is a ValueError
+            raise bad_request("The request body must be JSON.")
+        if not isinstance(payload, dict):
+            raise bad_request("The request body must be a JSON object.")
+
+        query = str(payload.get("query", "")).strip()
+        if not query:
+            raise bad_request("The 'query' field is required.")
+
+        top_k = payload.get("top_k", self.top_k)
+        if isinstance(top_k, bool) or not isinstance(top_k, int) or top_k < 1:
+            raise bad_request("The 'top_k' field must be a positive integer.")
+
+        # Either a Chroma style "where" clause or the shorthand fields
+        where = payload.get("where")
+        if where is not None and not isinstance(where, dict):
+            raise bad_request("The 'where' field must be a JSON object.")
+        page_range = payload.get("page_range")
+        try:
+            where = where or build_where(sources=payload.get("sources"),
+                                         page_range=tuple(page_range) if page_range else None,
+                                         ingested_after=payload.get("ingested_after"),
+                                         ingested_before=payload.get("ingested_before"))
+        except (TypeError, ValueError) as e:
+            raise bad_request(f"Invalid filter: {e}")
+        namespace = str(payload.get("namespace") or DEFAULT_NAMESPACE)
+        try:
+            NamespaceLayout(namespace=namespace)
+        except ValueError as e:
+            raise bad_request(str(e))
+        return query, top_k, where, namespace
+
+    async def handle_query(self, request: web.Request) -> web.Response:
+        with request_scope(self._request_id(request), entry_point="api") as request_id:
+            query, top_k, where, namespace = await self._read_query(request, request_id)
+            try:
+                result = await asyncio.wait_for(self.answer(query, top_k, where, namespace), timeout=self.request_timeout_seconds)
+            except asyncio.TimeoutError:
+                raise web.HTTPGatewayTimeout(text=f"The query did not finish within {self.request_timeout_seconds} seconds.")
+        return web.json_response(result, headers={"X-Request-Id": request_id})
+
+    async def handle_query_stream(self, request: web.Request) -> web.StreamResponse:
+        with request_scope(self._request_id(request), entry_point="api_stream") as request_id:
+            query, top_k, where, namespace = await self._read_query(request, request_id)
+            loop = asyncio.get_running_loop()
+            deadline = loop.time() + self.request_timeout_seconds
+
+            async with self.concurrency_limit:
+                try:
+                    timings, answer_stream = await asyncio.wait_for(self.stream_answer(query, top_k, where, namespace),
+                                                                    timeout=self.request_timeout_seconds)
+                except asyncio.TimeoutError:
+                    raise web.HTTPGatewayTimeout(text=f"The query did not finish within {self.request_timeout_seconds} seconds.")
+
+                response = web.StreamResponse(headers={
+                    "Content-Type": "text/plain; charset=utf-8",
+                    "X-Embedding-Seconds": f"{timings.get('embedding_seconds', 0.0):.4f}",
+                    "X-Retrieval-Seconds": f"{timings.get('retrieval_seconds', 0.0):.4f}",
+                    "X-Request-Id": request_id})
+                await response.prepare(request)
+
+                try:
+                    while True:
+                        # The deadline covers the whole answer, not each token
+                        text = await asyncio.wait_for(answer_stream.__anext__(), timeout=max(deadline - loop.time(), 0.0))
+                        await response.write(text.encode("utf-8"))
+                except StopAsyncIteration:
+                    pass
+                except asyncio.TimeoutError:
+                    logger.warning("Streaming answer timed out after %s seconds", self.request_timeout_seconds)
+                finally:
+                    await answer_stream.aclose()
+
+            await response.write_eof()
+            return response
+
+    def create_app(self) -> web.Application:
+
+        app = web.Application()
+        app.add_routes([web.get("/health", self.handle_health),
+                        web.get("/ready", self.handle_ready),
+                        web.get("/metrics", self.handle_metrics),
+                        web.post("/query", self.handle_query),
+                        web.post("/query/stream", self.handle_query_stream)])
+        app.on_startup.append(self._on_startup)
+        app.on_cleanup.append(self._on_cleanup)
+        return app
+
+    async def _on_startup(self, app: web.Application) -> None:
+        # The port is open at once; the first query is fast once /ready answers 200
+        start_warm_up(persist_directory=self.persist_directory, collection_name=self.collection_name)
+
+    async def _on_cleanup(self, app: web.Application) -> None:
+        self.embedding_executor.shutdown(wait=False, cancel_futures=True)
+        self.vector_store_executor.shutdown(wait=False, cancel_futures=True)
+
+def run_query_service() -> None:
+
+    configure_logging()
+    query_service = QueryService(
+        max_concurrency=int(os.getenv("QUERY_SERVICE_MAX_CONCURRENCY", "16")),
+        embedding_workers=int(os.getenv("QUERY_SERVICE_EMBEDDING_WORKERS", "2")),
+        request_timeout_seconds=float(os.getenv("QUERY_SERVICE_TIMEOUT_SECONDS", "60")))
+    web.run_app(query_service.create_app(),
+                host=os.getenv("QUERY_SERVICE_HOST", "0.0.0.0"),
+                port=int(os.getenv("QUERY_SERVICE_PORT", "8000")))
+
+if __name__ == "__main__":
+    run_query_service()
@@ -0,0 +1,65 @@
+import time
+import logging
+import threading
+from typing import Iterator
+
+import httpx
+
+from Infrastructure.telemetry import new_request_id
+
+logger = logging.getLogger(__name__)
+
+# Thin client for Services/QueryService.py with the same streaming interface as ProcessSearchResults
+class QueryServiceClient:
+
+    def __init__(self, query: str, top_k: int, service_url: str, timeout_seconds: float = 60.0,
+                 where: dict | None = None, namespace: str = "default") -> None:
+        self.query = query
+        self.top_k = top_k
+        self.where = where
+        self.namespace = namespace
+        self.service_url = service_url.rstrip("/")
+        self.timeout_seconds = timeout_seconds
+        self.timings: dict[str, float] = {}
+        # Sent as X-Request-Id so the service logs and metrics can be matched to this query
+        self.request_id = new_request_id()
+
+    def process_query_results(self) -> str:
+        try:
+            response = httpx.post(f"{self.service_url}/query",
+                                  json={"query": self.query, "top_k": self.top_k, "where": self.where,
+                                "namespace": self.namespace},
+                                  headers={"X-Request-Id": self.request_id},
+                                  timeout=self.timeout_seconds)
+            response.raise_for_status()
+            result = response.json()
+            self.timings = result.get("timings", {})
+            return result["answer"]
+        except Exception as e:
+            logger.error("Error calling the query service at %s: %s", self.service_url, e)
+            raise e
+
+    def stream_query_results(self, cancel_event: threading.Event | None = None) -> Iterator[str]:
+
+        self.timings = {}
+        start_time = time.perf_counter()
+        with httpx.stream("POST", f"{self.service_url}/query/stream",
+                          json={"query": self.query, "top_k": self.top_k, "where": self.where,
+                                "namespace": self.namespace},
+                          headers={"X-Request-Id": self.request_id},
+                          timeout=self.timeout_seconds) as response:
+            response.raise_for_status()
+            self.timings["retrieval_seconds"] = float(response.headers.get("X-Retrieval-Seconds", 0.0))
+
+            for text in response.iter_text():
+                if cancel_event is not None and cancel_event.is_set():
+                    self.timings["cancelled"] = True
+                    break
+                if text:
+                    if "time_to_first_token_seconds" not in self.timings:
+                        # Measured from the end of retrieval, like ProcessSearchResults does
+                        self.timings["time_to_first_token_seconds"] = (time.perf_counter() - start_time
+                                                                       - self.timings["retrieval_seconds"])
+                    yield text
+
+        self.timings["total_seconds"] = time.perf_counter() - start_time
@@ -1,8 +1,9 @@
-from langchain_openai import OpenAI
-from openai import OpenAI
-from RetrieverPipeline import RetrieverPipeline
+from Services.RetrieverPipeline import RetrieverPipeline
 import os
-import sys
+import time
+import logging
+import threading
+from typing import Iterator
 
 from dotenv import load_dotenv
 
@@ -11,12 +12,14 @@ from dotenv import load_dotenv
 # from EmbeddingManager import EmbeddingManager
 # from VectorStore import VectorStore
 
+logger = logging.getLogger(__name__)
+
 if os.getenv("ENVIRONMENT") == "development":
-    print("Loading environment variables from .env file")
+    logger.info("Loading environment variables from .env file")
     load_dotenv(".env")
 
-sys.path.append("Infrastructure")
-from Infrastructure.configuration import GetConfiguration
+from Infrastructure.resource_registry import get_registry
+from Infrastructure.telemetry import record_stage, stage
 
 class RagUsingLLM:
     
@@ -24,46 +27,97 @@ class RagUsingLLM:
         self.retriever_object = retriever_object
         self.query = query
         self.top_k = top_k
+        self.timings: dict[str, float] = {}
     
     
     def generate_response_using_llm(self):
 
         try:
-            openai_api_key = None
-
-            keyvault_name = os.getenv("KeyVault_Name")
-            secret_name = os.getenv("secret_name")
-
-            if keyvault_name and secret_name:
-                config = GetConfiguration(secret_name=secret_name, keyvault_name=keyvault_name)
-                openai_api_key = config.get_openai_api_key()
+            registry = get_registry()
+            openai_api_key = registry.get_openai_api_key()
             
             if not openai_api_key:
                 raise ValueError("OpenAI API key is not provided. Please set the OPENAI_API_KEY environment variable.")
             
-            llm = OpenAI(api_key = openai_api_key)
+            llm = registry.get_llm_client()
 
             retrieved_docs = self.retriever_object.retrieve(query=self.query, top_k=self.top_k)
 
             if not retrieved_docs or len(retrieved_docs) == 0:
-                print("No relevant documents found for the query.")
+                logger.info("No relevant documents found for the query.")
                 return "I'm sorry, I couldn't find any relevant information to answer your query."
             else:
-                context = "\n\n".join([doc['text'] for doc in retrieved_docs])
+                with stage("prompt_build"):
+                    context, context_stats = registry.get_context_builder().build(retrieved_docs)
+                self.timings["context_tokens_saved"] = context_stats["context_tokens_saved"]
 
             system_prompt = ("You are a helpful assistant that provides accurate and concise answers based on the provided context."
                              "If the answer is not contained within the context, respond with 'I don't know.'")
             
             model_name = os.getenv('Model')
             if model_name and len(model_name.strip()) > 0:
-                response = llm.chat.completions.create(model=model_name,
-                                                    messages=[{"role": "system", "content": system_prompt},
-                                                                {"role": "user", "content": f"Context: {context}\n\nQueston: {self.query}\nAnswer:"}])
+                with stage("llm_generation"):
+                    response = llm.chat.completions.create(model=model_name,
+                                                        messages=[{"role": "system", "content": system_prompt},
+                                                                    {"role": "user", "content": f"Context: {context}\n\nQueston: {self.query}\nAnswer:"}])
                 return response
 
         except Exception as e:
-            print(f"Error generating response using LLM: {e}")
+            logger.error("Error generating response using LLM: %s", e)
             return ""
+
+    def stream_response_using_llm(self, cancel_event: threading.Event | None = None) -> Iterator[str]:
+
+        # Streaming variant of generate_response_using_llm, yields answer text as it arrives
+        self.timings = {}
+        start_time = time.perf_counter()
+
+        registry = get_registry()
+        if not registry.get_openai_api_key():
+            raise ValueError("OpenAI API key is not provided. Please set the OPENAI_API_KEY environment variable.")
+
+        llm = registry.get_llm_client()
+
+        retrieved_docs = self.retriever_object.retrieve(query=self.query, top_k=self.top_k)
+        self.timings["retrieval_seconds"] = time.perf_counter() - start_time
+
+        if not retrieved_docs or len(retrieved_docs) == 0:
+            logger.info("No relevant documents found for the query.")
+            yield "I'm sorry, I couldn't find any relevant information to answer your query."
+            return
+
+        with stage("prompt_build"):
+            context, context_stats = registry.get_context_builder().build(retrieved_docs)
+        self.timings["context_tokens_saved"] = context_stats["context_tokens_saved"]
+        system_prompt = ("You are a helpful assistant that provides accurate and concise answers based on the provided context."
+                         "If the answer is not contained within the context, respond with 'I don't know.'")
+
+        model_name = os.getenv('Model')
+        if not model_name or len(model_name.strip()) == 0:
+            return
+
+        generation_start = time.perf_counter()
+        stream = llm.chat.completions.create(model=model_name,
+                                             messages=[{"role": "system", "content": system_prompt},
+                                                       {"role": "user", "content": f"Context: {context}\n\nQueston: {self.query}\nAnswer:"}],
+                                             stream=True)
+        try:
+            for chunk in stream:
+                if cancel_event is not None and cancel_event.is_set():
+                    self.timings["cancelled"] = True
+                    break
+
+                if chunk.choices and chunk.choices[0].delta.content:
+                    if "time_to_first_token_seconds" not in self.timings:
+                        self.timings["time_to_first_token_seconds"] = time.perf_counter() - generation_start
+                        record_stage("llm_first_token", self.timings["time_to_first_token_seconds"])
+                    yield chunk.choices[0].delta.content
+        finally:
+            stream.close()
+            self.timings["generation_seconds"] = time.perf_counter() - generation_start
+            record_stage("llm_generation", self.timings["generation_seconds"],
+                         outcome="cancelled" if self.timings.get("cancelled") else "ok")
+            self.timings["total_seconds"] = time.perf_counter() - start_time
         
 #**********************************************************************************************************
 # This is only to test the RetrieverPipeline class
@@ -0,0 +1,93 @@
+import time
+import hashlib
+import threading
+from collections import OrderedDict
+from typing import Any
+
+from Infrastructure.telemetry import record_stage
+
+class CrossEncoderReranker:
+
+    # Re-orders the retrieved candidates with a cross-encoder that reads query and chunk together.
+    # Candidates are scored best-retrieval-rank first in batches of batch_size; once latency_budget_ms
+    # is spent the remaining candidates keep their retrieval order behind the scored ones.
+    def __init__(self,
+                 model_name: str = "cross-encoder/ms-marco-MiniLM-L-6-v2",
+                 candidate_count: int = 50,
+                 batch_size: int = 16,
+                 latency_budget_ms: float = 300.0,
+                 max_length: int = 512,
+                 cache_entries: int = 10000) -> None:
+        self.model_name = model_name
+        self.candidate_count = candidate_count
+        self.batch_size = batch_size
+        self.latency_budget_seconds = latency_budget_ms / 1000.0
+        self.cache_entries = cache_entries
+        self.counters = {"scored_pairs": 0, "cached_pairs": 0, "budget_cutoffs": 0}
+        self._cache: OrderedDict[str, float] = OrderedDict()
+        self._lock = threading.Lock()
+
+        from sentence_transformers import CrossEncoder
+        self.model = CrossEncoder(model_name, device="cpu", max_length=max_length)
+
+    def _pair_key(self, query: str, doc: dict) -> str:
+        # Chunk ids are derived from content, so they identify the chunk text; fall back to the text itself
+        chunk_key = doc.get('id') or doc['text']
+        normalized_query = " ".join(query.lower().split())
+        return hashlib.sha256(f"{self.model_name}\x00{normalized_query}\x00{chunk_key}".encode("utf-8")).hexdigest()
+
+    def _remember(self, key: str, score: float) -> None:
+        with self._lock:
+            self._cache[key] = score
+            self._cache.move_to_end(key)
+            while len(self._cache) > self.cache_entries:
+                self._cache.popitem(last=False)
+
+    def rerank(self, query: str, docs: list[dict], top_k: int) -> tuple[list[dict], dict[str, Any]]:
+
+        start_time = time.perf_counter()
+        keys = [self._pair_key(query, doc) for doc in docs]
+        scores: list[float | None] = [None] * len(docs)
+        with self._lock:
+            for i, key in enumerate(keys):
+                if key in self._cache:
+                    self._cache.move_to_end(key)
+                    scores[i] = self._cache[key]
+        cached_pairs = sum(score is not None for score in scores)
+
+        pending = [i for i, score in enumerate(scores) if score is None]
+        budget_exceeded = False
+        for batch_start in range(0, len(pending), self.batch_size):
+            if time.perf_counter() - start_time > self.latency_budget_seconds:
+                budget_exceeded = True
+                break
+            batch = pending[batch_start:batch_start + self.batch_size]
+            batch_scores = self.model.predict([(query, docs[i]['text']) for i in batch],
+                                              batch_size=self.batch_size, show_progress_bar=False)
+            for i, score in zip(batch, batch_scores):
+                scores[i] = float(score)
+                self._remember(keys[i], scores[i])
+
+        scored = sorted((i for i, score in enumerate(scores) if score is not None), key=lambda i: -scores[i])
+        unscored = [i for i, score in enumerate(scores) if score is None]
+        reranked = []
+        for i in (scored + unscored)[:top_k]:
+            doc = dict(docs[i])
+            if scores[i] is not None:
+                doc['rerank_score'] = scores[i]
+            reranked.append(doc)
+
+        with self._lock:
+            self.counters["cached_pairs"] += cached_pairs
+            self.counters["scored_pairs"] += len(scored) - cached_pairs
+            self.counters["budget_cutoffs"] += int(budget_exceeded)
+
+        rerank_seconds = time.perf_counter() - start_time
+        record_stage("rerank", rerank_seconds, outcome="budget_exceeded" if budget_exceeded else "ok", items=len(scored) - cached_pairs)
+        return reranked, {
+            "rerank_seconds": rerank_seconds,
+            "rerank_candidates": len(docs),
+            "rerank_scored": len(scored) - cached_pairs,
+            "rerank_cached": cached_pairs,
+            "rerank_budget_exceeded": budget_exceeded
+        }
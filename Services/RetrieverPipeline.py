@@ -1,79 +1,230 @@
-from typing import Any, List, Dict
-from EmbeddingManager import EmbeddingManager
-from VectorStore import VectorStore
-from scipy.spatial import distance
+from typing import TYPE_CHECKING, Any, List, Dict
+from Services.LexicalIndex import BM25Index, reciprocal_rank_fusion
+from Infrastructure.telemetry import stage
 
-import chromadb
+import logging
+import numpy as np
+
+if TYPE_CHECKING:
+    # Annotations only: torch, sentence-transformers and chromadb load with the objects passed in
+    import chromadb
+    from Services.EmbeddingManager import EmbeddingManager
+    from Services.Reranker import CrossEncoderReranker
+
+logger = logging.getLogger(__name__)
 
 # import summarizer as summarizer_object
 # from EmbeddingManager import EmbeddingManager
 
 class RetrieverPipeline:
     
-    def __init__(self, vector_store: chromadb.Collection, embeddings: EmbeddingManager):
+    def __init__(self, vector_store: "chromadb.Collection", embeddings: "EmbeddingManager",
+                 lexical_index: BM25Index | None = None, candidate_factor: int = 4, rrf_k: int = 60,
+                 reranker: "CrossEncoderReranker | None" = None):
         self.vector_store = vector_store
         self.embeddings = embeddings
+        self.lexical_index = lexical_index
+        self.candidate_factor = candidate_factor
+        self.rrf_k = rrf_k
+        self.reranker = reranker
+        self.last_query_embedding = None
+        self.last_rerank_stats: Dict[str, Any] = {}
+
+    @staticmethod
+    def _cosine_similarities(query_vector: np.ndarray, doc_vectors: np.ndarray) -> np.ndarray:
+        # Same value as 1 - scipy cosine distance, computed for all hits at once
+        query_vector = np.asarray(query_vector, dtype=np.float64).ravel()
+        doc_vectors = np.asarray(doc_vectors, dtype=np.float64).reshape(len(doc_vectors), -1)
+
+        query_norm = np.linalg.norm(query_vector)
+        doc_norms = np.linalg.norm(doc_vectors, axis=1)
+        denominator = np.maximum(doc_norms * query_norm, np.finfo(np.float64).tiny)
+        return (doc_vectors @ query_vector) / denominator
+
+    def embed_query(self, query: str) -> np.ndarray | None:
 
-    def retrieve(self, query: str, top_k: int = 5) -> List[Dict[str, Any]]:
-        print(f"Retrieving top {top_k} documents for the query: {query}")
+        # Generate embedding for the query (includes any wait for the micro-batcher)
+        with stage("query_embed"):
+            query_embedding = self.embeddings.generate_query_embedding(query)
 
-        # Generate embedding for the query
-        query_embedding = self.embeddings.generate_embeddings([query])[0]
-        query_flatten_vector = query_embedding.flatten()
+        if query_embedding is None or query_embedding.size == 0:
+            logger.warning("Failed to generate embedding for the query.")
+            return None
 
-        if query_embedding.size == 0:
-            print("Failed to generate embedding for the query.")
+        self.last_query_embedding = query_embedding
+        return query_embedding
+
+    def retrieve(self, query: str, top_k: int = 5, where: Dict[str, Any] | None = None) -> List[Dict[str, Any]]:
+        logger.debug("Retrieving top %d documents", top_k)
+
+        query_embedding = self.embed_query(query)
+        if query_embedding is None:
             return []
+
+        return self.retrieve_by_embedding(query_embedding, top_k, query=query, where=where)
+
+    @staticmethod
+    def _records_by_id(results: Dict[str, Any], nested: bool) -> Dict[str, Dict[str, Any]]:
+        # query() nests every field one level deeper (one list per query embedding) than get()
+        def field(name):
+            values = results.get(name)
+            if values is None:
+                return None
+            return values[0] if nested else values
+
+        ids, documents, metadatas = field('ids') or [], field('documents'), field('metadatas')
+        distances, embeddings = field('distances'), field('embeddings')
+        return {chunk_id: {"document": documents[i],
+                           "metadata": metadatas[i],
+                           "distance": distances[i] if distances is not None else None,
+                           "embedding": embeddings[i] if embeddings is not None else None}
+                for i, chunk_id in enumerate(ids)}
+
+    def _fuse_with_lexical(self, query: str, results: Dict[str, Any], top_k: int,
+                           where: Dict[str, Any] | None = None) -> Dict[str, Any]:
+
+        # Reciprocal-rank fusion of the dense ranking and the BM25 ranking, then keep top_k
+        records = self._records_by_id(results, nested=True)
+        dense_ids = list(records)
+        with stage("lexical_search"):
+            lexical_ids = [chunk_id for chunk_id, _ in self.lexical_index.search(query, len(dense_ids) or top_k, where=where)]
+        fused_ids = reciprocal_rank_fusion([dense_ids, lexical_ids], k=self.rrf_k)[:top_k]
+
+        missing_ids = [chunk_id for chunk_id in fused_ids if chunk_id not in records]
+        if len(missing_ids) > 0:
+            # Lexical-only hits (exact part numbers, names) are loaded by id
+            records.update(self._records_by_id(
+                self.vector_store.get(ids=missing_ids, include=["documents", "metadatas", "embeddings"]), nested=False))
+
+        fused_ids = [chunk_id for chunk_id in fused_ids if chunk_id in records]
+        embeddings = [records[chunk_id]["embedding"] for chunk_id in fused_ids]
+        return {
+            "ids": [fused_ids],
+            "documents": [[records[chunk_id]["document"] for chunk_id in fused_ids]],
+            "metadatas": [[records[chunk_id]["metadata"] for chunk_id in fused_ids]],
+            "distances": [[records[chunk_id]["distance"] for chunk_id in fused_ids]],
+            "embeddings": [embeddings] if all(embedding is not None for embedding in embeddings) else None
+        }
+
+    def _candidate_counts(self, top_k: int, query: str | None) -> tuple[bool, int, int]:
+        # With a cross-encoder, retrieve a wider candidate set and let it pick the final top_k
+        rerank = self.reranker is not None and bool(query)
+        candidate_k = max(top_k, self.reranker.candidate_count) if rerank else top_k
+        hybrid = self.lexical_index is not None and bool(query)
+        return rerank, candidate_k, candidate_k * self.candidate_factor if hybrid else candidate_k
+
+    def _rank_results(self, query_embedding: np.ndarray, results: Dict[str, Any], top_k: int, query: str | None,
+                      where: Dict[str, Any] | None) -> List[Dict[str, Any]]:
+
+        retrieved_docs = []
+        doc_embeddings = None
+        final_retrieved_docs = []
+        self.last_rerank_stats = {}
+        rerank, candidate_k, _ = self._candidate_counts(top_k, query)
+
+        if self.lexical_index is not None and bool(query):
+            results = self._fuse_with_lexical(query, results, candidate_k, where)
+
+        if (results['documents'] and len(results['documents']) > 0) and (results['ids'] and len(results['ids']) > 0) and (results['distances'] and len(results['distances']) > 0 and (results['metadatas']) and len(results['metadatas']) > 0):
+            documents_text = results['documents'][0]
+            ids = results['ids'][0]
+            distances = results['distances'][0]
+            metadata_text = results['metadatas'][0]
+
+            for i, (docId, documents, distnace, metadatas) in enumerate(zip(ids, documents_text, distances, metadata_text)):
+                retrieved_docs.append({
+                    "id": docId,
+                    "text": documents,
+                    "distance": distnace,
+                    "metadata": metadatas,
+                    "rank": i + 1
+                })
+
+            stored_embeddings = results.get('embeddings')
+            if stored_embeddings is not None and len(stored_embeddings) > 0 and stored_embeddings[0] is not None and len(stored_embeddings[0]) == len(retrieved_docs):
+                doc_embeddings = np.asarray(stored_embeddings[0])
+
+        if len(retrieved_docs) > 0 and self.embeddings is not None and self.embeddings.model is not None:
+
+            if doc_embeddings is None:
+                # Fallback for stores that do not return vectors: one batched encode for all hits
+                doc_embeddings = self.embeddings.generate_embeddings([doc['text'] for doc in retrieved_docs], show_progress_bar=False)
+
+            # Calculate similarity score (cosine similarity) for every hit in one operation
+            scores = self._cosine_similarities(query_embedding, doc_embeddings)
+
+            for doc, score in zip(retrieved_docs, scores):
+                final_retrieved_docs.append({
+                    "id": doc['id'],
+                    "text": doc['text'],
+                    "similarity_score": float(score),
+                    "metadata": doc['metadata']
+                })
+
+        if rerank and len(final_retrieved_docs) > 0:
+            final_retrieved_docs, self.last_rerank_stats = self.reranker.rerank(query, final_retrieved_docs, top_k)
+
+        return final_retrieved_docs
+
+    def retrieve_by_embedding(self, query_embedding: np.ndarray, top_k: int = 5, query: str | None = None,
+                              where: Dict[str, Any] | None = None) -> List[Dict[str, Any]]:
+
         try:
-            
-            retrieved_docs = []
-            documents_text = []
-            metadata_text = []
-            ids = []
-            distances = []
-            map_doc_score = {}
-            final_retrieved_docs = []
-
-            if self.vector_store:
-                results = self.vector_store.query(query_embeddings = [query_embedding.tolist()], n_results=top_k)
-                
-                if (results['documents'] and len(results['documents']) > 0) and (results['ids'] and len(results['ids']) > 0) and (results['distances'] and len(results['distances']) > 0 and (results['metadatas']) and len(results['metadatas']) > 0):
-                    documents_text = results['documents'][0]
-                    ids = results['ids'][0]
-                    distances = results['distances'][0]
-                    metadata_text = results['metadatas'][0]
-
-                    for i, (docId, documents, distnace, metadatas) in enumerate(zip(ids, documents_text, distances, metadata_text)):
-                        retrieved_docs.append({
-                            "id": docId,
-                            "text": documents,
-                            "distance": distnace,
-                            "metadata": metadatas,
-                            "rank": i + 1
-                        })
-
-            if self.embeddings is not None and self.embeddings.model is not None:
-
-                for doc in retrieved_docs:
-                    
-                    doc_embedding = self.embeddings.generate_embeddings([doc['text']])[0]
-                    doc_flatten_vector = doc_embedding.flatten()
-                    
-                    # Calculate similarity score (e.g., cosine similarity)  
-                    score = 1 - distance.cosine(query_flatten_vector, doc_flatten_vector)
-                    map_doc_score[score] = doc['text']
-
-                    final_retrieved_docs.append({
-                        "text": doc['text'],
-                        "similarity_score": score,
-                        "metadata": doc['metadata']
-                    })
-                
+            self.last_rerank_stats = {}
+            if not self.vector_store:
+                return []
+
+            # Ask for the stored vectors too so re-ranking does not re-encode every hit
+            _, _, n_results = self._candidate_counts(top_k, query)
+            with stage("vector_search"):
+                results = self.vector_store.query(query_embeddings = [query_embedding.tolist()],
+                                                  n_results=n_results,
+                                                  include=["documents", "metadatas", "distances", "embeddings"],
+                                                  where=where)
+            return self._rank_results(query_embedding, results, top_k, query, where)
         except Exception as e:
-            print(f"Error during retrieval: {e}")
+            logger.exception("Error during retrieval: %s", e)
             return []
-        
-        return final_retrieved_docs
+
+    def retrieve_batch(self, queries: List[str], top_k: int = 5, where: Dict[str, Any] | None = None,
+                       search_batch_size: int = 64) -> List[List[Dict[str, Any]]]:
+
+        # Bulk path: one batched encode for all questions and one multi-query vector search per
+        # search_batch_size of them; fusion and re-ranking stay per question. A failing question
+        # gets an empty list, like retrieve().
+        if len(queries) == 0 or not self.vector_store:
+            return [[] for _ in queries]
+
+        with stage("query_embed", items=len(queries)):
+            query_embeddings = np.asarray(self.embeddings.generate_embeddings(list(queries), show_progress_bar=False))
+
+        _, _, n_results = self._candidate_counts(top_k, queries[0])
+        all_results: List[List[Dict[str, Any]]] = []
+        for batch_start in range(0, len(queries), search_batch_size):
+            batch_embeddings = query_embeddings[batch_start:batch_start + search_batch_size]
+            try:
+                with stage("vector_search", items=len(batch_embeddings)):
+                    results = self.vector_store.query(query_embeddings=batch_embeddings.tolist(),
+                                                      n_results=n_results,
+                                                      include=["documents", "metadatas", "distances", "embeddings"],
+                                                      where=where)
+            except Exception as e:
+                logger.exception("Error during batch retrieval: %s", e)
+                all_results.extend([] for _ in batch_embeddings)
+                continue
+
+            for position, query_embedding in enumerate(batch_embeddings):
+                query = queries[batch_start + position]
+                # The same single-query shape retrieve_by_embedding gets from the index
+                single_results = {key: [results[key][position]] if results.get(key) is not None else None
+                                  for key in ("ids", "documents", "metadatas", "distances", "embeddings")}
+                try:
+                    all_results.append(self._rank_results(query_embedding, single_results, top_k, query, where))
+                except Exception as e:
+                    logger.exception("Error during retrieval: %s", e)
+                    all_results.append([])
+
+        return all_results
 
 #**********************************************************************************************************
 # This is only to test the RetrieverPipeline class
@@ -0,0 +1,754 @@
+import os
+import json
+import time
+import bisect
+import logging
+import shutil
+import sqlite3
+import tempfile
+import threading
+from typing import Any
+
+import numpy as np
+
+from Services.MetadataFilter import where_mask
+from Infrastructure.telemetry import record_stage
+
+logger = logging.getLogger(__name__)
+
+# Everything a query can ask for, in the same shape as chromadb.Collection.query
+_DEFAULT_INCLUDE = ["documents", "metadatas", "distances"]
+
+SEARCH_DTYPES = ("float32", "float16", "int8")
+
+class VectorIndex:
+
+    def query(self, query_embeddings: Any, n_results: int = 10, include: list[str] | None = None,
+              where: dict[str, Any] | None = None) -> dict[str, Any]:
+        raise NotImplementedError
+
+    def get(self, ids: list[str], include: list[str] | None = None) -> dict[str, Any]:
+        raise NotImplementedError
+
+    def count(self) -> int:
+        raise NotImplementedError
+
+class ChromaVectorIndex(VectorIndex):
+
+    def __init__(self, collection: Any) -> None:
+        self.collection = collection
+
+    def query(self, query_embeddings: Any, n_results: int = 10, include: list[str] | None = None,
+              where: dict[str, Any] | None = None) -> dict[str, Any]:
+        # Chroma applies the where clause inside its search
+        return self.collection.query(query_embeddings=query_embeddings, n_results=n_results,
+                                     include=include or _DEFAULT_INCLUDE, where=where)
+
+    def get(self, ids: list[str], include: list[str] | None = None) -> dict[str, Any]:
+        return self.collection.get(ids=ids, include=include or ["documents", "metadatas"])
+
+    def count(self) -> int:
+        return self.collection.count()
+
+class ShardedVectorIndex(VectorIndex):
+
+    # Fans a query out to every shard in parallel and merges the per-shard top-k lists by distance.
+    # All shards use the same embedding model and space, so their distances are comparable.
+    def __init__(self, shards: list[VectorIndex], max_workers: int | None = None) -> None:
+        from concurrent.futures import ThreadPoolExecutor
+
+        self.shards = shards
+        self.executor = ThreadPoolExecutor(max_workers=max_workers or min(len(shards), 8),
+                                           thread_name_prefix="vector-index-shard")
+
+    def query(self, query_embeddings: Any, n_results: int = 10, include: list[str] | None = None,
+              where: dict[str, Any] | None = None) -> dict[str, Any]:
+
+        include = list(include or _DEFAULT_INCLUDE)
+        # Distances are needed to merge, even when the caller did not ask for them
+        shard_include = include if "distances" in include else include + ["distances"]
+        futures = [self.executor.submit(shard.query, query_embeddings=query_embeddings, n_results=n_results,
+                                        include=shard_include, where=where)
+                   for shard in self.shards]
+        shard_results = [future.result() for future in futures]
+
+        merged: dict[str, Any] = {"ids": [], "documents": [], "metadatas": [], "distances": [], "embeddings": []}
+        for query_position in range(len(shard_results[0]["ids"])):
+            hits = []
+            for shard_position, result in enumerate(shard_results):
+                for row, distance in enumerate(result["distances"][query_position]):
+                    # Ties are broken by shard, then by rank within the shard
+                    hits.append((distance, shard_position, row))
+            hits.sort()
+            hits = hits[:n_results]
+
+            for key in merged:
+                if key == "ids" or key in include:
+                    merged[key].append([shard_results[shard_position][key][query_position][row]
+                                        for _, shard_position, row in hits])
+
+        for key in ("documents", "metadatas", "distances", "embeddings"):
+            if key not in include:
+                merged[key] = None
+        return merged
+
+    def get(self, ids: list[str], include: list[str] | None = None) -> dict[str, Any]:
+
+        include = include or ["documents", "metadatas"]
+        futures = [self.executor.submit(shard.get, ids=ids, include=include) for shard in self.shards]
+        records: dict[str, dict[str, Any]] = {}
+        for future in futures:
+            result = future.result()
+            for row, chunk_id in enumerate(result["ids"]):
+                records[chunk_id] = {key: result[key][row] for key in ("documents", "metadatas", "embeddings")
+                                     if result.get(key) is not None}
+
+        # Same order as the requested ids, like a single collection
+        found_ids = [chunk_id for chunk_id in ids if chunk_id in records]
+        merged: dict[str, Any] = {"ids": found_ids}
+        for key in ("documents", "metadatas", "embeddings"):
+            merged[key] = [records[chunk_id][key] for chunk_id in found_ids] if key in include else None
+        return merged
+
+    def count(self) -> int:
+        return sum(shard.count() for shard in self.shards)
+
+def _read_index_manifest(index_directory: str) -> dict[str, Any]:
+    try:
+        with open(os.path.join(index_directory, "index.json"), "r", encoding="utf-8") as index_file:
+            return json.load(index_file)
+    except FileNotFoundError:
+        return {}
+
+def _write_index_manifest(index_directory: str, manifest: dict[str, Any]) -> None:
+    # Switched last: readers only pick up a generation once all of its files are written
+    temp_path = os.path.join(index_directory, "index.json.tmp")
+    with open(temp_path, "w", encoding="utf-8") as index_file:
+        json.dump(manifest, index_file)
+    os.replace(temp_path, os.path.join(index_directory, "index.json"))
+
+def _open_records(records_path: str) -> sqlite3.Connection:
+    # Chunk ids, texts and metadata of the indexed rows; rows are looked up by number or id, never loaded whole
+    connection = sqlite3.connect(records_path, check_same_thread=False)
+    connection.execute("PRAGMA journal_mode=WAL")
+    connection.execute("PRAGMA synchronous=NORMAL")
+    connection.execute("CREATE TABLE IF NOT EXISTS records (row INTEGER PRIMARY KEY, chunk_id TEXT NOT NULL, "
+                       "document TEXT, metadata TEXT, deleted INTEGER NOT NULL DEFAULT 0)")
+    connection.execute("CREATE INDEX IF NOT EXISTS records_chunk_id ON records (chunk_id)")
+    connection.commit()
+    return connection
+
+def _insert_records(connection: sqlite3.Connection, first_row: int, page: dict[str, Any]) -> None:
+    connection.executemany("INSERT INTO records (row, chunk_id, document, metadata) VALUES (?, ?, ?, ?)",
+                           [(first_row + i, chunk_id, document, json.dumps(metadata))
+                            for i, (chunk_id, document, metadata) in enumerate(zip(page["ids"], page["documents"], page["metadatas"]))])
+
+def _write_compact(vectors: np.ndarray, directory: str, search_dtype: str, block_size: int = 65536) -> None:
+
+    # Written under a temporary name and renamed, so a reader never maps a half-written copy
+    if search_dtype == "float16":
+        temp_path = os.path.join(directory, "vectors_float16.npy.tmp")
+        with open(temp_path, "wb") as compact_file:
+            np.save(compact_file, np.asarray(vectors).astype(np.float16))
+        os.replace(temp_path, os.path.join(directory, "vectors_float16.npy"))
+    elif search_dtype == "int8":
+        # Symmetric scalar quantization with one scale per vector: x ~= scale * q, q in [-127, 127]
+        temp_path = os.path.join(directory, "vectors_int8.npy.tmp")
+        quantized = np.lib.format.open_memmap(temp_path, mode="w+", dtype=np.int8, shape=vectors.shape)
+        scales = np.empty(len(vectors), dtype=np.float32)
+        for start in range(0, len(vectors), block_size):
+            block = np.asarray(vectors[start:start + block_size], dtype=np.float32)
+            block_scales = np.maximum(np.abs(block).max(axis=1), np.finfo(np.float32).tiny) / 127.0
+            quantized[start:start + len(block)] = np.clip(np.rint(block / block_scales[:, None]), -127, 127)
+            scales[start:start + len(block)] = block_scales
+        quantized.flush()
+        del quantized
+        with open(os.path.join(directory, "int8_scales.npy.tmp"), "wb") as scales_file:
+            np.save(scales_file, scales)
+        os.replace(os.path.join(directory, "int8_scales.npy.tmp"), os.path.join(directory, "int8_scales.npy"))
+        os.replace(temp_path, os.path.join(directory, "vectors_int8.npy"))
+
+class _Segment:
+
+    # Rows [start, end) of a build: memory-mapped vectors, their squared norms and the segment's
+    # inverted lists over the build's IVF centroids, plus the compact copy for the search dtype
+    def __init__(self, directory: str, start: int, search_dtype: str = "float32") -> None:
+        self.directory = directory
+        self.start = start
+        self.vectors = np.load(os.path.join(directory, "vectors_float32.npy"), mmap_mode="r")
+        self.end = start + len(self.vectors)
+        self.squared_norms = np.load(os.path.join(directory, "squared_norms.npy"))
+        self.ivf_order = np.load(os.path.join(directory, "ivf_order.npy"), mmap_mode="r")
+        self.ivf_offsets = np.load(os.path.join(directory, "ivf_offsets.npy"))
+        self.vectors_float16 = None
+        self.vectors_int8 = None
+        self.int8_scales = None
+        self.load_compact(search_dtype)
+
+    def load_compact(self, search_dtype: str, directory: str | None = None) -> None:
+        # Only the configured copy is written at ingest; switching VECTOR_INDEX_DTYPE writes the new one on first load
+        directory = directory or self.directory
+        if search_dtype == "float16":
+            path = os.path.join(directory, "vectors_float16.npy")
+            if not os.path.exists(path):
+                _write_compact(self.vectors, directory, search_dtype)
+            self.vectors_float16 = np.load(path, mmap_mode="r")
+        elif search_dtype == "int8":
+            path = os.path.join(directory, "vectors_int8.npy")
+            if not os.path.exists(path):
+                _write_compact(self.vectors, directory, search_dtype)
+            self.vectors_int8 = np.load(path, mmap_mode="r")
+            self.int8_scales = np.load(os.path.join(directory, "int8_scales.npy"))
+
+class LocalVectorIndex(VectorIndex):
+
+    # In-process index over a copy of a Chroma collection, stored as memory-mapped matrices.
+    # "exact" scans every vector (identical ranking to an exhaustive L2 search), "ivf" only scans
+    # the nprobe inverted lists closest to the query.
+    # search_dtype "float16" / "int8" scans the compact copy instead and re-scores the best
+    # k * rescore_factor candidates against the float32 vectors.
+    # A build is a list of segments plus a SQLite table of the rows' ids, texts and metadata. Every
+    # ingest appends one segment and marks replaced or removed rows deleted (update_from_collection);
+    # small segments are merged, and the collection is only exported again (with a new k-means) when
+    # many rows are deleted or the corpus has outgrown the centroids. index.json names the current
+    # build, its segments and a generation number that readers compare on every query.
+    def __init__(self,
+                 index_directory: str,
+                 search_mode: str = "exact",
+                 search_dtype: str = "float32",
+                 nprobe: int = 8,
+                 block_size: int = 65536,
+                 rescore_factor: int = 4) -> None:
+        if search_dtype not in SEARCH_DTYPES:
+            raise ValueError(f"search_dtype must be one of {SEARCH_DTYPES}, got '{search_dtype}'")
+        self.index_directory = index_directory
+        self.search_mode = search_mode
+        self.search_dtype = search_dtype
+        self.nprobe = nprobe
+        self.block_size = block_size
+        self.rescore_factor = rescore_factor
+        self._records_lock = threading.Lock()
+        self._records = None
+        self._build = None
+        self._loaded_version = None
+        self._load()
+
+    @staticmethod
+    def has_index(index_directory: str) -> bool:
+        # Snapshots written before builds were segmented have no "build" and are rebuilt once
+        return "build" in _read_index_manifest(index_directory)
+
+    @staticmethod
+    def build_from_collection(collection: Any,
+                              index_directory: str,
+                              nlist: int | None = None,
+                              page_size: int = 10000,
+                              ivf_iterations: int = 10,
+                              search_dtype: str = "float32") -> None:
+
+        try:
+            start_time = time.perf_counter()
+            # Each build goes to a new directory so running readers keep a consistent mapping
+            build_name = f"build_{int(time.time() * 1000)}"
+            build_directory = os.path.join(index_directory, build_name)
+            segment_name = "segment_000000"
+            segment_directory = os.path.join(build_directory, segment_name)
+            os.makedirs(segment_directory, exist_ok=True)
+            total_rows = collection.count()
+
+            records = _open_records(os.path.join(build_directory, "records.sqlite3"))
+            written_rows = 0
+            vectors = None
+            try:
+                # Page through the collection and stream the vectors straight into the memory-mapped file
+                for offset in range(0, total_rows, page_size):
+                    page = collection.get(include=["embeddings", "documents", "metadatas"], limit=page_size, offset=offset)
+                    page_vectors = np.asarray(page["embeddings"], dtype=np.float32)
+                    if len(page_vectors) == 0:
+                        break
+                    if vectors is None:
+                        vectors = np.lib.format.open_memmap(os.path.join(segment_directory, "vectors_float32.npy"), mode="w+",
+                                                            dtype=np.float32, shape=(total_rows, page_vectors.shape[1]))
+                    vectors[written_rows:written_rows + len(page_vectors)] = page_vectors
+                    _insert_records(records, written_rows, page)
+                    written_rows += len(page_vectors)
+                records.commit()
+            finally:
+                records.close()
+
+            if vectors is None or written_rows != total_rows:
+                shutil.rmtree(build_directory, ignore_errors=True)
+                if vectors is None:
+                    logger.info("The collection is empty, no local index written to %s", index_directory)
+                    return
+                raise RuntimeError(f"The collection changed while it was exported ({written_rows} of {total_rows} rows)")
+            vectors.flush()
+
+            centroids = LocalVectorIndex._train_ivf(vectors, nlist, ivf_iterations)
+            np.save(os.path.join(build_directory, "ivf_centroids.npy"), centroids)
+            LocalVectorIndex._finish_segment(vectors, segment_directory, centroids, search_dtype)
+
+            generation = _read_index_manifest(index_directory).get("generation", 0) + 1
+            _write_index_manifest(index_directory, {
+                "generation": generation, "build": build_name, "dimension": int(vectors.shape[1]),
+                "segments": [{"name": segment_name, "start": 0, "rows": written_rows}],
+                "rows": written_rows, "trained_rows": written_rows, "retired": [], "built_at": time.time()})
+            LocalVectorIndex._remove_old_builds(index_directory, keep=build_name)
+
+            build_seconds = time.perf_counter() - start_time
+            record_stage("local_index_build", build_seconds, items=written_rows)
+            logger.info("Local vector index with %d vectors written to %s in %.1fs", written_rows, index_directory, build_seconds)
+        except Exception as e:
+            logger.error("Error building the local vector index at '%s': %s", index_directory, e)
+            raise e
+
+    @staticmethod
+    def update_from_collection(collection: Any,
+                               index_directory: str,
+                               added_ids: list[str],
+                               deleted_ids: list[str],
+                               search_dtype: str = "float32",
+                               page_size: int = 5000,
+                               max_segments: int = 8,
+                               max_deleted_fraction: float = 0.2,
+                               retrain_growth: float = 4.0) -> None:
+
+        # Applies one ingest to the current build: only the added rows are read from Chroma
+        manifest = _read_index_manifest(index_directory)
+        if "build" not in manifest:
+            LocalVectorIndex.build_from_collection(collection, index_directory, search_dtype=search_dtype)
+            return
+        if len(added_ids) == 0 and len(deleted_ids) == 0:
+            return
+
+        try:
+            start_time = time.perf_counter()
+            build_directory = os.path.join(index_directory, manifest["build"])
+            generation = manifest["generation"] + 1
+            total_rows = manifest["rows"]
+            segments = list(manifest["segments"])
+            added_ids = list(dict.fromkeys(added_ids))
+
+            records = _open_records(os.path.join(build_directory, "records.sqlite3"))
+            try:
+                # An added id that is already indexed (e.g. a batch written again on resume) replaces its row
+                replaced_ids = sorted(set(added_ids) | set(deleted_ids))
+                for batch_start in range(0, len(replaced_ids), 500):
+                    batch = replaced_ids[batch_start:batch_start + 500]
+                    records.execute(f"UPDATE records SET deleted = 1 WHERE deleted = 0 AND chunk_id IN ({','.join('?' * len(batch))})",
+                                    batch)
+
+                vector_pages = []
+                added_rows = 0
+                for batch_start in range(0, len(added_ids), page_size):
+                    page = collection.get(ids=added_ids[batch_start:batch_start + page_size],
+                                          include=["embeddings", "documents", "metadatas"])
+                    if len(page["ids"]) == 0:
+                        continue
+                    vector_pages.append(np.asarray(page["embeddings"], dtype=np.float32))
+                    _insert_records(records, total_rows + added_rows, page)
+                    added_rows += len(page["ids"])
+
+                if added_rows > 0:
+                    segment_name = f"segment_{generation:06d}"
+                    segment_directory = os.path.join(build_directory, segment_name)
+                    os.makedirs(segment_directory, exist_ok=True)
+                    vectors = np.lib.format.open_memmap(os.path.join(segment_directory, "vectors_float32.npy"), mode="w+",
+                                                        dtype=np.float32, shape=(added_rows, manifest["dimension"]))
+                    vectors[:] = np.concatenate(vector_pages)
+                    vectors.flush()
+                    LocalVectorIndex._finish_segment(vectors, segment_directory,
+                                                     np.load(os.path.join(build_directory, "ivf_centroids.npy")), search_dtype)
+                    segments.append({"name": segment_name, "start": total_rows, "rows": added_rows})
+                    total_rows += added_rows
+                records.commit()
+                deleted_rows = records.execute("SELECT COUNT(*) FROM records WHERE deleted = 1 AND row < ?",
+                                               (total_rows,)).fetchone()[0]
+            finally:
+                records.close()
+
+            # A failed ingest can leave Chroma ahead of the index; the counts catch that, and too
+            # many deleted rows or a corpus that outgrew its centroids call for a fresh build
+            indexed_rows = total_rows - deleted_rows
+            if (deleted_rows > max_deleted_fraction * total_rows
+                    or indexed_rows > retrain_growth * manifest["trained_rows"]
+                    or indexed_rows != collection.count()):
+                LocalVectorIndex.build_from_collection(collection, index_directory, search_dtype=search_dtype)
+                return
+
+            retired = []
+            if len(segments) > max_segments:
+                segments, retired = LocalVectorIndex._merge_segments(build_directory, segments, f"segment_{generation:06d}_merged",
+                                                                     search_dtype)
+
+            # Segments retired one generation ago are no longer mapped by a reader that has refreshed
+            for name in manifest.get("retired", []):
+                shutil.rmtree(os.path.join(build_directory, name), ignore_errors=True)
+            _write_index_manifest(index_directory, {**manifest, "generation": generation, "segments": segments,
+                                                    "rows": total_rows, "retired": retired, "built_at": time.time()})
+
+            update_seconds = time.perf_counter() - start_time
+            record_stage("local_index_build", update_seconds, items=added_rows)
+            logger.info("Local vector index at %s updated: %d rows added, %d deleted, %d segments, in %.1fs",
+                        index_directory, added_rows, len(deleted_ids), len(segments), update_seconds)
+        except Exception as e:
+            logger.error("Error updating the local vector index at '%s': %s", index_directory, e)
+            raise e
+
+    @staticmethod
+    def _merge_segments(build_directory: str, segments: list[dict[str, Any]],
+                        segment_name: str, search_dtype: str) -> tuple[list[dict[str, Any]], list[str]]:
+
+        # Everything after the first (largest) segment becomes one segment; the rows keep their numbers
+        base, tail = segments[0], segments[1:]
+        parts = [np.load(os.path.join(build_directory, segment["name"], "vectors_float32.npy"), mmap_mode="r") for segment in tail]
+        segment_directory = os.path.join(build_directory, segment_name)
+        os.makedirs(segment_directory, exist_ok=True)
+        vectors = np.lib.format.open_memmap(os.path.join(segment_directory, "vectors_float32.npy"), mode="w+",
+                                            dtype=np.float32, shape=(sum(len(part) for part in parts), parts[0].shape[1]))
+        row = 0
+        for part in parts:
+            vectors[row:row + len(part)] = part
+            row += len(part)
+        vectors.flush()
+        LocalVectorIndex._finish_segment(vectors, segment_directory, np.load(os.path.join(build_directory, "ivf_centroids.npy")),
+                                         search_dtype)
+        merged = {"name": segment_name, "start": tail[0]["start"], "rows": len(vectors)}
+        return [base, merged], [segment["name"] for segment in tail]
+
+    @staticmethod
+    def _finish_segment(vectors: np.ndarray, segment_directory: str, centroids: np.ndarray, search_dtype: str) -> None:
+        _write_compact(vectors, segment_directory, search_dtype)
+        np.save(os.path.join(segment_directory, "squared_norms.npy"), np.einsum("ij,ij->i", vectors, vectors))
+
+        # Every row goes to the inverted list of its closest centroid
+        assignments = np.concatenate([LocalVectorIndex._closest_centroids(np.asarray(vectors[start:start + 65536]), centroids)
+                                      for start in range(0, len(vectors), 65536)])
+        order = np.argsort(assignments, kind="stable")
+        offsets = np.searchsorted(assignments[order], np.arange(len(centroids) + 1))
+        np.save(os.path.join(segment_directory, "ivf_order.npy"), order.astype(np.int64))
+        np.save(os.path.join(segment_directory, "ivf_offsets.npy"), offsets.astype(np.int64))
+
+    @staticmethod
+    def _remove_old_builds(index_directory: str, keep: str) -> None:
+        # Snapshots of the earlier single-file layout go at once
+        for name in os.listdir(index_directory):
+            if name.startswith("snapshot_"):
+                shutil.rmtree(os.path.join(index_directory, name), ignore_errors=True)
+        builds = sorted(name for name in os.listdir(index_directory) if name.startswith("build_") and name != keep)
+        # The newest previous build may still be mapped by a reader that has not refreshed yet
+        for name in builds[:-1]:
+            shutil.rmtree(os.path.join(index_directory, name), ignore_errors=True)
+
+    @staticmethod
+    def _train_ivf(vectors: np.ndarray, nlist: int | None, iterations: int) -> np.ndarray:
+
+        total_rows = len(vectors)
+        nlist = max(1, min(nlist or int(np.sqrt(total_rows)), total_rows))
+        rng = np.random.default_rng(0)
+
+        # Coarse quantizer: k-means on a sample; later segments are assigned to the same centroids
+        sample_rows = np.sort(rng.choice(total_rows, size=min(total_rows, nlist * 256), replace=False))
+        training = np.asarray(vectors[sample_rows], dtype=np.float32)
+        centroids = training[rng.choice(len(training), size=nlist, replace=False)].copy()
+        for _ in range(iterations):
+            assignments = LocalVectorIndex._closest_centroids(training, centroids)
+            for list_id in range(nlist):
+                members = training[assignments == list_id]
+                if len(members) > 0:
+                    centroids[list_id] = members.mean(axis=0)
+        return centroids
+
+    @staticmethod
+    def _closest_centroids(rows: np.ndarray, centroids: np.ndarray) -> np.ndarray:
+        distances = (np.einsum("ij,ij->i", centroids, centroids)[None, :] - 2.0 * rows @ centroids.T)
+        return np.argmin(distances, axis=1)
+
+    def _load(self, manifest: dict[str, Any] | None = None) -> None:
+
+        manifest = manifest or _read_index_manifest(self.index_directory)
+        if "build" not in manifest:
+            raise FileNotFoundError(f"No local vector index found at '{self.index_directory}'")
+
+        build_directory = os.path.join(self.index_directory, manifest["build"])
+        segments = [_Segment(os.path.join(build_directory, segment["name"]), segment["start"], self.search_dtype)
+                    for segment in manifest["segments"]]
+        ivf_centroids = np.load(os.path.join(build_directory, "ivf_centroids.npy"))
+        records = self._records if manifest["build"] == self._build else _open_records(os.path.join(build_directory, "records.sqlite3"))
+        with self._records_lock:
+            deleted_rows = np.fromiter((row for (row,) in records.execute(
+                "SELECT row FROM records WHERE deleted = 1 AND row < ?", (manifest["rows"],))), dtype=np.int64)
+
+        alive = None
+        if len(deleted_rows) > 0:
+            alive = np.ones(manifest["rows"], dtype=bool)
+            alive[deleted_rows] = False
+
+        # Queries on other threads keep the objects they started with; the old connection is left to be collected
+        self.segments = segments
+        self.segment_starts = [segment.start for segment in segments]
+        self.ivf_centroids = ivf_centroids
+        self.dimension = manifest["dimension"]
+        self.total_rows = manifest["rows"]
+        self.alive = alive
+        self.deleted_count = len(deleted_rows)
+        self._records = records
+        self._build = manifest["build"]
+        # Metadata fields used by filters, read on first use per generation
+        self._columns: dict[str, np.ndarray] = {}
+        self._loaded_version = (manifest["build"], manifest["generation"])
+
+    def refresh_if_changed(self) -> None:
+        # index.json is a few hundred bytes; reading its generation per query picks up every ingest
+        manifest = _read_index_manifest(self.index_directory)
+        if "build" in manifest and (manifest["build"], manifest["generation"]) != self._loaded_version:
+            self._load(manifest)
+
+    def _squared_l2(self, segment: _Segment, query: np.ndarray, rows: np.ndarray | None, start: int = 0, end: int = 0,
+                    search_dtype: str = "float32") -> np.ndarray:
+        # ||x||^2 - 2 x.q + ||q||^2, the same squared L2 distance Chroma reports for the default space.
+        # The norms are always exact; only the dot product comes from the compact copy.
+        selection = slice(start, end) if rows is None else rows
+        if search_dtype == "int8":
+            dot_products = (np.asarray(segment.vectors_int8[selection], dtype=np.float32) @ query) * segment.int8_scales[selection]
+        elif search_dtype == "float16":
+            dot_products = np.asarray(segment.vectors_float16[selection], dtype=np.float32) @ query
+        else:
+            dot_products = np.asarray(segment.vectors[selection], dtype=np.float32) @ query
+        return np.maximum(segment.squared_norms[selection] - 2.0 * dot_products + float(query @ query), 0.0)
+
+    @staticmethod
+    def _top_k(distances: np.ndarray, rows: np.ndarray, k: int) -> tuple[np.ndarray, np.ndarray]:
+        if len(distances) > k:
+            keep = np.argpartition(distances, k - 1)[:k]
+            distances, rows = distances[keep], rows[keep]
+        # Ties are broken by row so repeated searches are deterministic
+        order = np.lexsort((rows, distances))
+        return distances[order], rows[order]
+
+    def _scan(self, segment: _Segment, query: np.ndarray, allowed_rows: np.ndarray | None,
+              size: int) -> tuple[np.ndarray, np.ndarray]:
+
+        # Block-wise exhaustive scan over every row of the segment, or over the rows a filter allows
+        total_rows = len(segment.vectors) if allowed_rows is None else len(allowed_rows)
+        best_distances = np.empty(0, dtype=np.float32)
+        best_rows = np.empty(0, dtype=np.int64)
+        for start in range(0, total_rows, self.block_size):
+            end = min(start + self.block_size, total_rows)
+            if allowed_rows is None:
+                block_rows = np.arange(start, end, dtype=np.int64)
+                block_distances = self._squared_l2(segment, query, None, start, end, self.search_dtype)
+            else:
+                block_rows = allowed_rows[start:end]
+                block_distances = self._squared_l2(segment, query, block_rows, search_dtype=self.search_dtype)
+            block_distances, block_rows = self._top_k(block_distances, block_rows, size)
+            best_distances, best_rows = self._top_k(np.concatenate([best_distances, block_distances]),
+                                                    np.concatenate([best_rows, block_rows]), size)
+        return best_distances, best_rows
+
+    def _search_segment(self, segment: _Segment, query: np.ndarray, k: int, allowed_mask: np.ndarray | None,
+                        probe_lists: np.ndarray | None) -> tuple[np.ndarray, np.ndarray]:
+
+        # Rows are local to the segment here
+        rescore = self.search_dtype != "float32" and self.rescore_factor > 0
+        shortlist_size = k * self.rescore_factor if rescore else k
+        allowed_rows = np.flatnonzero(allowed_mask) if allowed_mask is not None else None
+
+        candidate_rows = None
+        if probe_lists is not None:
+            candidate_rows = np.concatenate([np.asarray(segment.ivf_order[segment.ivf_offsets[list_id]:segment.ivf_offsets[list_id + 1]])
+                                             for list_id in probe_lists])
+            candidate_rows.sort()
+            if allowed_mask is not None:
+                candidate_rows = candidate_rows[allowed_mask[candidate_rows]]
+                # A selective filter can leave the probed lists almost empty; its rows are few, so scan them all
+                if len(candidate_rows) < shortlist_size:
+                    candidate_rows = None
+
+        if candidate_rows is not None:
+            best_distances, best_rows = self._top_k(self._squared_l2(segment, query, candidate_rows, search_dtype=self.search_dtype),
+                                                    candidate_rows, shortlist_size)
+        else:
+            best_distances, best_rows = self._scan(segment, query, allowed_rows, shortlist_size)
+
+        if rescore:
+            # Exact distances for the shortlist only, so the reported distances match float32
+            rows = np.sort(best_rows)
+            return self._top_k(self._squared_l2(segment, query, rows), rows, k)
+        return best_distances, best_rows
+
+    def _search_one(self, query: np.ndarray, k: int,
+                    allowed_mask: np.ndarray | None = None) -> tuple[np.ndarray, np.ndarray]:
+
+        # Each segment returns its own top k; the merged top k uses rows numbered across the build
+        probe_lists = self._closest_lists(query) if self.search_mode == "ivf" else None
+        best_distances = np.empty(0, dtype=np.float32)
+        best_rows = np.empty(0, dtype=np.int64)
+        for segment in self.segments:
+            segment_mask = allowed_mask[segment.start:segment.end] if allowed_mask is not None else None
+            if segment_mask is not None and not segment_mask.any():
+                continue
+            distances, rows = self._search_segment(segment, query, k, segment_mask, probe_lists)
+            best_distances, best_rows = self._top_k(np.concatenate([best_distances, distances]),
+                                                    np.concatenate([best_rows, rows + segment.start]), k)
+        return best_distances, best_rows
+
+    def _column(self, name: str) -> np.ndarray:
+        column = self._columns.get(name)
+        if column is None:
+            with self._records_lock:
+                rows = self._records.execute("SELECT row, json_extract(metadata, ?) FROM records WHERE row < ?",
+                                             (f'$."{name}"', self.total_rows)).fetchall()
+            column = np.full(self.total_rows, None, dtype=object)
+            values = np.empty(len(rows), dtype=object)
+            values[:] = [value for _, value in rows]
+            column[np.fromiter((row for row, _ in rows), dtype=np.int64, count=len(rows))] = values
+            self._columns[name] = column
+        return column
+
+    def _closest_lists(self, query: np.ndarray) -> np.ndarray:
+        nprobe = max(1, min(self.nprobe, len(self.ivf_centroids)))
+        distances = np.einsum("ij,ij->i", self.ivf_centroids, self.ivf_centroids) - 2.0 * (self.ivf_centroids @ query)
+        return np.argsort(distances)[:nprobe]
+
+    def _vectors(self, rows: list[int]) -> np.ndarray:
+        vectors = np.empty((len(rows), self.dimension), dtype=np.float32)
+        for position, row in enumerate(rows):
+            segment = self.segments[bisect.bisect_right(self.segment_starts, row) - 1]
+            vectors[position] = segment.vectors[row - segment.start]
+        return vectors
+
+    def _records_by_row(self, rows: list[int]) -> dict[int, tuple[str, str, str]]:
+        found: dict[int, tuple[str, str, str]] = {}
+        with self._records_lock:
+            for batch_start in range(0, len(rows), 500):
+                batch = rows[batch_start:batch_start + 500]
+                for row, chunk_id, document, metadata in self._records.execute(
+                        f"SELECT row, chunk_id, document, metadata FROM records WHERE row IN ({','.join('?' * len(batch))})", batch):
+                    found[row] = (chunk_id, document, metadata)
+        return found
+
+    def _records_for(self, rows: list[int], include: list[str]) -> dict[str, Any]:
+        found = self._records_by_row(rows)
+        records: dict[str, Any] = {"ids": [found[row][0] for row in rows]}
+        records["documents"] = [found[row][1] for row in rows] if "documents" in include else None
+        records["metadatas"] = [json.loads(found[row][2]) for row in rows] if "metadatas" in include else None
+        records["embeddings"] = self._vectors(rows) if "embeddings" in include else None
+        return records
+
+    def query(self, query_embeddings: Any, n_results: int = 10, include: list[str] | None = None,
+              where: dict[str, Any] | None = None) -> dict[str, Any]:
+
+        self.refresh_if_changed()
+        include = include or _DEFAULT_INCLUDE
+        queries = np.asarray(query_embeddings, dtype=np.float32).reshape(-1, self.dimension)
+
+        # The filter is applied before scoring, only allowed rows are scanned; deleted rows never are
+        allowed_mask = where_mask(where, self._column, self.total_rows) if where else None
+        if self.alive is not None:
+            allowed_mask = self.alive if allowed_mask is None else allowed_mask & self.alive
+        allowed_count = self.total_rows if allowed_mask is None else int(allowed_mask.sum())
+        k = min(n_results, allowed_count)
+
+        results: dict[str, Any] = {"ids": [], "documents": [], "metadatas": [], "distances": [], "embeddings": []}
+        for query in queries:
+            if k > 0:
+                distances, rows = self._search_one(query, k, allowed_mask)
+            else:
+                distances, rows = np.empty(0, dtype=np.float32), np.empty(0, dtype=np.int64)
+            records = self._records_for(rows.tolist(), include)
+            for key in ("ids", "documents", "metadatas", "embeddings"):
+                results[key].append(records[key])
+            results["distances"].append(distances.tolist())
+
+        for key in ("documents", "metadatas", "distances", "embeddings"):
+            if key not in include:
+                results[key] = None
+        return results
+
+    def get(self, ids: list[str], include: list[str] | None = None) -> dict[str, Any]:
+        self.refresh_if_changed()
+        row_by_id: dict[str, int] = {}
+        with self._records_lock:
+            for batch_start in range(0, len(ids), 500):
+                batch = ids[batch_start:batch_start + 500]
+                row_by_id.update(self._records.execute(
+                    f"SELECT chunk_id, row FROM records WHERE deleted = 0 AND row < ? AND chunk_id IN ({','.join('?' * len(batch))})",
+                    [self.total_rows, *batch]).fetchall())
+        return self._records_for([row_by_id[doc_id] for doc_id in ids if doc_id in row_by_id], include or ["documents", "metadatas"])
+
+    def count(self) -> int:
+        self.refresh_if_changed()
+        return self.total_rows - self.deleted_count
+
+    def memory_footprint(self) -> dict[str, int]:
+        # Bytes that have to be scanned (and kept hot in the page cache) per search_dtype, whether or not the copy exists
+        values = self.total_rows * self.dimension
+        return {"float32": 4 * values, "float16": 2 * values, "int8": values + 4 * self.total_rows}
+
+def quantization_report(index_directory: str,
+                        query_embeddings: Any = None,
+                        sample_queries: int = 200,
+                        k: int = 10,
+                        rescore_factors: tuple[int, ...] = (0, 2, 4)) -> list[dict[str, Any]]:
+
+    # Recall@k of every compact storage mode against the exact float32 search on the same build.
+    # Without real questions, stored vectors (minus the vector itself) stand in for queries.
+    index = LocalVectorIndex(index_directory)
+    exclude_self = query_embeddings is None
+    if exclude_self:
+        rng = np.random.default_rng(0)
+        candidates = np.flatnonzero(index.alive) if index.alive is not None else np.arange(index.total_rows)
+        rows = np.sort(rng.choice(candidates, size=min(sample_queries, len(candidates)), replace=False))
+        queries = index._vectors(rows.tolist())
+    else:
+        queries = np.asarray(query_embeddings, dtype=np.float32).reshape(-1, index.dimension)
+    search_k = min(k + 1 if exclude_self else k, index.count())
+
+    def top_rows(query_row: int) -> set[int]:
+        _, found = index._search_one(queries[query_row], search_k, index.alive)
+        found = found.tolist()
+        if exclude_self:
+            found = [row for row in found if row != rows[query_row]]
+        return set(found[:k])
+
+    index.search_dtype = "float32"
+    ground_truth = [top_rows(i) for i in range(len(queries))]
+    footprint = index.memory_footprint()
+
+    report = []
+    with tempfile.TemporaryDirectory() as temp_directory:
+        for search_dtype in SEARCH_DTYPES[1:]:
+            # An index only stores the copy for its own VECTOR_INDEX_DTYPE; the others are written to a
+            # temporary directory for the comparison and dropped afterwards
+            stored = all(os.path.exists(os.path.join(segment.directory, f"vectors_{search_dtype}.npy")) for segment in index.segments)
+            for number, segment in enumerate(index.segments):
+                compact_directory = segment.directory if stored else os.path.join(temp_directory, f"{search_dtype}_{number}")
+                os.makedirs(compact_directory, exist_ok=True)
+                segment.load_compact(search_dtype, compact_directory)
+
+            for rescore_factor in rescore_factors:
+                index.search_dtype = search_dtype
+                index.rescore_factor = rescore_factor
+                start_time = time.perf_counter()
+                found = [top_rows(i) for i in range(len(queries))]
+                elapsed = time.perf_counter() - start_time
+                report.append({
+                    "search_dtype": search_dtype,
+                    "rescore_factor": rescore_factor,
+                    f"recall@{k}": float(np.mean([len(f & t) / max(len(t), 1) for f, t in zip(found, ground_truth)])),
+                    "scanned_bytes": footprint[search_dtype],
+                    "scanned_bytes_vs_float32": footprint[search_dtype] / footprint["float32"],
+                    "stored_with_index": stored,
+                    "ms_per_query": 1000.0 * elapsed / max(len(queries), 1)
+                })
+    return report
+
+if __name__ == "__main__":
+    # python -m Services.VectorIndex [collection_name] prints the recall-versus-memory report
+    import sys
+    from Infrastructure.resource_registry import local_index_directory
+
+    collection_name = sys.argv[1] if len(sys.argv) > 1 else "pdf_documents"
+    for row in quantization_report(local_index_directory(collection_name)):
+        print(json.dumps(row))
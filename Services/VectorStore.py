@@ -1,9 +1,17 @@
 import os
 import chromadb
 import uuid
+import time
+import logging
 from typing import Any
 import numpy as np
 
+from Infrastructure.resource_registry import get_registry
+from Services.NamespaceLayout import NamespaceLayout
+from Infrastructure.telemetry import record_stage
+
+logger = logging.getLogger(__name__)
+
 # Below lines are used only for testing purpose of VectorStore class
 # import summarizer as summarizer_object
 # from EmbeddingManager import EmbeddingManager
@@ -14,32 +22,21 @@ class VectorStore:
                  collection_name: str = "pdf_documents",
                  persist_directory: str = "data/vector_store",
                  documents: list[Any] = [],
-                 embeddings: np.ndarray = np.array([])) -> None:
+                 embeddings: np.ndarray = np.array([]),
+                 batch_size: int = 1024,
+                 collection_metadata: dict[str, Any] | None = None) -> None:
         
         self.documents = documents
         self.embeddings = embeddings
         self.collection_name = collection_name
         self.persist_directory = persist_directory
+        self.batch_size = batch_size
         self.chroma_client = None
         self.collection = None
-        self.dict_of_metadata = {}
-        self._prepare_metadata(documents=documents)
+        # Per-chunk metadata lives on the records; the collection only carries a small fixed descriptor
+        self.collection_metadata = collection_metadata
         self._initialize_vector_store()
 
-    def _prepare_metadata(self, documents: list[Any]) -> dict[str, Any]:
-        
-        try:
-            if len(documents) == 0:
-                raise ValueError("The documents should not be empty")
-            
-            for i, doc in enumerate(documents):
-                self.dict_of_metadata[f"{i}"] = f"{doc['metadata']}" #dict(documents[i]['metadata'])  #{f"chunk_{i}", doc[0]['metadata']['source']} #doc['metadata']
-
-            return self.dict_of_metadata
-        except Exception as e:
-            print(f"Error adding documents to the vector store collection '{self.collection_name}': {e}")
-            raise e
-
     # @classmethod
     # def get_vector_collection(cls, collection_name: str, persist_directory: str):
     #     try:
@@ -62,67 +59,145 @@ class VectorStore:
     def _initialize_vector_store(self):
         try:
 
-            os.makedirs(self.persist_directory, exist_ok=True) # check if the directory exists, if not create it
-
-            # Initialize Chroma client
-            self.chroma_client = chromadb.PersistentClient(path=self.persist_directory)
+            # Shared Chroma client, one per persist directory for the whole process
+            self.chroma_client = get_registry().get_chroma_client(self.persist_directory)
             
             # Create or get collection
             self.collection = self.chroma_client.get_or_create_collection(
                     name=self.collection_name,
-                    metadata= self.dict_of_metadata #{"description": "Collection of PDF documents embeddings"}
+                    metadata= self.collection_metadata #{"description": "Collection of PDF documents embeddings"}
                 )
-
-            print(f"Vector store initialized at {self.persist_directory} with collection '{self.collection_name}'")
-            print(f"Existing collections count: {self.collection.count()}")
+            # get_or_create_collection ignores the metadata of an existing collection; ones created before
+            # namespaces carry an entry per document, which modify() replaces with the fixed descriptor
+            if self.collection_metadata is not None and self.collection.metadata != self.collection_metadata:
+                self.collection.modify(metadata=self.collection_metadata)
+                logger.info("Collection '%s' metadata replaced with %s", self.collection_name, self.collection_metadata)
+
+            # count() is a query of its own, only pay for it when it is logged
+            if logger.isEnabledFor(logging.DEBUG):
+                logger.debug("Vector store initialized at %s with collection '%s' (%d records)",
+                             self.persist_directory, self.collection_name, self.collection.count())
         except Exception as e:
-            print(f"Error initializing Chroma collection '{self.collection_name}': {e}")
+            logger.error("Error initializing Chroma collection '%s': %s", self.collection_name, e)
             raise e
 
-    # def add_documents(self, documents: list[Any], embeddings: np.ndarray):
-    def add_documents(self):
+    def _resolve_batch_size(self) -> int:
+        # Never send more rows per call than the Chroma client accepts
+        max_batch_size = None
+        if self.chroma_client is not None:
+            if hasattr(self.chroma_client, "get_max_batch_size"):
+                max_batch_size = self.chroma_client.get_max_batch_size()
+            else:
+                max_batch_size = getattr(self.chroma_client, "max_batch_size", None)
+
+        if max_batch_size:
+            return max(1, min(self.batch_size, int(max_batch_size)))
+        return max(1, self.batch_size)
+
+    def add_documents(self, documents: list[Any] | None = None, embeddings: np.ndarray | None = None) -> dict[str, float]:
+
+        if documents is not None:
+            self.documents = documents
+        if embeddings is not None:
+            self.embeddings = embeddings
 
-        ids = []
-        document_text = []
-        embedding_list = []
-        metadata_collection = []
-        
         try:
+            if len(self.documents) == 0:
+                raise ValueError("The documents should not be empty")
+
             if len(self.documents) != len(self.embeddings):
                 raise ValueError("The number of documents must match the number of embeddings.")
 
-            for i, (doc, embeddings) in enumerate(zip(self.documents, self.embeddings)):
+            if self.collection is None:
+                raise ValueError(f"The collection '{self.collection_name}' is not initialized.")
 
-                # Generate a unique ID for each document                
-                doc_id = f"docu_{uuid.uuid4().hex[:8]}_{i}"
-                ids.append(doc_id)
+            start_time = time.perf_counter()
 
-                # document content addition
-                document_text.append(doc['text'])
+            # One contiguous float32 matrix, sliced per batch instead of converted row by row
+            embedding_matrix = np.ascontiguousarray(self.embeddings, dtype=np.float32)
 
+            # Deterministic chunk ids make re-ingesting the same content an overwrite, not a duplicate
+            ids = [doc.get('id') or f"docu_{uuid.uuid4().hex[:8]}_{i}" for i, doc in enumerate(self.documents)]
+            document_text = [doc['text'] for doc in self.documents]
+            metadata_collection = []
+            for i, doc in enumerate(self.documents):
                 metadata_object = dict(doc['metadata'])  # ensure it's a dict
-                metadata_object['doc_index'] = i
+                # Position of the chunk in its file, the same in every write batch; i only for callers without one
+                metadata_object['doc_index'] = metadata_object.get('chunk_index', i)
                 metadata_collection.append(metadata_object)
 
-                # embedding addition
-                embedding_list.append(embeddings.tolist())
-                
-                if self.collection is not None:
-                    self.collection.add(
-                        ids=ids,
-                        documents=document_text,
-                        embeddings=embedding_list,
-                        metadatas = metadata_collection
-                    )
-                    
-
-            print(f"The Collection is of type {type(self.collection)}")
-            print(f"Added {len(self.documents)} documents to the vector store collection '{self.collection_name}'.")
-            print(self.collection)
+            batch_size = self._resolve_batch_size()
+            total_rows = len(ids)
+            for batch_start in range(0, total_rows, batch_size):
+                batch_end = min(batch_start + batch_size, total_rows)
+                self.collection.upsert(
+                    ids=ids[batch_start:batch_end],
+                    documents=document_text[batch_start:batch_end],
+                    embeddings=embedding_matrix[batch_start:batch_end],
+                    metadatas = metadata_collection[batch_start:batch_end]
+                )
+
+            elapsed_seconds = time.perf_counter() - start_time
+            rows_per_second = total_rows / elapsed_seconds if elapsed_seconds > 0 else float(total_rows)
+
+            record_stage("index_write", elapsed_seconds, items=total_rows)
+            logger.debug("Added %d documents to the vector store collection '%s' in batches of %d (%.1f rows/s).",
+                         total_rows, self.collection_name, batch_size, rows_per_second)
+            return {"rows": total_rows, "seconds": elapsed_seconds, "rows_per_second": rows_per_second}
         except Exception as e:
-            print(f"Error adding documents to the vector store collection '{self.collection_name}': {e}")
+            logger.error("Error adding documents to the vector store collection '%s': %s", self.collection_name, e)
             raise e
 
+    def delete_documents(self, ids: list[str]) -> None:
+
+        try:
+            if len(ids) == 0 or self.collection is None:
+                return
+
+            batch_size = self._resolve_batch_size()
+            for batch_start in range(0, len(ids), batch_size):
+                self.collection.delete(ids=ids[batch_start:batch_start + batch_size])
+            logger.debug("Deleted %d documents from the vector store collection '%s'.", len(ids), self.collection_name)
+        except Exception as e:
+            logger.error("Error deleting documents from the vector store collection '%s': %s", self.collection_name, e)
+            raise e
+
+class ShardedVectorStore:
+
+    # Write side of a namespace: one VectorStore per shard collection, chunks routed by id
+    def __init__(self, layout: NamespaceLayout, batch_size: int = 1024) -> None:
+        self.layout = layout
+        self.shards = [VectorStore(collection_name=collection_name,
+                                   persist_directory=layout.persist_directory,
+                                   batch_size=batch_size,
+                                   collection_metadata=layout.collection_metadata(shard))
+                       for shard, collection_name in enumerate(layout.collection_names())]
+
+    def add_documents(self, documents: list[Any], embeddings: np.ndarray) -> dict[str, float]:
+
+        if len(self.shards) == 1:
+            return self.shards[0].add_documents(documents=documents, embeddings=embeddings)
+
+        start_time = time.perf_counter()
+        embedding_matrix = np.ascontiguousarray(embeddings, dtype=np.float32)
+        rows_by_shard: dict[int, list[int]] = {}
+        for row, doc in enumerate(documents):
+            rows_by_shard.setdefault(self.layout.shard_of(doc['id']), []).append(row)
+
+        for shard, rows in rows_by_shard.items():
+            self.shards[shard].add_documents(documents=[documents[row] for row in rows], embeddings=embedding_matrix[rows])
+
+        elapsed_seconds = time.perf_counter() - start_time
+        rows_per_second = len(documents) / elapsed_seconds if elapsed_seconds > 0 else float(len(documents))
+        return {"rows": len(documents), "seconds": elapsed_seconds, "rows_per_second": rows_per_second}
+
+    def delete_documents(self, ids: list[str]) -> None:
+        ids_by_shard: dict[int, list[str]] = {}
+        for chunk_id in ids:
+            ids_by_shard.setdefault(self.layout.shard_of(chunk_id), []).append(chunk_id)
+        for shard, shard_ids in ids_by_shard.items():
+            self.shards[shard].delete_documents(shard_ids)
+
 #**********************************************************************************************************
 # This is only for the testing purpose of VectorStore class
 #**********************************************************************************************************
@@ -1,36 +1,244 @@
 
 from langchain_community.document_loaders import DirectoryLoader ,PyMuPDFLoader
-from typing import Any, Dict, List
+from typing import Any, Dict, Iterator, List, Tuple
+from functools import lru_cache
+from concurrent.futures import ProcessPoolExecutor
+from bisect import bisect_left, bisect_right
+import multiprocessing
+import threading
+import os
+import time
 
-def load_pdf():
+import numpy as np
+
+from Infrastructure.telemetry import record_stage
+from Utilities.tokenization import get_encoding
+
+# "recursive" is LangChain's RecursiveCharacterTextSplitter (the default), "token" cuts each page by token offsets in one pass
+CHUNKERS = ("recursive", "token")
+
+# Preferred cut points, best first, as in RecursiveCharacterTextSplitter
+_SEPARATORS = ("\n\n", "\n", " ")
+
+def load_pdf(upload_directory: str = "Uploads"):
     
     pdf_loader = DirectoryLoader(
-        "Uploads", 
+        upload_directory, 
         glob="*.pdf", 
         loader_cls=PyMuPDFLoader, 
         show_progress= False)
     pdf_documents = pdf_loader.load()
     return pdf_documents
 
+def load_pdf_file(file_path: str):
+
+    pdf_loader = PyMuPDFLoader(file_path)
+    pdf_documents = pdf_loader.load()
+    return pdf_documents
+
+@lru_cache(maxsize=8)
+def _get_text_splitter(model_name: str, chunk_size: int, chunk_size_overlap: int):
+    from langchain_text_splitters import RecursiveCharacterTextSplitter
+
+    # Building the splitter loads the tiktoken encoding, so do it once per settings
+    return RecursiveCharacterTextSplitter.from_tiktoken_encoder(model_name=model_name,
+                                                                chunk_size=chunk_size,
+                                                                chunk_overlap=chunk_size_overlap)
+
+# The byte length tables are shared by every thread chunking with the same encoding
+_token_byte_lengths_lock = threading.Lock()
+
+@lru_cache(maxsize=8)
+def _token_byte_lengths(encoding: Any) -> np.ndarray:
+    # Filled in as tokens are first seen, under _token_byte_lengths_lock; -1 is not looked up yet
+    return np.full(encoding.max_token_value + 1, -1, dtype=np.int64)
+
+def _token_byte_offsets(encoding: Any, tokens: List[int]) -> np.ndarray:
+    # Byte offset of every token in the decoded text, plus the end of the text
+    token_array = np.asarray(tokens, dtype=np.int64)
+    with _token_byte_lengths_lock:
+        lengths = _token_byte_lengths(encoding)
+        for token in np.unique(token_array[lengths[token_array] < 0]).tolist():
+            lengths[token] = len(encoding.decode_single_token_bytes(token))
+        token_lengths = lengths[token_array]
+    offsets = np.zeros(len(tokens) + 1, dtype=np.int64)
+    np.cumsum(token_lengths, out=offsets[1:])
+    return offsets
+
+def _find_all(data: np.ndarray, separator: bytes) -> np.ndarray:
+    # Start of every occurrence of separator, overlapping ones included
+    count = len(data) - len(separator) + 1
+    if count <= 0:
+        return np.zeros(0, dtype=np.int64)
+    matches = data[:count] == separator[0]
+    for i in range(1, len(separator)):
+        matches &= data[i:count + i] == separator[i]
+    return np.flatnonzero(matches)
+
+def _char_start(data: bytes, position: int) -> int:
+    # A token may end inside a multi-byte character; cut before that character instead
+    while 0 < position < len(data) and data[position] & 0xC0 == 0x80:
+        position -= 1
+    return position
+
+def split_text_by_tokens(text: str,
+                         encoding: Any,
+                         chunk_size: int = 400,
+                         chunk_size_overlap: int = 50,
+                         separators: Tuple[str, ...] = _SEPARATORS) -> List[str]:
+
+    # The text is tokenized once; chunks are windows of at most chunk_size tokens. A window ends at
+    # its last paragraph break, else its last line break, else its last space, else after chunk_size
+    # tokens. The next window starts up to chunk_size_overlap tokens earlier, on a break of the same
+    # kind, which is how RecursiveCharacterTextSplitter merges its splits and repeats the overlap.
+    tokens = encoding.encode_ordinary(text)
+    token_count = len(tokens)
+    if token_count == 0:
+        return []
+    data = encoding.decode_bytes(tokens)
+    offsets = _token_byte_offsets(encoding, tokens)
+
+    # Token indices a chunk may end at, per separator level; each level includes the better ones
+    byte_array = np.frombuffer(data, dtype=np.uint8)
+    breaks = []
+    indices = np.zeros(0, dtype=np.int64)
+    for separator in separators:
+        found = np.searchsorted(offsets, _find_all(byte_array, separator.encode("utf-8")), side="left")
+        indices = np.union1d(indices, found[(found > 0) & (found < token_count)])
+        breaks.append(indices.tolist())
+    offsets = offsets.tolist()
+
+    chunks = []
+    start = 0
+    while start < token_count:
+        limit = min(start + chunk_size, token_count)
+        end, level = limit, len(breaks)
+        if limit < token_count:
+            for level, level_breaks in enumerate(breaks):
+                candidate = bisect_right(level_breaks, limit) - 1
+                if candidate >= 0 and level_breaks[candidate] > start:
+                    end = level_breaks[candidate]
+                    break
+            else:
+                level = len(breaks)
+
+        chunk = data[_char_start(data, offsets[start]):_char_start(data, offsets[end])].decode("utf-8", errors="replace").strip()
+        if chunk:
+            chunks.append(chunk)
+        if end >= token_count:
+            break
+
+        next_start = end
+        if chunk_size_overlap > 0:
+            first = max(end - chunk_size_overlap, start + 1)
+            if level < len(breaks):
+                candidate = bisect_left(breaks[level], first)
+                if candidate < len(breaks[level]) and breaks[level][candidate] < end:
+                    next_start = breaks[level][candidate]
+            else:
+                next_start = first
+        start = next_start
+    return chunks
+
+def _split_documents_by_tokens(documents: Any, model_name: str, chunk_size: int,
+                               chunk_size_overlap: int) -> List[Tuple[str, Dict]]:
+    encoding = get_encoding(model_name)
+    return [(text, dict(doc.metadata))
+            for doc in documents
+            for text in split_text_by_tokens(doc.page_content, encoding, chunk_size, chunk_size_overlap)]
+
+def _page_number(metadata: Dict) -> int:
+    # Stored 1-based, the way users count pages; PyMuPDF's "page" is 0-based. -1 when unknown
+    if "page_number" in metadata:
+        return metadata["page_number"]
+    page = metadata.get("page")
+    return page + 1 if isinstance(page, int) else -1
+
 def genreate_pdf_chunks(documents: Any, 
                         model_name: str = "gpt-5", 
                         chunk_size: int = 400, 
-                        chunk_size_overlap: int=50) -> List[Dict]:
-    from langchain_text_splitters import RecursiveCharacterTextSplitter
+                        chunk_size_overlap: int=50,
+                        chunker: str | None = None) -> List[Dict]:
 
-    text_splitter = RecursiveCharacterTextSplitter.from_tiktoken_encoder(model_name=model_name,
-                                                                         chunk_size=chunk_size,
-                                                                         chunk_overlap=chunk_size_overlap)
-    
-    chunked_docs = text_splitter.split_documents(documents)
+    chunker = chunker or os.getenv("CHUNKER", "recursive")
+    if chunker == "token":
+        chunked_docs = _split_documents_by_tokens(documents, model_name, chunk_size, chunk_size_overlap)
+    elif chunker == "recursive":
+        text_splitter = _get_text_splitter(model_name, chunk_size, chunk_size_overlap)
+        chunked_docs = [(doc.page_content, doc.metadata) for doc in text_splitter.split_documents(documents)]
+    else:
+        raise ValueError(f"Unknown chunker '{chunker}', expected one of {', '.join(CHUNKERS)}")
 
     chuked_pdf = []
-    for i, doc in enumerate(chunked_docs):
+    for i, (text, metadata) in enumerate(chunked_docs):
         chuked_pdf.append({
             "id": f"chunk_{i}",
-            "text": doc.page_content.strip(),
-            "metadata": doc.metadata,
-            "source": doc.metadata.get("source", ""),
-            "page_number": doc.metadata.get("page_number", -1)
+            "text": text.strip(),
+            "metadata": metadata,
+            "source": metadata.get("source", ""),
+            "page_number": _page_number(metadata)
         })
-    return chuked_pdf
\ No newline at end of file
+    return chuked_pdf
+
+def chunk_pdf_file(file_path: str,
+                   model_name: str = "gpt-5",
+                   chunk_size: int = 400,
+                   chunk_size_overlap: int = 50,
+                   chunker: str | None = None) -> List[Dict]:
+    # Top-level so it can run in a worker process
+    return genreate_pdf_chunks(load_pdf_file(file_path),
+                               model_name=model_name,
+                               chunk_size=chunk_size,
+                               chunk_size_overlap=chunk_size_overlap,
+                               chunker=chunker)
+
+def _chunk_pdf_file_timed(file_path: str,
+                          model_name: str = "gpt-5",
+                          chunk_size: int = 400,
+                          chunk_size_overlap: int = 50,
+                          chunker: str | None = None) -> Tuple[List[Dict], float, float]:
+    # Worker-process metrics are lost with the worker, so the load and chunk times travel back with the chunks
+    start_time = time.perf_counter()
+    documents = load_pdf_file(file_path)
+    loaded_time = time.perf_counter()
+    chunks = genreate_pdf_chunks(documents, model_name=model_name, chunk_size=chunk_size,
+                                 chunk_size_overlap=chunk_size_overlap, chunker=chunker)
+    return chunks, loaded_time - start_time, time.perf_counter() - loaded_time
+
+def _record_chunked_file(result: Tuple[List[Dict], float, float]) -> List[Dict]:
+    chunks, load_seconds, chunk_seconds = result
+    record_stage("load", load_seconds, items=1)
+    record_stage("chunk", chunk_seconds, items=len(chunks))
+    return chunks
+
+def iter_pdf_chunks_parallel(file_paths: List[str],
+                             model_name: str = "gpt-5",
+                             chunk_size: int = 400,
+                             chunk_size_overlap: int = 50,
+                             max_workers: int | None = None,
+                             chunker: str | None = None) -> Iterator[Tuple[str, List[Dict]]]:
+
+    # Parses and chunks PDFs across a process pool and yields (file_path, chunks) in input order.
+    # At most two files per worker are in flight, so memory stays bounded however many files there are.
+    max_workers = max(1, min(max_workers or os.cpu_count() or 1, len(file_paths)))
+
+    if max_workers == 1:
+        for file_path in file_paths:
+            yield file_path, _record_chunked_file(_chunk_pdf_file_timed(file_path, model_name, chunk_size, chunk_size_overlap, chunker))
+        return
+
+    # spawn keeps workers clear of the threads (Streamlit, torch) of the parent process
+    with ProcessPoolExecutor(max_workers=max_workers, mp_context=multiprocessing.get_context("spawn")) as executor:
+        pending = []
+        remaining = iter(file_paths)
+        for file_path in remaining:
+            pending.append((file_path, executor.submit(_chunk_pdf_file_timed, file_path, model_name, chunk_size, chunk_size_overlap, chunker)))
+            if len(pending) >= 2 * max_workers:
+                break
+
+        while len(pending) > 0:
+            file_path, future = pending.pop(0)
+            next_path = next(remaining, None)
+            if next_path is not None:
+                pending.append((next_path, executor.submit(_chunk_pdf_file_timed, next_path, model_name, chunk_size, chunk_size_overlap, chunker)))
+            yield file_path, _record_chunked_file(future.result())
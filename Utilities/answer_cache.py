@@ -0,0 +1,98 @@
+import time
+import threading
+from typing import Any
+
+import numpy as np
+
+class SemanticAnswerCache:
+
+    def __init__(self,
+                 similarity_threshold: float = 0.92,
+                 ttl_seconds: float = 3600.0,
+                 max_entries: int = 1000) -> None:
+        self.similarity_threshold = similarity_threshold
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self.counters = {"hits": 0, "misses": 0, "stale": 0, "evictions": 0, "invalidations": 0}
+        self._entries: list[dict[str, Any]] = []
+        self._matrix: np.ndarray | None = None
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _normalize(vector: np.ndarray) -> np.ndarray:
+        vector = np.asarray(vector, dtype=np.float32).ravel()
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm > 0 else vector
+
+    def _expire(self, now: float) -> None:
+        # Caller holds the lock
+        live_entries = [entry for entry in self._entries if now - entry["created_at"] <= self.ttl_seconds]
+        if len(live_entries) != len(self._entries):
+            self.counters["evictions"] += len(self._entries) - len(live_entries)
+            self._entries = live_entries
+            self._matrix = None
+
+    def _query_matrix(self) -> np.ndarray:
+        # Caller holds the lock; stacked lazily so inserts stay cheap
+        if self._matrix is None:
+            self._matrix = np.vstack([entry["query_vector"] for entry in self._entries])
+        return self._matrix
+
+    def lookup(self, query_vector: np.ndarray, chunk_ids: list[str], model_name: str = "") -> str | None:
+
+        with self._lock:
+            self._expire(time.time())
+            if len(self._entries) == 0:
+                self.counters["misses"] += 1
+                return None
+
+            similarities = self._query_matrix() @ self._normalize(query_vector)
+            candidate_ids = frozenset(chunk_ids)
+
+            # Best match first; an answer is only reused if it was built from the same chunks
+            for index in np.argsort(-similarities):
+                if similarities[index] < self.similarity_threshold:
+                    break
+                entry = self._entries[index]
+                if entry["model_name"] == model_name and entry["chunk_ids"] == candidate_ids:
+                    entry["last_access"] = time.time()
+                    self.counters["hits"] += 1
+                    return entry["answer"]
+                self.counters["stale"] += 1
+
+            self.counters["misses"] += 1
+            return None
+
+    def store(self, query_vector: np.ndarray, chunk_ids: list[str], answer: str, model_name: str = "") -> None:
+
+        if not answer:
+            return
+
+        with self._lock:
+            now = time.time()
+            self._expire(now)
+            self._entries.append({
+                "query_vector": self._normalize(query_vector),
+                "chunk_ids": frozenset(chunk_ids),
+                "model_name": model_name,
+                "answer": answer,
+                "created_at": now,
+                "last_access": now
+            })
+            self._matrix = None
+
+            if len(self._entries) > self.max_entries:
+                # Drop the least recently used answers
+                self._entries.sort(key=lambda entry: entry["last_access"], reverse=True)
+                self.counters["evictions"] += len(self._entries) - self.max_entries
+                del self._entries[self.max_entries:]
+
+    def invalidate(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self._matrix = None
+            self.counters["invalidations"] += 1
+
+    def stats(self) -> dict[str, Any]:
+        with self._lock:
+            return {**self.counters, "entries": len(self._entries)}
@@ -0,0 +1,159 @@
+import os
+import time
+import logging
+import sqlite3
+import hashlib
+import threading
+import unicodedata
+from collections import OrderedDict
+from typing import Any
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+class EmbeddingCache:
+
+    def __init__(self,
+                 cache_path: str = "data/embedding_cache/embeddings.sqlite3",
+                 memory_budget_bytes: int = 64 * 1024 * 1024,
+                 max_disk_entries: int = 1_000_000) -> None:
+        self.cache_path = cache_path
+        self.memory_budget_bytes = memory_budget_bytes
+        self.max_disk_entries = max_disk_entries
+        self.memory_bytes = 0
+        self._writes_since_prune = 0
+        self.counters = {"memory_hits": 0, "disk_hits": 0, "misses": 0, "evictions": 0}
+        self._memory: OrderedDict[str, np.ndarray] = OrderedDict()
+        self._lock = threading.Lock()
+        self._connection = None
+        self._initialize_disk_store()
+
+    def _initialize_disk_store(self) -> None:
+        try:
+            if not self.cache_path:
+                return
+
+            os.makedirs(os.path.dirname(self.cache_path) or ".", exist_ok=True)
+            self._connection = sqlite3.connect(self.cache_path, check_same_thread=False)
+            self._connection.execute("PRAGMA journal_mode=WAL")
+            self._connection.execute("PRAGMA synchronous=NORMAL")
+            self._connection.execute(
+                "CREATE TABLE IF NOT EXISTS embeddings ("
+                "key TEXT PRIMARY KEY, dim INTEGER NOT NULL, vector BLOB NOT NULL, last_access REAL NOT NULL)")
+            self._connection.commit()
+        except Exception as e:
+            # The in-memory tier still works without the disk store
+            logger.warning("Error opening embedding cache '%s', using memory only: %s", self.cache_path, e)
+            self._connection = None
+
+    @staticmethod
+    def make_key(model_name: str, text: str) -> str:
+        normalized_text = " ".join(unicodedata.normalize("NFC", text).split())
+        return hashlib.sha256(f"{model_name}\x00{normalized_text}".encode("utf-8")).hexdigest()
+
+    def _remember(self, key: str, vector: np.ndarray) -> None:
+        # Caller holds the lock
+        if key in self._memory:
+            self._memory.move_to_end(key)
+            return
+
+        self._memory[key] = vector
+        self.memory_bytes += vector.nbytes
+        while self.memory_bytes > self.memory_budget_bytes and len(self._memory) > 1:
+            _, evicted = self._memory.popitem(last=False)
+            self.memory_bytes -= evicted.nbytes
+            self.counters["evictions"] += 1
+
+    def get_many(self, model_name: str, texts: list[str]) -> list[np.ndarray | None]:
+
+        keys = [self.make_key(model_name, text) for text in texts]
+        found: list[np.ndarray | None] = [None] * len(keys)
+        disk_lookup: dict[str, list[int]] = {}
+
+        with self._lock:
+            for i, key in enumerate(keys):
+                vector = self._memory.get(key)
+                if vector is not None:
+                    self._memory.move_to_end(key)
+                    found[i] = vector
+                    self.counters["memory_hits"] += 1
+                else:
+                    disk_lookup.setdefault(key, []).append(i)
+
+            if self._connection is not None and len(disk_lookup) > 0:
+                lookup_keys = list(disk_lookup)
+                now = time.time()
+                for batch_start in range(0, len(lookup_keys), 500):
+                    batch_keys = lookup_keys[batch_start:batch_start + 500]
+                    placeholders = ",".join("?" * len(batch_keys))
+                    rows = self._connection.execute(
+                        f"SELECT key, vector FROM embeddings WHERE key IN ({placeholders})", batch_keys).fetchall()
+                    for key, blob in rows:
+                        vector = np.frombuffer(blob, dtype=np.float32)
+                        self._remember(key, vector)
+                        for i in disk_lookup.pop(key):
+                            found[i] = vector
+                            self.counters["disk_hits"] += 1
+                    if len(rows) > 0:
+                        self._connection.executemany("UPDATE embeddings SET last_access = ? WHERE key = ?",
+                                                     [(now, key) for key, _ in rows])
+                if self._connection.in_transaction:
+                    self._connection.commit()
+
+            self.counters["misses"] += sum(len(indexes) for indexes in disk_lookup.values())
+
+        return found
+
+    def put_many(self, model_name: str, texts: list[str], embeddings: np.ndarray) -> None:
+
+        rows = []
+        now = time.time()
+        with self._lock:
+            for text, embedding in zip(texts, embeddings):
+                key = self.make_key(model_name, text)
+                vector = np.array(embedding, dtype=np.float32).ravel()
+                vector.setflags(write=False)
+                self._remember(key, vector)
+                rows.append((key, vector.shape[0], vector.tobytes(), now))
+
+            if self._connection is not None and len(rows) > 0:
+                try:
+                    self._connection.executemany(
+                        "INSERT OR REPLACE INTO embeddings (key, dim, vector, last_access) VALUES (?, ?, ?, ?)", rows)
+                    self._writes_since_prune += 1
+                    if self._writes_since_prune >= 50:
+                        self._prune_disk_store()
+                        self._writes_since_prune = 0
+                    self._connection.commit()
+                except Exception as e:
+                    logger.error("Error writing to embedding cache '%s': %s", self.cache_path, e)
+                    self._connection.rollback()
+
+    def _prune_disk_store(self) -> None:
+        # Caller holds the lock; drops the least recently used rows beyond max_disk_entries
+        (row_count,) = self._connection.execute("SELECT COUNT(*) FROM embeddings").fetchone()
+        if row_count > self.max_disk_entries:
+            self._connection.execute(
+                "DELETE FROM embeddings WHERE key IN (SELECT key FROM embeddings ORDER BY last_access ASC LIMIT ?)",
+                (row_count - self.max_disk_entries,))
+
+    def stats(self) -> dict[str, Any]:
+        with self._lock:
+            hits = self.counters["memory_hits"] + self.counters["disk_hits"]
+            lookups = hits + self.counters["misses"]
+            return {
+                **self.counters,
+                "hits": hits,
+                "hit_rate": hits / lookups if lookups > 0 else 0.0,
+                "memory_entries": len(self._memory),
+                "memory_bytes": self.memory_bytes
+            }
+
+    def clear(self) -> None:
+        with self._lock:
+            self._memory.clear()
+            self.memory_bytes = 0
+            if self._connection is not None:
+                self._connection.execute("DELETE FROM embeddings")
+                self._connection.commit()
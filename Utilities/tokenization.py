@@ -0,0 +1,12 @@
+from functools import lru_cache
+
+@lru_cache(maxsize=None)
+def get_encoding(model_name: str):
+
+    import tiktoken
+
+    try:
+        return tiktoken.encoding_for_model(model_name)
+    except KeyError:
+        # Newer model names than the installed tiktoken knows about use the current encoding
+        return tiktoken.get_encoding("o200k_base")
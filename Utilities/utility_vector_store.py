@@ -1,5 +1,12 @@
-import os
-import chromadb
+import logging
+from typing import TYPE_CHECKING
+
+from Infrastructure.resource_registry import get_registry
+
+if TYPE_CHECKING:
+    import chromadb
+
+logger = logging.getLogger(__name__)
 
 class UtilityVectorStore:
     def __init__(self, collection_name: str, persist_directory: str):
@@ -7,20 +14,28 @@ class UtilityVectorStore:
         self.persist_directory = persist_directory
         self.chroma_client = None
 
-    def get_vector_collection(self) -> chromadb.Collection:
+    def get_vector_collection(self) -> "chromadb.Collection":
         try:
 
-            os.makedirs(self.persist_directory, exist_ok=True) # check if the directory exists, if not create it
-
-            # Initialize Chroma client
-            chroma_client = chromadb.PersistentClient(path=self.persist_directory)
-            
-            # Create or get collection
-            vector_collection = chroma_client.get_collection(
-                    name=self.collection_name,
+            # Shared Chroma client and collection handle, created once per process
+            registry = get_registry()
+            self.chroma_client = registry.get_chroma_client(self.persist_directory)
+            vector_collection = registry.get_vector_collection(
+                    collection_name=self.collection_name,
+                    persist_directory=self.persist_directory,
                 )
 
             return vector_collection
         except Exception as e:
-            print(f"Error getting collection '{self.collection_name}': {e}")
-            raise e
\ No newline at end of file
+            logger.error("Error getting collection '%s': %s", self.collection_name, e)
+            raise e
+
+    def get_vector_index(self):
+        try:
+
+            # Chroma or the in-process index, depending on VECTOR_INDEX_BACKEND
+            return get_registry().get_vector_index(collection_name=self.collection_name,
+                                                   persist_directory=self.persist_directory)
+        except Exception as e:
+            logger.error("Error getting vector index for '%s': %s", self.collection_name, e)
+            raise e
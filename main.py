@@ -20,5 +20,37 @@ def run_streamlit_app():
     except subprocess.CalledProcessError as e:
         print(f"An error occurred while running the Streamlit app: {e}")
 
+def run_query_service():
+    # Asyncio HTTP API around retrieval and generation, see Services/QueryService.py
+    from Services.QueryService import run_query_service as run_service
+    run_service()
+
+def run_benchmarks():
+    # Offline ingestion and query benchmark, see Benchmarks/run_benchmarks.py
+    from Benchmarks.run_benchmarks import main as run_benchmark_suite
+    run_benchmark_suite(sys.argv[2:])
+
+def run_batch():
+    # Bulk question answering from a file to JSONL, see Services/BatchQuestionAnswering.py
+    from Services.BatchQuestionAnswering import main as run_batch_questions
+    run_batch_questions(sys.argv[2:])
+
+def run_ingestion_worker():
+    # Standalone ingestion worker for INGESTION_EXTERNAL_WORKERS=true, see Services/IngestionJobQueue.py
+    import os
+    from Services.IngestionJobQueue import run_worker, worker_options_from_env
+    run_worker(os.getenv("INGESTION_JOBS_PATH", "data/jobs/ingestion_jobs.sqlite3"),
+               max_running_jobs=int(os.getenv("INGESTION_MAX_CONCURRENT_JOBS", "1")),
+               **worker_options_from_env())
+
 if __name__ == "__main__":
-    run_streamlit_app()
+    if len(sys.argv) > 1 and sys.argv[1] == "api":
+        run_query_service()
+    elif len(sys.argv) > 1 and sys.argv[1] == "benchmark":
+        run_benchmarks()
+    elif len(sys.argv) > 1 and sys.argv[1] == "batch":
+        run_batch()
+    elif len(sys.argv) > 1 and sys.argv[1] == "ingest-worker":
+        run_ingestion_worker()
+    else:
+        run_streamlit_app()
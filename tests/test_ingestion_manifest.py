@@ -0,0 +1,36 @@
+import os
+import tempfile
+import unittest
+
+from Services.IngestionManifest import IngestionManifest
+
+class IdenticalFilesTest(unittest.TestCase):
+
+    def test_identical_files_do_not_share_chunk_ids(self):
+        with tempfile.TemporaryDirectory() as directory:
+            paths = [os.path.join(directory, name) for name in ("a.pdf", "b.pdf")]
+            for path in paths:
+                with open(path, "wb") as pdf_file:
+                    pdf_file.write(b"%PDF-1.4 same bytes")
+
+            content_hashes = [IngestionManifest.hash_file(path) for path in paths]
+            self.assertEqual(content_hashes[0], content_hashes[1])
+
+            settings_key = IngestionManifest.settings_key({"chunk_size": 400})
+            manifest = IngestionManifest(os.path.join(directory, "manifest.json"))
+            for path, content_hash in zip(paths, content_hashes):
+                manifest.record(path, content_hash, settings_key,
+                                [IngestionManifest.chunk_id(path, content_hash, settings_key, i) for i in range(3)])
+
+            # Removing a.pdf deletes exactly its ids, none of which belong to b.pdf
+            self.assertEqual(set(manifest.chunk_ids(paths[0])) & set(manifest.chunk_ids(paths[1])), set())
+            manifest.remove(paths[0])
+            self.assertTrue(manifest.is_current(paths[1], content_hashes[1], settings_key))
+            self.assertEqual(len(manifest.chunk_ids(paths[1])), 3)
+
+    def test_chunk_ids_are_deterministic(self):
+        self.assertEqual(IngestionManifest.chunk_id("Uploads/a.pdf", "ab" * 32, "settings", 0),
+                         IngestionManifest.chunk_id("Uploads/a.pdf", "ab" * 32, "settings", 0))
+
+if __name__ == "__main__":
+    unittest.main()
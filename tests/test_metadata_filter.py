@@ -0,0 +1,59 @@
+import tempfile
+import unittest
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+try:
+    import chromadb
+except ImportError:
+    chromadb = None
+
+if np is not None:
+    from Services.MetadataFilter import build_where, where_mask
+
+# One chunk per page of a five page file, as PyMuPDF's loader numbers them (0-based "page")
+LOADER_PAGES = [0, 1, 2, 3, 4]
+
+@unittest.skipIf(np is None, "numpy is required")
+class PageRangeTest(unittest.TestCase):
+
+    def setUp(self):
+        # page_number is stored 1-based, see summarizer._page_number
+        self.metadatas = [{"source": "a.pdf", "page_number": page + 1} for page in LOADER_PAGES]
+        self.where = build_where(page_range=(2, 3))
+
+    def selected_pages(self, where):
+        def column(name):
+            values = np.empty(len(self.metadatas), dtype=object)
+            values[:] = [metadata.get(name) for metadata in self.metadatas]
+            return values
+        mask = where_mask(where, column, len(self.metadatas))
+        return [metadata["page_number"] for metadata, keep in zip(self.metadatas, mask) if keep]
+
+    def test_page_range_is_inclusive_and_one_based(self):
+        self.assertEqual(self.selected_pages(self.where), [2, 3])
+
+    def test_page_range_combines_with_sources(self):
+        self.assertEqual(self.selected_pages(build_where(sources=["a.pdf"], page_range=(2, 3))), [2, 3])
+        self.assertEqual(self.selected_pages(build_where(sources=["b.pdf"], page_range=(2, 3))), [])
+
+    @unittest.skipIf(chromadb is None, "chromadb is required")
+    def test_matches_chroma(self):
+        with tempfile.TemporaryDirectory() as directory:
+            client = chromadb.PersistentClient(path=directory)
+            try:
+                collection = client.create_collection(name="pdf_documents")
+                collection.add(ids=[f"page_{metadata['page_number']}" for metadata in self.metadatas],
+                               embeddings=np.eye(len(self.metadatas), dtype=np.float32),
+                               metadatas=self.metadatas)
+                found = collection.get(where=self.where, include=["metadatas"])
+                self.assertEqual(sorted(metadata["page_number"] for metadata in found["metadatas"]),
+                                 self.selected_pages(self.where))
+            finally:
+                client._system.stop()
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,76 @@
+import unittest
+
+try:
+    import tiktoken
+    from Services.summarizer import split_text_by_tokens
+except ImportError:
+    tiktoken = None
+
+def _test_encoding():
+    # A small byte-level BPE built here, so the test needs no download: every byte is a token, plus
+    # a few merges so tokens span several bytes. Digits never merge, one digit is one token.
+    ranks = {bytes([byte]): byte for byte in range(256)}
+    for merged in (b"th", b"he", b"in", b"an", b" t", b" a", b"the", b" the", b"ing", b"\n\n"):
+        ranks[merged] = len(ranks)
+    return tiktoken.Encoding(name="test_bpe", pat_str=r"""'s|'t| ?\p{L}+| ?\p{N}+| ?[^\s\p{L}\p{N}]+|\s+(?!\S)|\s+""",
+                             mergeable_ranks=ranks, special_tokens={})
+
+PAGE = "\n\n".join(
+    "\n".join(" ".join(f"the{word % 7}ing an{line} café ☃" for word in range(paragraph + line, paragraph + line + 9))
+              for line in range(4))
+    for paragraph in range(6))
+
+@unittest.skipIf(tiktoken is None, "tiktoken and the PDF chunking dependencies are required")
+class TokenChunkerTest(unittest.TestCase):
+
+    def setUp(self):
+        self.encoding = _test_encoding()
+
+    def spans(self, text, chunks):
+        # Chunks come in order and are stripped substrings of the text
+        spans, cursor = [], 0
+        for chunk in chunks:
+            start = text.find(chunk, cursor)
+            self.assertGreaterEqual(start, 0, f"chunk not found in order: {chunk!r}")
+            spans.append((start, start + len(chunk)))
+            cursor = start + 1
+        return spans
+
+    def test_chunks_fit_the_token_budget(self):
+        for chunk_size, chunk_size_overlap in ((40, 10), (64, 0), (17, 5)):
+            chunks = split_text_by_tokens(PAGE, self.encoding, chunk_size, chunk_size_overlap)
+            self.assertGreater(len(chunks), 1)
+            for chunk in chunks:
+                self.assertLessEqual(len(self.encoding.encode_ordinary(chunk)), chunk_size)
+
+    def test_overlap_without_breaks_is_exactly_chunk_size_overlap_tokens(self):
+        # No separator to cut at: windows of chunk_size tokens, each starting chunk_size_overlap tokens early
+        text = "0123456789" * 30
+        chunks = split_text_by_tokens(text, self.encoding, chunk_size=40, chunk_size_overlap=10)
+        self.assertTrue(all(len(chunk) == 40 for chunk in chunks[:-1]))
+        for previous, current in zip(chunks, chunks[1:]):
+            self.assertEqual(previous[-10:], current[:10])
+        self.assertEqual(chunks[0] + "".join(chunk[10:] for chunk in chunks[1:]), text)
+
+    def test_overlap_on_breaks_is_at_most_chunk_size_overlap_tokens(self):
+        chunks = split_text_by_tokens(PAGE, self.encoding, chunk_size=40, chunk_size_overlap=10)
+        spans = self.spans(PAGE, chunks)
+        overlapping = 0
+        for (_, previous_end), (start, _) in zip(spans, spans[1:]):
+            if start < previous_end:
+                overlapping += 1
+                self.assertLessEqual(len(self.encoding.encode_ordinary(PAGE[start:previous_end])), 10)
+        self.assertGreater(overlapping, 0)
+
+    def test_chunks_without_overlaps_reproduce_the_page(self):
+        for chunk_size_overlap in (0, 10):
+            chunks = split_text_by_tokens(PAGE, self.encoding, chunk_size=40, chunk_size_overlap=chunk_size_overlap)
+            spans = self.spans(PAGE, chunks)
+            pieces = [PAGE[spans[0][0]:spans[0][1]]]
+            for (_, previous_end), (start, end) in zip(spans, spans[1:]):
+                pieces.append(PAGE[max(start, previous_end):end])
+            # Chunks are stripped, so only the whitespace at the cuts may be missing
+            self.assertEqual("".join("".join(pieces).split()), "".join(PAGE.split()))
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,80 @@
+import os
+import json
+import tempfile
+import unittest
+
+try:
+    import numpy as np
+    import chromadb
+except ImportError:
+    np = None
+    chromadb = None
+
+if np is not None:
+    from Services.VectorIndex import ChromaVectorIndex, LocalVectorIndex
+
+@unittest.skipIf(chromadb is None, "numpy and chromadb are required")
+class LocalVectorIndexMatchesChromaTest(unittest.TestCase):
+
+    # A few hundred vectors: Chroma's HNSW search is exhaustive in practice at this size, so the
+    # exact float32 local search has to return the same ids and distances
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.rng = np.random.default_rng(0)
+        self.client = chromadb.PersistentClient(path=f"{self.directory.name}/chroma")
+        self.collection = self.client.create_collection(name="pdf_documents")
+        self.index_directory = f"{self.directory.name}/local_index"
+        self.add(300, "a")
+
+    def tearDown(self):
+        self.client._system.stop()
+        self.directory.cleanup()
+
+    def add(self, count: int, source: str) -> list[str]:
+        ids = [f"{source}_{i}" for i in range(count)]
+        self.collection.add(ids=ids, embeddings=self.rng.normal(size=(count, 16)).astype(np.float32),
+                            documents=[f"text of {chunk_id}" for chunk_id in ids],
+                            metadatas=[{"source": source, "page_number": i % 7 + 1} for i in range(count)])
+        return ids
+
+    def assert_same_results(self, local_index, where=None):
+        queries = self.rng.normal(size=(8, 16)).astype(np.float32)
+        expected = ChromaVectorIndex(self.collection).query(queries, n_results=10, where=where)
+        found = local_index.query(queries, n_results=10, where=where)
+        self.assertEqual(found["ids"], expected["ids"])
+        self.assertEqual(found["documents"], expected["documents"])
+        self.assertEqual(found["metadatas"], expected["metadatas"])
+        for found_distances, expected_distances in zip(found["distances"], expected["distances"]):
+            np.testing.assert_allclose(found_distances, expected_distances, rtol=1e-4, atol=1e-4)
+
+    def test_exact_search_matches_chroma(self):
+        LocalVectorIndex.build_from_collection(self.collection, self.index_directory)
+        local_index = LocalVectorIndex(self.index_directory, search_mode="exact", search_dtype="float32")
+        self.assertEqual(local_index.count(), self.collection.count())
+        self.assert_same_results(local_index)
+        self.assert_same_results(local_index, where={"page_number": {"$lte": 3}})
+
+    def test_updates_match_chroma(self):
+        LocalVectorIndex.build_from_collection(self.collection, self.index_directory)
+        local_index = LocalVectorIndex(self.index_directory, search_mode="exact", search_dtype="float32")
+
+        # One ingest adds a file's chunks and deletes a few others; a replaced id moves to a new vector
+        added_ids = self.add(40, "b")
+        deleted_ids = ["a_1", "a_2", "a_3"]
+        self.collection.delete(ids=deleted_ids)
+        self.collection.upsert(ids=["a_10"], embeddings=np.zeros((1, 16), dtype=np.float32),
+                               documents=["replaced"], metadatas=[{"source": "a", "page_number": 4}])
+        LocalVectorIndex.update_from_collection(self.collection, self.index_directory,
+                                                added_ids=added_ids + ["a_10"], deleted_ids=deleted_ids)
+
+        # Applied as a new segment, not by exporting the collection again
+        with open(os.path.join(self.index_directory, "index.json"), "r", encoding="utf-8") as index_file:
+            self.assertEqual(len(json.load(index_file)["segments"]), 2)
+        self.assertEqual(local_index.count(), self.collection.count())
+        self.assert_same_results(local_index)
+        self.assert_same_results(local_index, where={"source": "b"})
+        self.assertEqual(local_index.get(deleted_ids)["ids"], [])
+        self.assertEqual(local_index.get(["a_10"])["documents"], ["replaced"])
+
+if __name__ == "__main__":
+    unittest.main()